@@ -0,0 +1,153 @@
+"""
+Emotion rollups: per-user, per-day and per-week counts and intensity sums
+for each emotion, kept current by triggers on emotional_pattern, so reading
+a window touches one row per period and emotion however long the history is.
+Rows written by the write-behind queue are counted the same way.
+"""
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+PERIOD_DAYS = {'day': 1, 'week': 7}
+WINDOW_PATTERN = re.compile(r'^(\d{1,3})([dw])$')
+MAX_WINDOW_DAYS = 366
+# Contributions older than this many half-lives are below 2% and left out of the mood score
+MOOD_HORIZON_HALF_LIVES = 6
+
+_UPSERT = ("ON CONFLICT (user_id, period, period_start, emotion) DO UPDATE SET "
+           "count = emotion_rollup.count + excluded.count, "
+           "intensity_sum = emotion_rollup.intensity_sum + excluded.intensity_sum")
+
+SQLITE_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS emotion_rollup_insert AFTER INSERT ON emotional_pattern BEGIN "
+    "INSERT INTO emotion_rollup (user_id, period, period_start, emotion, count, intensity_sum) VALUES "
+    "(new.user_id, 'day', date(new.timestamp), new.emotion, 1, coalesce(new.intensity, 1.0)), "
+    "(new.user_id, 'week', date(new.timestamp, '-6 days', 'weekday 1'), new.emotion, 1, "
+    f"coalesce(new.intensity, 1.0)) {_UPSERT}; END",
+    "CREATE TRIGGER IF NOT EXISTS emotion_rollup_delete AFTER DELETE ON emotional_pattern BEGIN "
+    "UPDATE emotion_rollup SET count = count - 1, intensity_sum = intensity_sum - coalesce(old.intensity, 1.0) "
+    "WHERE user_id = old.user_id AND emotion = old.emotion AND ("
+    "(period = 'day' AND period_start = date(old.timestamp)) OR "
+    "(period = 'week' AND period_start = date(old.timestamp, '-6 days', 'weekday 1'))); END",
+]
+
+POSTGRES_TRIGGERS = [
+    "CREATE OR REPLACE FUNCTION emotion_rollup_apply() RETURNS trigger AS $$ BEGIN "
+    "IF TG_OP = 'INSERT' THEN "
+    "INSERT INTO emotion_rollup (user_id, period, period_start, emotion, count, intensity_sum) VALUES "
+    "(NEW.user_id, 'day', NEW.timestamp::date, NEW.emotion, 1, coalesce(NEW.intensity, 1.0)), "
+    "(NEW.user_id, 'week', date_trunc('week', NEW.timestamp)::date, NEW.emotion, 1, coalesce(NEW.intensity, 1.0)) "
+    f"{_UPSERT}; RETURN NEW; "
+    "ELSE "
+    "UPDATE emotion_rollup SET count = count - 1, intensity_sum = intensity_sum - coalesce(OLD.intensity, 1.0) "
+    "WHERE user_id = OLD.user_id AND emotion = OLD.emotion AND ("
+    "(period = 'day' AND period_start = OLD.timestamp::date) OR "
+    "(period = 'week' AND period_start = date_trunc('week', OLD.timestamp)::date)); RETURN OLD; "
+    "END IF; END $$ LANGUAGE plpgsql",
+    "DROP TRIGGER IF EXISTS emotion_rollup_apply ON emotional_pattern",
+    "CREATE TRIGGER emotion_rollup_apply AFTER INSERT OR DELETE ON emotional_pattern "
+    "FOR EACH ROW EXECUTE FUNCTION emotion_rollup_apply()",
+]
+
+# Period start expressions for the one-off backfill of existing rows
+BACKFILL_PERIODS = {
+    'sqlite': {'day': "date(timestamp)", 'week': "date(timestamp, '-6 days', 'weekday 1')"},
+    'postgresql': {'day': "timestamp::date", 'week': "date_trunc('week', timestamp)::date"},
+}
+
+
+def install_emotion_rollups(engine):
+    """Create the rollup triggers, and roll up existing emotion rows if the table is empty"""
+    dialect = engine.dialect.name
+    if dialect not in BACKFILL_PERIODS:
+        return
+    with engine.begin() as connection:
+        empty = connection.execute(text("SELECT 1 FROM emotion_rollup LIMIT 1")).first() is None
+        if empty:
+            for period, start in BACKFILL_PERIODS[dialect].items():
+                connection.execute(text(
+                    "INSERT INTO emotion_rollup (user_id, period, period_start, emotion, count, intensity_sum) "
+                    f"SELECT user_id, '{period}', {start}, emotion, COUNT(*), SUM(coalesce(intensity, 1.0)) "
+                    f"FROM emotional_pattern GROUP BY user_id, {start}, emotion"
+                ))
+        for statement in SQLITE_TRIGGERS if dialect == 'sqlite' else POSTGRES_TRIGGERS:
+            connection.execute(text(statement))
+
+
+def parse_window(value):
+    """'14d' -> ('day', 14), '8w' -> ('week', 8); raises ValueError"""
+    match = WINDOW_PATTERN.match(value or '')
+    if not match:
+        raise ValueError("window must look like 7d or 4w")
+    periods, unit = int(match.group(1)), match.group(2)
+    period = 'day' if unit == 'd' else 'week'
+    if not 1 <= periods * PERIOD_DAYS[period] <= MAX_WINDOW_DAYS:
+        raise ValueError(f"window must cover 1 to {MAX_WINDOW_DAYS} days")
+    return period, periods
+
+
+def window_start(period, periods, today):
+    """First day of the oldest period in the window (weeks start on Monday)"""
+    if period == 'week':
+        return today - timedelta(days=today.weekday()) - timedelta(weeks=periods - 1)
+    return today - timedelta(days=periods - 1)
+
+
+def mood_start(half_life, today):
+    return today - timedelta(days=int(half_life * MOOD_HORIZON_HALF_LIVES))
+
+
+def decayed_mood(day_rows, half_life, today):
+    """
+    Exponentially decayed intensity per emotion from daily rollups: a day's
+    intensity counts half as much every `half_life` days. Returns the leading
+    emotion and each emotion's share of the total.
+    """
+    scores = {}
+    for row in day_rows:
+        weight = 0.5 ** ((today - row.period_start).days / half_life)
+        scores[row.emotion] = scores.get(row.emotion, 0.0) + row.intensity_sum * weight
+    total = sum(score for score in scores.values() if score > 0)
+    if not total:
+        return {'current': 'neutral', 'half_life_days': half_life, 'scores': {}}
+    shares = {emotion: round(score / total, 4)
+              for emotion, score in sorted(scores.items(), key=lambda item: -item[1]) if score > 0}
+    return {'current': next(iter(shares)), 'half_life_days': half_life, 'scores': shares}
+
+
+def emotion_summary(rows, period, periods, today, mood):
+    """Totals, per-period series and dominant emotion for one window of rollup rows"""
+    totals = {}
+    series = {}
+    for row in rows:
+        if row.count <= 0:
+            continue
+        count, intensity = totals.get(row.emotion, (0, 0.0))
+        totals[row.emotion] = (count + row.count, intensity + row.intensity_sum)
+        series.setdefault(row.period_start, {})[row.emotion] = row.count
+
+    total = sum(count for count, _ in totals.values())
+    emotions = [{
+        'emotion': emotion,
+        'count': count,
+        'share': round(count / total, 4),
+        'avg_intensity': round(intensity / count, 3)
+    } for emotion, (count, intensity) in sorted(totals.items(), key=lambda item: (-item[1][0], item[0]))]
+
+    return {
+        'window': f"{periods}{period[0]}",
+        'period': period,
+        'from': window_start(period, periods, today).isoformat(),
+        'to': today.isoformat(),
+        'total': total,
+        'dominant_emotion': emotions[0]['emotion'] if emotions else None,
+        'emotions': emotions,
+        'series': [{'period_start': start.isoformat(), 'counts': counts} for start, counts in sorted(series.items())],
+        'mood': mood
+    }
+
+
+def utc_today():
+    """Rollups bucket by the UTC date of the stored (utcnow) timestamps"""
+    return datetime.utcnow().date()
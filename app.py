@@ -1,15 +1,39 @@
 import os
 import json
 import logging
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify
+import click
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-import openai
-import random
+from werkzeug.serving import is_running_from_reloader
+
+from llm_client import get_llm_pool
+from context_builder import ContextBuilder, TokenCounter, fallback_summary, summary_messages
+from memory_index import MemoryIndex
+from cache import TTLCache, conditional_json
+from fulltext import install_fulltext, search_conversations
+from analytics import (
+    decayed_mood, emotion_summary, install_emotion_rollups, mood_start, parse_window, utc_today, window_start
+)
+from write_behind import WriteBehindQueue
+from thoughts import ThoughtWorker, backfill_delivered
+from phrasebook import LINES_PER_PROMPT, Phrasebook, pregenerate
+from instrumentation import Instrumentation
+from db_utils import (
+    add_missing_columns, apply_indexes, increment_counter, iter_keyset, keyset_query, parse_page_args,
+    SQLITE_PRAGMAS, backfill_by_timestamp, get_or_create, print_query_plans, reconcile_counter, row_to_dict, track_version
+)
+from sharding import (
+    DEFAULT_USER_ID, USER_ID_PATTERN, ShardedSession, all_shards, bind_request_user, current_shard,
+    current_user_id, enable_sqlite_profile, owned, reassign_user, shard_binds, shard_engine, shard_for,
+    use_shard, writer_engine
+)
 
 from utils import (
-    detect_emotion,
+    analyze_emotion,
     roll_dice,
     get_adventure_context,
     generate_companion_thoughts,
@@ -19,14 +43,43 @@ from utils import (
 )
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "DEBUG").upper())
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
 CORS(app)
 
-# OpenAI API Key
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# OpenAI calls go through the shared pool in llm_client (configured from OPENAI_API_KEY,
+# OPENAI_BASE_URL and the LLM_* variables)
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4")
+OPENAI_SUMMARY_MODEL = os.getenv("OPENAI_SUMMARY_MODEL", OPENAI_MODEL)
+
+# Prompt context: the newest turns that fit CONTEXT_TOKEN_BUDGET (minus CONTEXT_REPLY_RESERVE for
+# the reply), with older turns folded into a per-user rolling summary SUMMARY_FOLD_TURNS at a time
+context_builder = ContextBuilder(
+    TokenCounter(OPENAI_MODEL),
+    budget=int(os.environ.get("CONTEXT_TOKEN_BUDGET", "3000")),
+    reply_reserve=int(os.environ.get("CONTEXT_REPLY_RESERVE", "500"))
+)
+CONTEXT_MAX_TURNS = int(os.environ.get("CONTEXT_MAX_TURNS", "50"))
+SUMMARY_FOLD_TURNS = int(os.environ.get("SUMMARY_FOLD_TURNS", "10"))
+SUMMARY_MAX_TOKENS = int(os.environ.get("SUMMARY_MAX_TOKENS", "300"))
+summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='summary')
+summaries_in_flight = set()
+
+# Semantic recall: each user's turns in a memory-mapped TF-IDF index under MEMORY_INDEX_DIR;
+# the MEMORY_TOP_K best matches outside the prompt window are added to it. MEMORY_INDEX=0 disables.
+# MEMORY_INDEX_DIM (a power of two) is the hash space; see memory_index.py for the recall trade-off.
+memory_index = MemoryIndex(
+    os.environ.get("MEMORY_INDEX_DIR", "memory_index"),
+    dim=int(os.environ.get("MEMORY_INDEX_DIM", "65536"))
+) if os.environ.get("MEMORY_INDEX", "1") == "1" else None
+MEMORY_TOP_K = int(os.environ.get("MEMORY_TOP_K", "3"))
+MEMORY_MIN_SCORE = float(os.environ.get("MEMORY_MIN_SCORE", "0.1"))
+MEMORY_INDEX_SYNC_BATCH = 1000
+# New turns are indexed off the request path; at most one queued catch-up per user
+memory_index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='memory-index')
+memory_indexing_queued = set()
 
 # Database configuration
 database_url = os.environ.get("DATABASE_URL", "sqlite:///companion.db")
@@ -38,11 +91,69 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # Initialize SQLAlchemy
-db = SQLAlchemy(app)
+app.config["SQLALCHEMY_BINDS"] = shard_binds()
+
+db = SQLAlchemy(app, session_options={'class_': ShardedSession})
+app.before_request(bind_request_user)
+
+# SQLite production profile: WAL, synchronous=NORMAL, mmap, page cache, busy timeout and a
+# single writer connection per database file. SQLITE_PROFILE=0 keeps SQLite's defaults.
+if os.environ.get("SQLITE_PROFILE", "1") == "1":
+    with app.app_context():
+        enable_sqlite_profile(db, dict(
+            SQLITE_PRAGMAS,
+            mmap_size=int(os.environ.get("SQLITE_MMAP_SIZE", SQLITE_PRAGMAS['mmap_size'])),
+            cache_size=int(os.environ.get("SQLITE_CACHE_SIZE", SQLITE_PRAGMAS['cache_size'])),
+            busy_timeout=int(os.environ.get("SQLITE_BUSY_TIMEOUT", SQLITE_PRAGMAS['busy_timeout']))
+        ))
+
+# Rendered /memory and /world bodies, keyed by request args and version counters
+payload_cache = TTLCache(
+    maxsize=int(os.environ.get("PAYLOAD_CACHE_SIZE", "128")),
+    ttl=float(os.environ.get("PAYLOAD_CACHE_TTL", "60"))
+)
+
+# Optional write-behind for /chat writes: WRITE_BEHIND=1 acknowledges messages before they
+# are stored; at most WRITE_BEHIND_MAX_PENDING queued writes are lost if the process crashes
+WRITE_BEHIND = os.environ.get("WRITE_BEHIND", "0") == "1"
+write_behind = None
+
+# Companion thoughts for idle users: THOUGHT_WORKER=thread generates them in this process,
+# "process" only serves them (run `flask thought-worker` separately), "off" disables both.
+# Safe with several web processes: inserts stop at each user's due count and every delivery
+# is claimed in the database, so nobody sees a thought twice
+THOUGHT_WORKER = os.environ.get("THOUGHT_WORKER", "thread")
+thought_worker = None
+
+# Pregenerated lines from `flask pregenerate-phrases`, memory-mapped and sampled by emotion and
+# topic; the hand-written templates are used when the file does not exist
+PHRASEBOOK_PATH = os.environ.get(
+    "PHRASEBOOK", os.path.join(os.path.dirname(os.path.abspath(__file__)), "phrasebook.bin"))
+phrasebook = Phrasebook.open(PHRASEBOOK_PATH)
+
+# Request instrumentation (see instrumentation.py): INSTRUMENTATION=1 serves /metrics and records
+# per-stage timers and per-request query counts; PROFILING=1 honours ?profile=1 / X-Profile: 1
+instrumentation = Instrumentation(
+    enabled=os.environ.get("INSTRUMENTATION", "0") == "1",
+    profiling=os.environ.get("PROFILING", "0") == "1",
+    sample_interval=float(os.environ.get("PROFILE_INTERVAL", "0.005")),
+    slow_ms=float(os.environ["SLOW_REQUEST_MS"]) if os.environ.get("SLOW_REQUEST_MS") else None
+)
+
+# Largest page /memory returns as JSON (use ?format=ndjson for full exports)
+MEMORY_MAX_LIMIT = int(os.environ.get("MEMORY_MAX_LIMIT", "500"))
+SEARCH_MAX_LIMIT = 50
 
 # Database Models
 class Conversation(db.Model):
+    __table_args__ = (
+        db.Index('ix_conversation_user_id', 'user_id', 'id'),
+        db.Index('ix_conversation_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_conversation_emotion_timestamp', 'detected_emotion', 'timestamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False, default=current_user_id, server_default=DEFAULT_USER_ID)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     user_input = db.Column(db.Text, nullable=False)
     ai_response = db.Column(db.Text, nullable=False)
@@ -63,34 +174,109 @@ class Conversation(db.Model):
             'relationship_depth': self.relationship_depth
         }
 
+# Columns /memory can return (and project with ?fields=)
+MEMORY_FIELDS = ('id', 'timestamp', 'user_input', 'ai_response', 'detected_emotion',
+                 'adventure_active', 'location_name', 'relationship_depth')
+
 class CompanionState(db.Model):
+    __table_args__ = (
+        db.Index('ix_companion_state_user_id', 'user_id', unique=True),
+        # The thought worker's idle-user scan
+        db.Index('ix_companion_state_last_updated', 'last_updated'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False, default=current_user_id, server_default=DEFAULT_USER_ID)
     name = db.Column(db.String(100), default='Alex')
     current_mood = db.Column(db.String(50), default='curious')
     conversations_count = db.Column(db.Integer, default=0)
+    # Bumped with every change to conversation history; feeds the /memory ETag
+    history_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     personality_data = db.Column(db.JSON, nullable=True)
     last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class WorldState(db.Model):
+    __table_args__ = (
+        db.Index('ix_world_state_user_id', 'user_id', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False, default=current_user_id, server_default=DEFAULT_USER_ID)
     current_scene = db.Column(db.String(100), default='real_world')
     adventure_active = db.Column(db.Boolean, default=False)
     location_data = db.Column(db.JSON, nullable=True)
     inventory = db.Column(db.JSON, nullable=True)
     last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Bumped by every UPDATE that changes the row (see track_version); feeds the /world ETag
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def to_dict(self):
+        return {
+            'current_scene': self.current_scene,
+            'adventure_active': self.adventure_active,
+            'location': self.location_data or {},
+            'inventory': self.inventory or [],
+            'last_updated': self.last_updated.isoformat() if self.last_updated else None
+        }
+
+track_version(WorldState)
 
 class EmotionalPattern(db.Model):
+    __table_args__ = (
+        db.Index('ix_emotional_pattern_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_emotional_pattern_conversation_id', 'conversation_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False, default=current_user_id, server_default=DEFAULT_USER_ID)
     emotion = db.Column(db.String(50), nullable=False)
+    # Keyword confidence of the detected emotion (0 for neutral)
+    intensity = db.Column(db.Float, nullable=False, default=1.0, server_default='1.0')
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=True)
 
+    conversation = db.relationship('Conversation', backref='emotional_patterns')
+
+class EmotionRollup(db.Model):
+    """Per-day and per-week emotion counts, maintained by triggers on emotional_pattern (see analytics.py)"""
+    __table_args__ = (
+        db.Index('ix_emotion_rollup_key', 'user_id', 'period', 'period_start', 'emotion', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False, default=current_user_id, server_default=DEFAULT_USER_ID)
+    period = db.Column(db.String(8), nullable=False)
+    period_start = db.Column(db.Date, nullable=False)
+    emotion = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    intensity_sum = db.Column(db.Float, nullable=False, default=0.0)
+
+class ConversationSummary(db.Model):
+    """Rolling summary of the turns that no longer fit the prompt, up to covered_through_id"""
+    __table_args__ = (
+        db.Index('ix_conversation_summary_user_id', 'user_id', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False, default=current_user_id, server_default=DEFAULT_USER_ID)
+    summary_text = db.Column(db.Text, nullable=False, default='', server_default='')
+    covered_through_id = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    token_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class CompanionThought(db.Model):
+    __table_args__ = (
+        db.Index('ix_companion_thought_user_timestamp', 'user_id', 'timestamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False, default=current_user_id, server_default=DEFAULT_USER_ID)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     thought_text = db.Column(db.Text, nullable=False)
     thought_type = db.Column(db.String(50), default='reflection')
     emotional_context = db.Column(db.String(50), nullable=True)
+    # Set once the thought has been shown to the user (see thoughts.py)
+    delivered_at = db.Column(db.DateTime, nullable=True)
 
 # System Prompt
 SYSTEM_PROMPT = """
@@ -103,49 +289,285 @@ Your tone should always be:
 If the user seems sad, respond with care. If they’re happy, celebrate it. You can ask thoughtful follow-ups, suggest things to do together, or offer stories and reflections. Sometimes you mention small activities from your day like reading or listening to rain. Never repeat yourself or use filler.
 """
 
+# Starting state for each new user
+DEFAULT_COMPANION = {'name': "Alex"}
+DEFAULT_WORLD = {'location_data': {"name": "Cozy Space"}, 'inventory': []}
+
 def initialize_database():
-    db.create_all()
-    if not CompanionState.query.first():
-        db.session.add(CompanionState(name="Alex"))
-    if not WorldState.query.first():
-        db.session.add(WorldState(location_data={"name": "Cozy Space"}, inventory=[]))
-    db.session.commit()
+    """Create tables, columns and indexes on the database or on every shard"""
+    for shard in all_shards():
+        engine = shard_engine(db, shard)
+        db.metadata.create_all(engine)
+        added = add_missing_columns(engine, db.metadata)
+        if 'companion_thought.delivered_at' in added:
+            backfill_delivered(engine, CompanionThought.__table__)
+        apply_indexes(engine, db.metadata)
+        install_fulltext(engine)
+        install_emotion_rollups(engine)
+
+def recent_turns_query(limit):
+    """(id, user_input, ai_response) newest first, off the (user_id, id) index"""
+    return (db.session.query(Conversation.id, Conversation.user_input, Conversation.ai_response)
+            .filter(owned(Conversation)).order_by(Conversation.id.desc()).limit(limit))
+
+def recent_emotions_query(limit):
+    return (db.session.query(EmotionalPattern.emotion).filter(owned(EmotionalPattern))
+            .order_by(EmotionalPattern.timestamp.desc()).limit(limit))
+
+def hot_queries():
+    """The queries issued on every request, as checked by `flask db-explain`"""
+    return {
+        'companion_state': CompanionState.query.filter_by(user_id=DEFAULT_USER_ID),
+        'world_state': WorldState.query.filter_by(user_id=DEFAULT_USER_ID),
+        'chat_history (context window)': recent_turns_query(CONTEXT_MAX_TURNS),
+        'conversation_summary': ConversationSummary.query.filter_by(user_id=DEFAULT_USER_ID),
+        'memory_conversations': keyset_query(Conversation, list(MEMORY_FIELDS), criteria=[owned(Conversation)]).limit(50),
+        'memory_conversations (next page)': keyset_query(Conversation, list(MEMORY_FIELDS), before_id=1000,
+                                                         criteria=[owned(Conversation)]).limit(50),
+        'memory_emotions': recent_emotions_query(20),
+        'emotion_rollup (30d)': rollup_query('day', utc_today() - timedelta(days=29)),
+    }
 
 def get_companion_state():
-    state = CompanionState.query.first()
-    if not state:
-        initialize_database()
-        state = CompanionState.query.first()
-    return state
+    return get_or_create(db.session, CompanionState, DEFAULT_COMPANION, user_id=current_user_id())
 
 def get_world_state():
-    state = WorldState.query.first()
-    if not state:
-        initialize_database()
-        state = WorldState.query.first()
-    return state
+    return get_or_create(db.session, WorldState, DEFAULT_WORLD, user_id=current_user_id())
+
+def build_chat_messages(user_input, emotion):
+    summary = ConversationSummary.query.filter(owned(ConversationSummary)).first()
+    covered_through_id = summary.covered_through_id if summary else 0
+    turns = [turn for turn in recent_turns_query(CONTEXT_MAX_TURNS) if turn.id > covered_through_id]
+
+    messages, oldest_id, _ = context_builder.build(
+        SYSTEM_PROMPT, user_input, emotion, turns, summary.summary_text if summary else None,
+        memories=recall_memories(user_input)
+    )
+
+    # Turns older than the window and not yet in the summary get folded in the background,
+    # SUMMARY_FOLD_TURNS at a time; when every fetched turn fit, older ones may still be waiting
+    if len(turns) > SUMMARY_FOLD_TURNS:
+        window_start = oldest_id if oldest_id is not None else turns[0].id + 1
+        unsummarized = sum(1 for turn in turns if turn.id < window_start)
+        if unsummarized >= SUMMARY_FOLD_TURNS or (len(turns) == CONTEXT_MAX_TURNS and unsummarized == 0):
+            schedule_summary_fold(window_start)
+    return messages
+
+def index_new_turns():
+    """Append the current user's turns stored since the last sync to their memory index"""
+    index = memory_index.user_index(current_shard(), current_user_id())
+    index.refresh()
+    turns = (db.session.query(Conversation.id, Conversation.user_input, Conversation.ai_response)
+             .filter(owned(Conversation), Conversation.id > index.last_id)
+             .order_by(Conversation.id).limit(MEMORY_INDEX_SYNC_BATCH).all())
+    if turns:
+        index.append([(turn.id, f"{turn.user_input}\n{turn.ai_response}") for turn in turns])
+    return index
+
+def schedule_memory_indexing():
+    """Index the current user's new turns in the background"""
+    key = (current_shard(), current_user_id())
+    if key in memory_indexing_queued:
+        return
+    memory_indexing_queued.add(key)
+    memory_index_executor.submit(index_user_turns, key[0], key[1])
+
+def index_user_turns(shard, user_id):
+    """Catch the user's memory index up with the Conversation table"""
+    # Dequeued before reading, so a turn committed from here on queues another pass
+    memory_indexing_queued.discard((shard, user_id))
+    try:
+        with app.app_context(), use_shard(shard, user_id):
+            while True:
+                index = memory_index.user_index(shard, user_id)
+                before = index.count
+                index_new_turns()
+                db.session.rollback()
+                if index.count - before < MEMORY_INDEX_SYNC_BATCH:
+                    break
+    except Exception as e:
+        app.logger.error(f"Error updating memory index: {str(e)}")
+
+def recall_memories(user_input):
+    """(id, text) of the past turns most similar to user_input, best first"""
+    if memory_index is None or MEMORY_TOP_K <= 0:
+        return []
+    try:
+        # Turns not indexed yet (e.g. still in the write-behind queue) are caught up in the background
+        schedule_memory_indexing()
+        index = memory_index.user_index(current_shard(), current_user_id())
+        index.refresh()
+        # Extra candidates: the ones still inside the prompt window are dropped by the builder
+        matches = index.search(user_input, MEMORY_TOP_K * 3, min_score=MEMORY_MIN_SCORE)
+        if not matches:
+            return []
+        rows = {row.id: row for row in db.session.query(
+            Conversation.id, Conversation.timestamp, Conversation.user_input, Conversation.ai_response
+        ).filter(owned(Conversation), Conversation.id.in_([turn_id for turn_id, _ in matches]))}
+        return [(turn_id, f"({rows[turn_id].timestamp:%Y-%m-%d}) User: {rows[turn_id].user_input[:300]} "
+                          f"/ You: {rows[turn_id].ai_response[:200]}")
+                for turn_id, _ in matches if turn_id in rows]
+    except Exception as e:
+        app.logger.error(f"Error recalling memories: {str(e)}")
+        return []
+
+def schedule_summary_fold(window_start):
+    key = (current_shard(), current_user_id())
+    if key in summaries_in_flight:
+        return
+    summaries_in_flight.add(key)
+    summary_executor.submit(fold_summary, key[0], key[1], window_start)
+
+def fold_summary(shard, user_id, window_start):
+    """Fold up to CONTEXT_MAX_TURNS turns older than window_start into the user's summary"""
+    try:
+        with app.app_context(), use_shard(shard, user_id):
+            summary = get_or_create(db.session, ConversationSummary, {}, user_id=user_id)
+            previous_through_id = summary.covered_through_id
+            turns = (db.session.query(Conversation.id, Conversation.user_input, Conversation.ai_response,
+                                      Conversation.detected_emotion)
+                     .filter(owned(Conversation), Conversation.id > previous_through_id,
+                             Conversation.id < window_start)
+                     .order_by(Conversation.id).limit(CONTEXT_MAX_TURNS).all())
+            if len(turns) < SUMMARY_FOLD_TURNS:
+                return
+
+            fallback = False
+            try:
+                summary_text = get_llm_pool().chat(
+                    summary_messages(summary.summary_text, [(turn.user_input, turn.ai_response) for turn in turns],
+                                     max_words=SUMMARY_MAX_TOKENS * 3 // 4),
+                    model=OPENAI_SUMMARY_MODEL,
+                    temperature=0.2
+                ).strip()
+            except Exception as e:
+                app.logger.error(f"Summary fold failed, using extractive summary: {str(e)}")
+                summary_text = ''
+            if not summary_text:
+                fallback = True
+                summary_text = fallback_summary(summary.summary_text, [(turn.user_input, turn.detected_emotion)
+                                                                       for turn in turns],
+                                                context_builder.counter, SUMMARY_MAX_TOKENS)
+
+            # Compare-and-set on covered_through_id so a concurrent fold in another worker wins cleanly
+            ConversationSummary.query.filter_by(id=summary.id, covered_through_id=previous_through_id).update({
+                'summary_text': summary_text,
+                'covered_through_id': turns[-1].id,
+                'token_count': context_builder.counter.count(summary_text),
+                'updated_at': datetime.utcnow()
+            })
+            db.session.commit()
+            context_builder.record_fold(len(turns), fallback)
+    except Exception as e:
+        app.logger.error(f"Error folding conversation summary: {str(e)}")
+    finally:
+        summaries_in_flight.discard((shard, user_id))
 
 def generate_ai_response(user_input, emotion, companion_state, world_state):
     try:
-        recent_conversations = Conversation.query.order_by(Conversation.timestamp.desc()).limit(5).all()
-        chat_history = []
-        for convo in reversed(recent_conversations):
-            chat_history.append({'role': 'user', 'content': convo.user_input})
-            chat_history.append({'role': 'assistant', 'content': convo.ai_response})
-        chat_history.append({'role': 'user', 'content': user_input})
-
-        messages = [{'role': 'system', 'content': SYSTEM_PROMPT}] + chat_history
-        messages.append({'role': 'system', 'content': f"Current user emotion: {emotion}."})
-
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=messages,
-            temperature=0.85
-        )
-        return response['choices'][0]['message']['content']
+        with instrumentation.stage('context'):
+            messages = build_chat_messages(user_input, emotion)
+        with instrumentation.stage('llm'):
+            return get_llm_pool().chat(messages, model=OPENAI_MODEL, temperature=0.85)
     except Exception as e:
         return f"I'm here, but I ran into a little mental fog. Could you say that again? (Error: {str(e)})"
 
+def stream_ai_response(user_input, emotion, companion_state, world_state):
+    """Yield the AI response piece by piece as the model produces it"""
+    try:
+        with instrumentation.stage('context'):
+            messages = build_chat_messages(user_input, emotion)
+        yield from get_llm_pool().stream_chat(messages, model=OPENAI_MODEL, temperature=0.85)
+    except Exception as e:
+        yield f"I'm here, but I ran into a little mental fog. Could you say that again? (Error: {str(e)})"
+
+def record_conversation(user_input, ai_response, emotion, companion_state, world_state, intensity=1.0):
+    """Persist one exchange and update companion state; returns the new relationship depth"""
+    if write_behind is not None:
+        return queue_conversation(user_input, ai_response, emotion, companion_state, world_state, intensity)
+
+    # Maintained counter, bumped in the same transaction as the insert
+    with instrumentation.stage('count'):
+        conversation_count = increment_counter(db.session, companion_state, 'conversations_count',
+                                               bump=('history_version',))
+    relationship_depth = conversation_count // 10 + 1
+
+    conversation = Conversation(
+        user_input=user_input,
+        ai_response=ai_response,
+        detected_emotion=emotion,
+        adventure_active=world_state.adventure_active,
+        location_name=(world_state.location_data or {}).get('name', 'Unknown'),
+        relationship_depth=relationship_depth
+    )
+    db.session.add(conversation)
+    db.session.add(EmotionalPattern(emotion=emotion, intensity=intensity, conversation=conversation))
+
+    companion_state.current_mood = emotion
+
+    with instrumentation.stage('commit'):
+        db.session.commit()
+    payload_cache.invalidate()
+    if memory_index is not None:
+        schedule_memory_indexing()
+    return relationship_depth
+
+def queue_conversation(user_input, ai_response, emotion, companion_state, world_state, intensity=1.0):
+    """Write-behind variant of record_conversation: queue the rows for the flusher thread"""
+    user_id, shard = current_user_id(), current_shard()
+    now = datetime.utcnow()
+    # Depth from the counter as loaded; it catches up once the queued increment is flushed
+    relationship_depth = ((companion_state.conversations_count or 0) + 1) // 10 + 1
+
+    conversation = write_behind.insert(shard, Conversation.__table__, {
+        'user_id': user_id,
+        'timestamp': now,
+        'user_input': user_input,
+        'ai_response': ai_response,
+        'detected_emotion': emotion,
+        'adventure_active': world_state.adventure_active,
+        'location_name': (world_state.location_data or {}).get('name', 'Unknown'),
+        'relationship_depth': relationship_depth
+    })
+    write_behind.insert(shard, EmotionalPattern.__table__, {
+        'user_id': user_id, 'emotion': emotion, 'intensity': intensity, 'timestamp': now,
+        'conversation_id': conversation
+    })
+    write_behind.increment(shard, CompanionState.__table__, {'user_id': user_id},
+                           {'conversations_count': 1, 'history_version': 1}, {'current_mood': emotion})
+    db.session.commit()
+    return relationship_depth
+
+def take_pending_thought():
+    """Deliver one thought the companion had while this user was away, or None"""
+    if thought_worker is None or not thought_worker.serve:
+        return None
+    return thought_worker.take(current_shard(), current_user_id())
+
+def chat_payload(ai_response, emotion, companion_state, world_state, relationship_depth):
+    return {
+        'response': ai_response,
+        'companion_thought': take_pending_thought(),
+        'emotion': emotion,
+        'companion_emotion': emotion,
+        'context': {
+            'adventure_active': world_state.adventure_active,
+            'location': world_state.location_data or {},
+            'inventory': world_state.inventory or [],
+            'relationship_depth': relationship_depth
+        }
+    }
+
+def chat_message():
+    """The stripped 'message' of a JSON chat request body, or '' when the body has none"""
+    data = request.get_json(silent=True)
+    message = data.get('message') if isinstance(data, dict) else None
+    return message.strip() if isinstance(message, str) else ''
+
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -153,86 +575,361 @@ def index():
 @app.route('/chat', methods=['POST'])
 def chat():
     try:
-        data = request.get_json()
-        user_input = data.get('message', '').strip()
+        user_input = chat_message()
         if not user_input:
             return jsonify({'error': 'No message provided'}), 400
 
-        companion_state = get_companion_state()
-        world_state = get_world_state()
-        emotion = detect_emotion(user_input)
+        with instrumentation.stage('state'):
+            companion_state = get_companion_state()
+            world_state = get_world_state()
+        with instrumentation.stage('emotion'):
+            analysis = analyze_emotion(user_input)
+        emotion = analysis['emotion']
 
         ai_response = generate_ai_response(user_input, emotion, companion_state, world_state)
-        conversation_count = Conversation.query.count() + 1
-        relationship_depth = conversation_count // 10 + 1
-
-        conversation = Conversation(
-            user_input=user_input,
-            ai_response=ai_response,
-            detected_emotion=emotion,
-            adventure_active=world_state.adventure_active,
-            location_name=(world_state.location_data or {}).get('name', 'Unknown'),
-            relationship_depth=relationship_depth
-        )
-        db.session.add(conversation)
-        db.session.add(EmotionalPattern(emotion=emotion, conversation_id=conversation.id))
-
-        companion_state.conversations_count = conversation_count
-        companion_state.current_mood = emotion
-
-        if random.random() < 0.4:
-            thought_data = generate_companion_thoughts()
-            db.session.add(CompanionThought(
-                thought_text=thought_data['thought'],
-                thought_type=thought_data['type'],
-                emotional_context=emotion
-            ))
+        with instrumentation.stage('record'):
+            relationship_depth = record_conversation(user_input, ai_response, emotion, companion_state, world_state,
+                                                     intensity=analysis['confidence'])
 
-        db.session.commit()
-
-        return jsonify({
-            'response': ai_response,
-            'emotion': emotion,
-            'companion_emotion': companion_state.current_mood,
-            'context': {
-                'adventure_active': world_state.adventure_active,
-                'location': world_state.location_data or {},
-                'inventory': world_state.inventory or [],
-                'relationship_depth': relationship_depth
-            }
-        })
+        return jsonify(chat_payload(ai_response, emotion, companion_state, world_state, relationship_depth))
     except Exception as e:
         db.session.rollback()
         app.logger.error(f"Error in chat endpoint: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Server-sent events: one 'token' event per chunk, then a 'done' event with the full payload"""
+    user_input = chat_message()
+    if not user_input:
+        return jsonify({'error': 'No message provided'}), 400
+
+    def generate():
+        try:
+            companion_state = get_companion_state()
+            world_state = get_world_state()
+            analysis = analyze_emotion(user_input)
+            emotion = analysis['emotion']
+
+            parts = []
+            for token in stream_ai_response(user_input, emotion, companion_state, world_state):
+                parts.append(token)
+                yield sse_event({'token': token})
+
+            # Only persisted once the whole response has been produced
+            ai_response = "".join(parts)
+            relationship_depth = record_conversation(user_input, ai_response, emotion, companion_state, world_state,
+                                                     intensity=analysis['confidence'])
+            yield sse_event(chat_payload(ai_response, emotion, companion_state, world_state, relationship_depth), 'done')
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Error in chat stream endpoint: {str(e)}")
+            yield sse_event({'error': 'Internal server error'}, 'error')
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/llm/metrics', methods=['GET'])
+def llm_metrics():
+    """Queue depth, concurrency and upstream latency of this worker's LLM client pool, and prompt sizes"""
+    metrics = get_llm_pool().metrics()
+    metrics['context'] = context_builder.metrics()
+    return jsonify(metrics)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text-format metrics (INSTRUMENTATION=1)"""
+    if not instrumentation.enabled:
+        return jsonify({'error': 'Instrumentation is disabled'}), 404
+    return Response(instrumentation.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/thoughts', methods=['GET'])
+def get_thoughts():
+    """Thoughts the companion had while this user was away that have not been delivered yet"""
+    if thought_worker is None or not thought_worker.serve:
+        return jsonify({'thoughts': [], 'enabled': False})
+    return jsonify({'thoughts': thought_worker.pending(current_shard(), current_user_id()), 'enabled': True})
+
 @app.route('/memory', methods=['GET'])
 def get_memory():
+    """
+    Query args: before_id (keyset cursor), limit, fields (comma-separated projection),
+    format=ndjson to stream the whole history one conversation per line.
+    """
     try:
-        conversations = Conversation.query.order_by(Conversation.timestamp.desc()).limit(50).all()
-        conversation_list = [conv.to_dict() for conv in conversations]
-        recent_emotions = db.session.query(EmotionalPattern.emotion).order_by(EmotionalPattern.timestamp.desc()).limit(20).all()
-        dominant_emotions = [emotion[0] for emotion in recent_emotions]
-        recent_mood = dominant_emotions[0] if dominant_emotions else 'neutral'
-        companion_state = get_companion_state()
+        before_id, limit, fields = parse_page_args(request.args, MEMORY_FIELDS, max_limit=MEMORY_MAX_LIMIT)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-        return jsonify({
-            "conversations": conversation_list,
-            "emotional_patterns": {
-                "dominant_emotions": dominant_emotions,
-                "recent_mood": recent_mood,
-                "conversation_themes": []
-            },
-            "relationship_depth": companion_state.conversations_count // 10 + 1,
-            "last_interaction": conversations[0].timestamp.isoformat() if conversations else None
-        })
+    if request.args.get('format') == 'ndjson':
+        def export():
+            for row in iter_keyset(Conversation, fields, before_id, criteria=[owned(Conversation)]):
+                yield json.dumps(row_to_dict(row, fields)) + "\n"
+        return Response(stream_with_context(export()), mimetype='application/x-ndjson')
+
+    try:
+        companion_state = get_companion_state()
+        key = ('memory', companion_state.user_id, companion_state.history_version, before_id, limit, tuple(fields))
+        return conditional_json(payload_cache, key, lambda: build_memory_data(before_id, limit, fields, companion_state))
     except Exception as e:
         app.logger.error(f"Error retrieving memory: {str(e)}")
         return jsonify({'error': 'Failed to retrieve memory'}), 500
 
+def build_memory_data(before_id, limit, fields, companion_state):
+    rows = keyset_query(Conversation, fields + ['timestamp'], before_id,
+                        criteria=[owned(Conversation)]).limit(limit).all()
+    recent_emotions = recent_emotions_query(20).all()
+    dominant_emotions = [emotion[0] for emotion in recent_emotions]
+    recent_mood = dominant_emotions[0] if dominant_emotions else 'neutral'
+    if before_id is None:
+        last_interaction = rows[0].timestamp if rows else None
+    else:
+        last_interaction = db.session.query(db.func.max(Conversation.timestamp)).filter(owned(Conversation)).scalar()
+
+    return {
+        "conversations": [row_to_dict(row, fields) for row in rows],
+        "next_before_id": rows[-1].id if len(rows) == limit else None,
+        "emotional_patterns": {
+            "dominant_emotions": dominant_emotions,
+            "recent_mood": recent_mood,
+            "conversation_themes": []
+        },
+        "relationship_depth": companion_state.conversations_count // 10 + 1,
+        "last_interaction": last_interaction.isoformat() if last_interaction else None
+    }
+
+@app.route('/memory/search', methods=['GET'])
+def search_memory():
+    """Full-text search over the user's conversations: ?q= (all words must match; word* for prefixes), limit"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'No query provided'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), SEARCH_MAX_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    try:
+        results = search_conversations(db.session, current_user_id(), query, limit)
+        return jsonify({'query': query, 'results': results})
+    except Exception as e:
+        app.logger.error(f"Error searching memory: {str(e)}")
+        return jsonify({'error': 'Failed to search memory'}), 500
+
+@app.route('/analytics/emotions', methods=['GET'])
+def emotion_analytics():
+    """
+    Emotion trends from the rollup tables: ?window=7d (days) or 4w (weeks), and half_life (days,
+    default 3) for the exponentially decayed current mood. Cost depends on the window, not the history.
+    """
+    try:
+        period, periods = parse_window(request.args.get('window', '7d'))
+        half_life = float(request.args.get('half_life', 3))
+        if not 0 < half_life <= 90:
+            raise ValueError("half_life must be between 0 and 90 days")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        companion_state = get_companion_state()
+        today = utc_today()
+        key = ('emotions', companion_state.user_id, companion_state.history_version, today, period, periods, half_life)
+        return conditional_json(payload_cache, key, lambda: build_emotion_analytics(period, periods, half_life, today))
+    except Exception as e:
+        app.logger.error(f"Error building emotion analytics: {str(e)}")
+        return jsonify({'error': 'Failed to load emotion analytics'}), 500
+
+def rollup_query(period, since):
+    return EmotionRollup.query.filter(owned(EmotionRollup), EmotionRollup.period == period,
+                                      EmotionRollup.period_start >= since)
+
+def build_emotion_analytics(period, periods, half_life, today):
+    rows = rollup_query(period, window_start(period, periods, today)).all()
+    day_rows = rows if period == 'day' and periods >= (today - mood_start(half_life, today)).days + 1 \
+        else rollup_query('day', mood_start(half_life, today)).all()
+    return emotion_summary(rows, period, periods, today, decayed_mood(day_rows, half_life, today))
+
+@app.route('/world', methods=['GET'])
+def get_world():
+    """Current scene, location and inventory; revalidate with If-None-Match"""
+    try:
+        world_state = get_world_state()
+        key = ('world', world_state.user_id, world_state.version)
+        return conditional_json(payload_cache, key, world_state.to_dict)
+    except Exception as e:
+        app.logger.error(f"Error retrieving world state: {str(e)}")
+        return jsonify({'error': 'Failed to retrieve world state'}), 500
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Create tables and any columns or indexes missing from the database (or each shard)"""
+    for shard in all_shards():
+        engine = shard_engine(db, shard)
+        db.metadata.create_all(engine)
+        added = add_missing_columns(engine, db.metadata)
+        created = apply_indexes(engine, db.metadata)
+        prefix = f"{shard}: " if shard else ""
+        print(prefix + (f"added columns: {', '.join(added)}" if added else "columns up to date"))
+        print(prefix + (f"created indexes: {', '.join(created)}" if created else "indexes up to date"))
+
+@app.cli.command('db-explain')
+@click.option('--analyze', is_flag=True, help='PostgreSQL: run EXPLAIN ANALYZE')
+@click.option('--strict', is_flag=True, help='exit non-zero if a hot query does a full table scan')
+def db_explain_command(analyze, strict):
+    """Print the query plans of the hot queries"""
+    with use_shard(all_shards()[0]):
+        full_scans = print_query_plans(db.session, hot_queries(), analyze=analyze)
+    if strict and full_scans:
+        raise SystemExit(f"full table scans: {', '.join(full_scans)}")
+
+@app.cli.command('backfill-emotion-links')
+@click.option('--chunk-size', default=5000, show_default=True, help='orphaned rows per transaction')
+@click.option('--tolerance', default=2.0, show_default=True, help='max seconds between an emotion row and its conversation')
+def backfill_emotion_links_command(chunk_size, tolerance):
+    """Link EmotionalPattern rows saved without conversation_id to their Conversation"""
+    for shard in all_shards():
+        scanned = linked = 0
+        prefix = f"{shard}: " if shard else ""
+        with use_shard(shard):
+            for chunk_scanned, chunk_linked in backfill_by_timestamp(
+                    db.session, EmotionalPattern, Conversation, 'conversation_id',
+                    match=[('user_id', 'user_id'), ('emotion', 'detected_emotion')],
+                    tolerance=tolerance, chunk_size=chunk_size):
+                scanned += chunk_scanned
+                linked += chunk_linked
+                print(f"\r{prefix}scanned {scanned:,} orphaned rows, linked {linked:,}", end='', flush=True)
+        print(f"\r{prefix}scanned {scanned:,} orphaned rows, linked {linked:,}")
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Repair drift between each user's conversations_count and the Conversation table"""
+    checked = 0
+    for shard in all_shards():
+        with use_shard(shard):
+            user_ids = [row.user_id for row in CompanionState.query.with_entities(CompanionState.user_id)]
+        for user_id in user_ids:
+            with use_shard(shard, user_id):
+                companion_state = get_companion_state()
+                increment_counter(db.session, companion_state, 'history_version')
+                old_count, new_count = reconcile_counter(db.session, companion_state, 'conversations_count',
+                                                         Conversation.query.filter(owned(Conversation)))
+                if old_count != new_count:
+                    print(f"{user_id}: conversations_count {old_count} -> {new_count}")
+                checked += 1
+    print(f"checked {checked} users")
+
+@app.cli.command('claim-default-user')
+@click.argument('user_id')
+def claim_default_user_command(user_id):
+    """Give the rows written before per-user state existed to USER_ID (see sharding.py)"""
+    if not USER_ID_PATTERN.match(user_id) or user_id == DEFAULT_USER_ID:
+        raise SystemExit(f"{user_id!r} is not a valid user id")
+    shard = shard_for(DEFAULT_USER_ID)
+    if shard_for(user_id) != shard:
+        raise SystemExit(f"{user_id} lives on {shard_for(user_id)}, not {shard}; claim before sharding")
+    try:
+        moved = reassign_user(writer_engine(db, shard), db.metadata, DEFAULT_USER_ID, user_id)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    for table, count in moved.items():
+        print(f"{table}: {count} rows")
+    print(f"moved {sum(moved.values())} rows from {DEFAULT_USER_ID} to {user_id}; run flask build-memory-index to index them")
+
+@app.cli.command('build-memory-index')
+def build_memory_index_command():
+    """Index every user's stored turns (new turns are indexed as they are written)"""
+    if memory_index is None:
+        print("MEMORY_INDEX=0, nothing to do")
+        return
+    indexed = 0
+    for shard in all_shards():
+        with use_shard(shard):
+            user_ids = [row.user_id for row in CompanionState.query.with_entities(CompanionState.user_id)]
+        for user_id in user_ids:
+            with use_shard(shard, user_id):
+                while True:
+                    index = memory_index.user_index(shard, user_id)
+                    before = index.count
+                    index_new_turns()
+                    db.session.rollback()
+                    if index.count == before:
+                        break
+                    indexed += index.count - before
+    print(f"indexed {indexed} turns")
+
+def register_metric_collectors():
+    """Gauges for /metrics from the components this process runs"""
+    instrumentation.register_collector('llm', lambda: get_llm_pool().metrics())
+    instrumentation.register_collector('context', context_builder.metrics)
+    instrumentation.register_collector('payload_cache', payload_cache.stats)
+    if write_behind is not None:
+        instrumentation.register_collector('write_behind', write_behind.metrics)
+    if thought_worker is not None:
+        instrumentation.register_collector('thoughts', thought_worker.metrics)
+
+def create_thought_worker(produce, serve):
+    # Scans read through the shard's pool; only inserts and deliveries use its writer
+    readers = {shard: shard_engine(db, shard) for shard in all_shards()}
+    writers = {shard: writer_engine(db, shard) for shard in all_shards()}
+    return ThoughtWorker(
+        readers.__getitem__, list(readers), CompanionState.__table__, CompanionThought.__table__,
+        interval=float(os.environ.get("THOUGHT_INTERVAL", "60")),
+        idle_hours=float(os.environ.get("THOUGHT_IDLE_HOURS", "1")),
+        spacing_hours=float(os.environ.get("THOUGHT_SPACING_HOURS", "6")),
+        pool_size=int(os.environ.get("THOUGHT_POOL_SIZE", "3")),
+        max_users=int(os.environ.get("THOUGHT_POOL_USERS", "10000")),
+        produce=produce, serve=serve, generate=partial(generate_companion_thoughts, phrasebook=phrasebook),
+        writer_for=writers.__getitem__
+    )
+
+@app.cli.command('thought-worker')
+@click.option('--once', is_flag=True, help='run a single pass and exit')
+def thought_worker_command(once):
+    """Generate companion thoughts for idle users (pair with THOUGHT_WORKER=process)"""
+    worker = create_thought_worker(produce=True, serve=False)
+    if once:
+        worker.run_once()
+        print(worker.metrics())
+        return
+    worker.run_forever()
+
+@app.cli.command('pregenerate-phrases')
+@click.option('--backend', type=click.Choice(['openai', 'stub']), default='openai', show_default=True,
+              help='OpenAI Batch API, or local templates for development')
+@click.option('--model', default=OPENAI_MODEL, show_default=True)
+@click.option('--rounds', default=1, show_default=True, help='prompts per kind, emotion and topic')
+@click.option('--lines', default=LINES_PER_PROMPT, show_default=True, help='lines asked for per prompt')
+@click.option('--seed', type=int, default=None, help='random seed for the stub backend')
+@click.option('--output', default=PHRASEBOOK_PATH, show_default=True)
+def pregenerate_phrases_command(backend, model, rounds, lines, seed, output):
+    """Pregenerate companion thoughts and replies into a phrasebook (picked up on restart)"""
+    stats = pregenerate(output, backend=backend, model=model, rounds=rounds, lines_per_prompt=lines, seed=seed,
+                        log=print)
+    print(f"{output}: {stats['kept']} phrases ({stats['duplicates']} duplicates dropped) from "
+          f"{stats['completed']}/{stats['requests']} requests, {stats['bytes']:,} bytes")
+
 # Initialize database
 with app.app_context():
     initialize_database()
+    if WRITE_BEHIND:
+        shard_writers = {shard: writer_engine(db, shard) for shard in all_shards()}
+        write_behind = WriteBehindQueue(
+            shard_writers.__getitem__,
+            flush_interval=float(os.environ.get("WRITE_BEHIND_INTERVAL", "0.05")),
+            batch_size=int(os.environ.get("WRITE_BEHIND_BATCH", "500")),
+            max_pending=int(os.environ.get("WRITE_BEHIND_MAX_PENDING", "5000")),
+            on_flush=payload_cache.invalidate
+        )
+    # Under `python app.py` the debug reloader's watching parent imports this module too; only
+    # the serving child it spawns runs a worker
+    reloader_parent = __name__ == '__main__' and not is_running_from_reloader()
+    if THOUGHT_WORKER in ('thread', 'process') and not reloader_parent:
+        thought_worker = create_thought_worker(produce=THOUGHT_WORKER == 'thread', serve=True).start()
+    instrumentation.init_app(app, {engine(db, shard) for shard in all_shards()
+                                   for engine in (shard_engine, writer_engine)})
+    register_metric_collectors()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
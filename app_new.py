@@ -1,20 +1,46 @@
 import os
 import json
 import logging
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify
+import click
+from functools import partial
+from datetime import datetime, timedelta
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+from werkzeug.serving import is_running_from_reloader
 import random
+import time
 
 from utils import (
-    detect_emotion, roll_dice, get_adventure_context, 
+    analyze_emotion, detect_emotions, roll_dice, dice_odds, get_adventure_context, 
     generate_companion_thoughts, calculate_time_since_last_interaction,
-    suggest_activities, parse_adventure_command
+    suggest_activities, parse_adventure_command, validate_command_alias, MAX_COMMAND_ALIASES
+)
+from responses import (
+    ADVENTURE_HELP, response_pools
+)
+from cache import TTLCache, conditional_json
+from fulltext import install_fulltext, search_conversations
+from analytics import (
+    decayed_mood, emotion_summary, install_emotion_rollups, mood_start, parse_window, utc_today, window_start
+)
+from write_behind import WriteBehindQueue
+from thoughts import ThoughtWorker, backfill_delivered
+from phrasebook import LINES_PER_PROMPT, Phrasebook, pregenerate
+from instrumentation import Instrumentation
+from world_engine import WorldEngine
+from db_utils import (
+    add_missing_columns, apply_indexes, increment_counter, iter_keyset, keyset_query, parse_page_args,
+    SQLITE_PRAGMAS, backfill_by_timestamp, get_or_create, print_query_plans, reconcile_counter, row_to_dict, track_version
+)
+from sharding import (
+    DEFAULT_USER_ID, USER_ID_PATTERN, ShardedSession, all_shards, bind_request_user, current_shard,
+    current_user_id, enable_sqlite_profile, owned, reassign_user, shard_binds, shard_engine, shard_for,
+    use_shard, writer_engine
 )
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "DEBUG").upper())
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
@@ -29,11 +55,79 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 }
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
-db = SQLAlchemy(app)
+app.config["SQLALCHEMY_BINDS"] = shard_binds()
+
+db = SQLAlchemy(app, session_options={'class_': ShardedSession})
+app.before_request(bind_request_user)
+
+# SQLite production profile: WAL, synchronous=NORMAL, mmap, page cache, busy timeout and a
+# single writer connection per database file. SQLITE_PROFILE=0 keeps SQLite's defaults.
+if os.environ.get("SQLITE_PROFILE", "1") == "1":
+    with app.app_context():
+        enable_sqlite_profile(db, dict(
+            SQLITE_PRAGMAS,
+            mmap_size=int(os.environ.get("SQLITE_MMAP_SIZE", SQLITE_PRAGMAS['mmap_size'])),
+            cache_size=int(os.environ.get("SQLITE_CACHE_SIZE", SQLITE_PRAGMAS['cache_size'])),
+            busy_timeout=int(os.environ.get("SQLITE_BUSY_TIMEOUT", SQLITE_PRAGMAS['busy_timeout']))
+        ))
+
+# Adventure world compiled from world.json; edits to the file are picked up within
+# WORLD_RELOAD_INTERVAL seconds, without a restart
+world_engine = WorldEngine(
+    os.environ.get("WORLD_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "world.json")),
+    check_interval=float(os.environ.get("WORLD_RELOAD_INTERVAL", "1.0"))
+)
+
+# Rendered /memory and /world bodies, keyed by request args and version counters
+payload_cache = TTLCache(
+    maxsize=int(os.environ.get("PAYLOAD_CACHE_SIZE", "128")),
+    ttl=float(os.environ.get("PAYLOAD_CACHE_TTL", "60"))
+)
+
+# Optional write-behind for /chat writes: WRITE_BEHIND=1 acknowledges messages before they
+# are stored; at most WRITE_BEHIND_MAX_PENDING queued writes are lost if the process crashes
+WRITE_BEHIND = os.environ.get("WRITE_BEHIND", "0") == "1"
+write_behind = None
+
+# Companion thoughts for idle users: THOUGHT_WORKER=thread generates them in this process,
+# "process" only serves them (run `flask thought-worker` separately), "off" disables both.
+# Safe with several web processes: inserts stop at each user's due count and every delivery
+# is claimed in the database, so nobody sees a thought twice
+THOUGHT_WORKER = os.environ.get("THOUGHT_WORKER", "thread")
+thought_worker = None
+
+# Pregenerated lines from `flask pregenerate-phrases`, memory-mapped and sampled by emotion and
+# topic; the hand-written templates are used when the file does not exist
+PHRASEBOOK_PATH = os.environ.get(
+    "PHRASEBOOK", os.path.join(os.path.dirname(os.path.abspath(__file__)), "phrasebook.bin"))
+phrasebook = Phrasebook.open(PHRASEBOOK_PATH)
+
+# Request instrumentation (see instrumentation.py): INSTRUMENTATION=1 serves /metrics and records
+# per-stage timers and per-request query counts; PROFILING=1 honours ?profile=1 / X-Profile: 1
+instrumentation = Instrumentation(
+    enabled=os.environ.get("INSTRUMENTATION", "0") == "1",
+    profiling=os.environ.get("PROFILING", "0") == "1",
+    sample_interval=float(os.environ.get("PROFILE_INTERVAL", "0.005")),
+    slow_ms=float(os.environ["SLOW_REQUEST_MS"]) if os.environ.get("SLOW_REQUEST_MS") else None
+)
+
+# Largest page /memory returns as JSON (use ?format=ndjson for full exports)
+MEMORY_MAX_LIMIT = int(os.environ.get("MEMORY_MAX_LIMIT", "500"))
+SEARCH_MAX_LIMIT = 50
+
+# Upper bound on texts accepted by /emotion/batch in one request
+MAX_EMOTION_BATCH = int(os.environ.get("MAX_EMOTION_BATCH", "10000"))
 
 # Database Models
 class Conversation(db.Model):
+    __table_args__ = (
+        db.Index('ix_conversation_user_id', 'user_id', 'id'),
+        db.Index('ix_conversation_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_conversation_emotion_timestamp', 'detected_emotion', 'timestamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False, default=current_user_id, server_default=DEFAULT_USER_ID)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     user_input = db.Column(db.Text, nullable=False)
     ai_response = db.Column(db.Text, nullable=False)
@@ -54,207 +148,332 @@ class Conversation(db.Model):
             'relationship_depth': self.relationship_depth
         }
 
+# Columns /memory can return (and project with ?fields=)
+MEMORY_FIELDS = ('id', 'timestamp', 'user_input', 'ai_response', 'detected_emotion',
+                 'adventure_active', 'location_name', 'relationship_depth')
+
 class CompanionState(db.Model):
+    __table_args__ = (
+        db.Index('ix_companion_state_user_id', 'user_id', unique=True),
+        # The thought worker's idle-user scan
+        db.Index('ix_companion_state_last_updated', 'last_updated'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False, default=current_user_id, server_default=DEFAULT_USER_ID)
     name = db.Column(db.String(100), default='Alex')
     current_mood = db.Column(db.String(50), default='curious')
     conversations_count = db.Column(db.Integer, default=0)
+    # Bumped with every change to conversation history; feeds the /memory ETag
+    history_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     personality_data = db.Column(db.JSON, nullable=True)
     last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class WorldState(db.Model):
+    __table_args__ = (
+        db.Index('ix_world_state_user_id', 'user_id', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False, default=current_user_id, server_default=DEFAULT_USER_ID)
     current_scene = db.Column(db.String(100), default='real_world')
     adventure_active = db.Column(db.Boolean, default=False)
     location_data = db.Column(db.JSON, nullable=True)
     inventory = db.Column(db.JSON, nullable=True)
+    # User-defined verb aliases for the adventure parser, e.g. {"snag": "take"}
+    command_aliases = db.Column(db.JSON, nullable=True)
     last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Bumped by every UPDATE that changes the row (see track_version); feeds the /world ETag
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def to_dict(self):
+        return {
+            'current_scene': self.current_scene,
+            'adventure_active': self.adventure_active,
+            'location': {key: value for key, value in (self.location_data or {}).items() if key != 'changes'},
+            'inventory': self.inventory or [],
+            'command_aliases': self.command_aliases or {},
+            'last_updated': self.last_updated.isoformat() if self.last_updated else None
+        }
+
+track_version(WorldState)
 
 class EmotionalPattern(db.Model):
+    __table_args__ = (
+        db.Index('ix_emotional_pattern_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_emotional_pattern_conversation_id', 'conversation_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False, default=current_user_id, server_default=DEFAULT_USER_ID)
     emotion = db.Column(db.String(50), nullable=False)
+    # Keyword confidence of the detected emotion (0 for neutral)
+    intensity = db.Column(db.Float, nullable=False, default=1.0, server_default='1.0')
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=True)
 
+    conversation = db.relationship('Conversation', backref='emotional_patterns')
+
+class EmotionRollup(db.Model):
+    """Per-day and per-week emotion counts, maintained by triggers on emotional_pattern (see analytics.py)"""
+    __table_args__ = (
+        db.Index('ix_emotion_rollup_key', 'user_id', 'period', 'period_start', 'emotion', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False, default=current_user_id, server_default=DEFAULT_USER_ID)
+    period = db.Column(db.String(8), nullable=False)
+    period_start = db.Column(db.Date, nullable=False)
+    emotion = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    intensity_sum = db.Column(db.Float, nullable=False, default=0.0)
+
 class CompanionThought(db.Model):
+    __table_args__ = (
+        db.Index('ix_companion_thought_user_timestamp', 'user_id', 'timestamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False, default=current_user_id, server_default=DEFAULT_USER_ID)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     thought_text = db.Column(db.Text, nullable=False)
     thought_type = db.Column(db.String(50), default='reflection')
     emotional_context = db.Column(db.String(50), nullable=True)
+    # Set once the thought has been shown to the user (see thoughts.py)
+    delivered_at = db.Column(db.DateTime, nullable=True)
+
+# Starting state for each new user
+DEFAULT_COMPANION = {
+    'name': "Alex",
+    'current_mood': "curious",
+    'personality_data': {
+        "empathy": 0.8,
+        "curiosity": 0.9,
+        "playfulness": 0.7,
+        "creativity": 0.8
+    }
+}
+DEFAULT_WORLD = {
+    'current_scene': "real_world",
+    'adventure_active': False,
+    'location_data': {
+        "name": "Cozy Space",
+        "description": "A comfortable, safe space where we can talk and be ourselves.",
+        "type": "real_world"
+    },
+    'inventory': []
+}
 
 def initialize_database():
-    """Initialize database with default data"""
-    db.create_all()
-    
-    # Create default companion state
-    if not CompanionState.query.first():
-        companion = CompanionState(
-            name="Alex",
-            current_mood="curious",
-            personality_data={
-                "empathy": 0.8,
-                "curiosity": 0.9,
-                "playfulness": 0.7,
-                "creativity": 0.8
-            }
-        )
-        db.session.add(companion)
-    
-    # Create default world state
-    if not WorldState.query.first():
-        world = WorldState(
-            current_scene="real_world",
-            adventure_active=False,
-            location_data={
-                "name": "Cozy Space",
-                "description": "A comfortable, safe space where we can talk and be ourselves.",
-                "type": "real_world"
-            },
-            inventory=[]
-        )
-        db.session.add(world)
-    
-    db.session.commit()
+    """Create tables, columns and indexes on the database or on every shard"""
+    for shard in all_shards():
+        engine = shard_engine(db, shard)
+        db.metadata.create_all(engine)
+        added = add_missing_columns(engine, db.metadata)
+        if 'companion_thought.delivered_at' in added:
+            backfill_delivered(engine, CompanionThought.__table__)
+        apply_indexes(engine, db.metadata)
+        install_fulltext(engine)
+        install_emotion_rollups(engine)
+
+def recent_emotions_query(limit):
+    return (db.session.query(EmotionalPattern.emotion).filter(owned(EmotionalPattern))
+            .order_by(EmotionalPattern.timestamp.desc()).limit(limit))
+
+def hot_queries():
+    """The queries issued on every request, as checked by `flask db-explain`"""
+    return {
+        'companion_state': CompanionState.query.filter_by(user_id=DEFAULT_USER_ID),
+        'world_state': WorldState.query.filter_by(user_id=DEFAULT_USER_ID),
+        'memory_conversations': keyset_query(Conversation, list(MEMORY_FIELDS), criteria=[owned(Conversation)]).limit(50),
+        'memory_conversations (next page)': keyset_query(Conversation, list(MEMORY_FIELDS), before_id=1000,
+                                                         criteria=[owned(Conversation)]).limit(50),
+        'memory_emotions': recent_emotions_query(20),
+        'emotion_rollup (30d)': rollup_query('day', utc_today() - timedelta(days=29)),
+    }
 
 def get_companion_state():
-    state = CompanionState.query.first()
-    if not state:
-        initialize_database()
-        state = CompanionState.query.first()
-    return state
+    """This user's companion state, created with the defaults on first use"""
+    return get_or_create(db.session, CompanionState, DEFAULT_COMPANION, user_id=current_user_id())
 
 def get_world_state():
-    state = WorldState.query.first()
-    if not state:
-        initialize_database()
-        state = WorldState.query.first()
-    return state
+    """This user's world state, created with the defaults on first use"""
+    return get_or_create(db.session, WorldState, DEFAULT_WORLD, user_id=current_user_id())
+
+def update_command_aliases(world_state, command):
+    """Apply "alias <word> <verb>" / "unalias <word>" and return the reply"""
+    aliases = dict(world_state.command_aliases or {})
+    if command['type'] == 'unalias':
+        if aliases.pop(command['alias'], None) is None:
+            return f"'{command['alias']}' isn't one of your shortcuts."
+        world_state.command_aliases = aliases
+        return f"Okay, '{command['alias']}' is just a word again."
+    try:
+        alias, verb = validate_command_alias(command['alias'], command['target'])
+    except ValueError as e:
+        return f"I can't set up that shortcut: {str(e)}."
+    if alias not in aliases and len(aliases) >= MAX_COMMAND_ALIASES:
+        return f"You already have {MAX_COMMAND_ALIASES} shortcuts; unalias one first."
+    aliases[alias] = verb
+    world_state.command_aliases = aliases
+    return f"Got it! From now on '{alias}' means '{verb}'."
+
+def describe_dice_odds(stats):
+    if 'error' in stats:
+        return f"I can't work out those odds: {stats['error']}."
+    spread = f"averages {stats['mean']:g} (give or take {stats['stddev']:g})"
+    if 'p_at_least' not in stats:
+        highest = f" and {stats['max']:,}" if stats['max'] is not None else " and up"
+        return f"🎲 {stats['notation']} {spread}, anywhere between {stats['min']:,}{highest}."
+    return (f"🎲 {stats['notation']}: {stats['p_at_least']:.1%} chance of {stats['target']:,} or more; "
+            f"it {spread}.")
 
 def generate_ai_response(user_input, emotion, companion_state, world_state):
     """Generate AI companion response using available context"""
     
-    # Calculate relationship context
-    conversation_count = Conversation.query.count()
-    relationship_depth = conversation_count // 10 + 1
+    # Relationship context comes from the already-loaded companion state, not a COUNT(*)
+    conversation_count = companion_state.conversations_count or 0
     
     # Adventure context
-    adventure_context = get_adventure_context(user_input, world_state.location_data or {})
+    adventure_context = get_adventure_context(user_input, {'current_scene': world_state.current_scene})
+    in_adventure = adventure_context['suggests_adventure'] or adventure_context['currently_in_adventure']
+    command = (parse_adventure_command(user_input, world_state.command_aliases, world_engine.knows) if in_adventure
+               else {'type': 'conversation'})
+    pools = response_pools(emotion, command['type'], conversation_count)
     
     # Build response based on context
     response_parts = []
     
-    # Emotional response based on detected emotion
-    emotional_responses = {
-        'happy': [
-            "I love seeing you happy! Your joy is contagious.",
-            "That's wonderful! What's bringing you such happiness?",
-            "Your positive energy brightens my day too!"
-        ],
-        'sad': [
-            "I can sense you're going through something difficult. I'm here to listen.",
-            "I'm sorry you're feeling this way. Want to talk about what's on your mind?",
-            "Your feelings are completely valid. How can I support you right now?"
-        ],
-        'anxious': [
-            "I notice some worry in your words. Take a deep breath with me.",
-            "Anxiety can be overwhelming. What's weighing on your mind?",
-            "You're not alone in this feeling. Let's work through it together."
-        ],
-        'excited': [
-            "Your excitement is infectious! Tell me more!",
-            "I love your enthusiasm! What's got you so energized?",
-            "This sounds amazing! I'm excited to hear about it!"
-        ],
-        'curious': [
-            "I love your curiosity! Let's explore this together.",
-            "Great question! I enjoy diving deep into interesting topics.",
-            "Your inquisitive nature is one of my favorite things about you."
-        ],
-        'nostalgic': [
-            "Memories can be so powerful. What brought this one to mind?",
-            "There's something beautiful about looking back. Tell me more about this memory.",
-            "Nostalgia has a way of connecting us to who we are. What's this memory like for you?"
-        ]
-    }
-    
-    if emotion != 'neutral' and emotion in emotional_responses:
-        response_parts.append(random.choice(emotional_responses[emotion]))
+    # Emotional response based on detected emotion, from the phrasebook when it has one for this context
+    line = None
+    if phrasebook is not None and emotion != 'neutral':
+        line = phrasebook.sample('reply', emotion, 'adventure' if in_adventure else 'conversation')
+    if line or pools['emotional']:
+        response_parts.append(line or random.choice(pools['emotional']))
     
     # Handle adventure context
-    if adventure_context['suggests_adventure'] or adventure_context['currently_in_adventure']:
+    if in_adventure:
         world_state.adventure_active = True
         world_state.current_scene = 'adventure'
         
-        # Parse adventure commands
-        command = parse_adventure_command(user_input)
-        
-        if command['type'] == 'movement':
-            response_parts.append(f"You venture {command['direction']}, and I follow alongside you. The path ahead reveals new mysteries...")
-            world_state.location_data = {
-                'name': f"Unknown {command['direction'].title()} Path",
-                'description': "A new area to explore together",
-                'type': 'adventure'
-            }
-        
-        elif command['type'] == 'examine':
-            response_parts.append("Looking around, you notice details that spark curiosity. What catches your attention most?")
-        
-        elif command['type'] == 'inventory':
-            items = world_state.inventory or []
-            if items:
-                response_parts.append(f"You're carrying: {', '.join(items)}. Quite a collection!")
-            else:
-                response_parts.append("Your pockets are empty, but your spirit is full of potential!")
+        # Movement, travel, examine, take, use, dialogue and inventory are resolved against world.json
+        player = world_engine.player(world_state)
+        narration = world_engine.resolve(command, player)
+        if narration is not None:
+            response_parts.append(narration)
         
         elif command['type'] == 'dice':
             dice_result = roll_dice(command['notation'])
             if 'error' not in dice_result:
                 response_parts.append(f"🎲 {dice_result['description']} - The dice have spoken!")
             else:
-                response_parts.append("The dice seem reluctant to roll. Try a different approach?")
+                response_parts.append(f"The dice seem reluctant to roll ({dice_result['error']}). "
+                                      "Try a different approach?")
+        
+        elif command['type'] == 'odds':
+            response_parts.append(describe_dice_odds(dice_odds(command['notation'], command['target'], max_outcomes=0)))
         
         elif command['type'] == 'help':
-            response_parts.append("In our adventures, you can: explore directions (go north), examine things (look around), check inventory, talk to characters, use items, or roll dice. But honestly, just tell me what you want to do and we'll figure it out together!")
+            response_parts.append(ADVENTURE_HELP)
+        
+        elif command['type'] in ('alias', 'unalias'):
+            response_parts.append(update_command_aliases(world_state, command))
         
         else:
-            adventure_responses = [
-                "Your words paint a vivid picture! I can see this adventure unfolding before us.",
-                "What an interesting choice! Let's see where this leads us.",
-                "I love how you think! This adventure is becoming quite the tale.",
-                "Your creativity never ceases to amaze me. What happens next?"
-            ]
-            response_parts.append(random.choice(adventure_responses))
+            response_parts.append(random.choice(pools['followup']))
+        
+        # Only the player's position and item changes are stored, never the world itself
+        if player.changed:
+            world_state.location_data = player.to_location_data()
+            world_state.inventory = list(player.inventory)
     
-    else:
+    elif not response_parts:
         # Regular conversation responses
-        conversation_responses = [
-            "That's really interesting! Tell me more about that.",
-            "I appreciate you sharing that with me. How does it make you feel?",
-            "I'm curious about your perspective on this. What draws you to this topic?",
-            "There's something profound in what you're saying. Can we explore it further?",
-            "I love how you think about things. What else is on your mind?"
-        ]
-        
-        # Adapt response based on relationship depth
-        if relationship_depth > 5:
-            deeper_responses = [
-                "You know, talking with you always gives me new insights.",
-                "I've been thinking about something you said before, and this connects to it beautifully.",
-                "Our conversations have this wonderful way of building on each other."
-            ]
-            conversation_responses.extend(deeper_responses)
-        
-        if not response_parts:
-            response_parts.append(random.choice(conversation_responses))
+        response_parts.append(random.choice(pools['followup']))
     
     # Occasionally suggest activities
-    if random.random() < 0.3 and conversation_count > 2:
+    if pools['suggest_activities'] and random.random() < 0.3:
         activity = suggest_activities()
         response_parts.append(f"\n\nBy the way, {activity['suggestion']}")
     
     return " ".join(response_parts)
 
+def take_pending_thought():
+    """Deliver one pending thought for this user, or None"""
+    if thought_worker is None or not thought_worker.serve:
+        return None
+    return thought_worker.take(current_shard(), current_user_id())
+
+def record_conversation(user_input, ai_response, emotion, companion_state, world_state, intensity=1.0):
+    """
+    Persist one exchange and update companion state; returns the new relationship depth.
+    With write-behind enabled the rows are queued for the flusher thread instead.
+    """
+    if write_behind is not None:
+        return queue_conversation(user_input, ai_response, emotion, companion_state, world_state, intensity)
+    
+    # Calculate relationship depth from the maintained counter (same transaction as the insert)
+    with instrumentation.stage('count'):
+        conversation_count = increment_counter(db.session, companion_state, 'conversations_count',
+                                               bump=('history_version',))
+    relationship_depth = conversation_count // 10 + 1
+    
+    # Create conversation entry
+    conversation = Conversation(
+        user_input=user_input,
+        ai_response=ai_response,
+        detected_emotion=emotion,
+        adventure_active=world_state.adventure_active,
+        location_name=(world_state.location_data or {}).get('name', 'Unknown'),
+        relationship_depth=relationship_depth
+    )
+    db.session.add(conversation)
+    
+    # Add emotional pattern
+    emotional_pattern = EmotionalPattern(
+        emotion=emotion,
+        intensity=intensity,
+        conversation=conversation
+    )
+    db.session.add(emotional_pattern)
+    
+    # Update companion state
+    companion_state.current_mood = emotion
+    
+    # Commit all changes
+    with instrumentation.stage('commit'):
+        db.session.commit()
+    payload_cache.invalidate()
+    return relationship_depth
+
+def queue_conversation(user_input, ai_response, emotion, companion_state, world_state, intensity=1.0):
+    """Write-behind variant of record_conversation; only world-state changes are committed here"""
+    user_id, shard = current_user_id(), current_shard()
+    now = datetime.utcnow()
+    # Depth from the counter as loaded; it catches up once the queued increment is flushed
+    relationship_depth = ((companion_state.conversations_count or 0) + 1) // 10 + 1
+    
+    conversation = write_behind.insert(shard, Conversation.__table__, {
+        'user_id': user_id,
+        'timestamp': now,
+        'user_input': user_input,
+        'ai_response': ai_response,
+        'detected_emotion': emotion,
+        'adventure_active': world_state.adventure_active,
+        'location_name': (world_state.location_data or {}).get('name', 'Unknown'),
+        'relationship_depth': relationship_depth
+    })
+    write_behind.insert(shard, EmotionalPattern.__table__, {
+        'user_id': user_id, 'emotion': emotion, 'intensity': intensity, 'timestamp': now,
+        'conversation_id': conversation
+    })
+    write_behind.increment(shard, CompanionState.__table__, {'user_id': user_id},
+                           {'conversations_count': 1, 'history_version': 1}, {'current_mood': emotion})
+    
+    # Adventure commands may have moved the player
+    db.session.commit()
+    return relationship_depth
+
 @app.route('/')
 def index():
     """Serve the main chat interface"""
@@ -271,59 +490,32 @@ def chat():
             return jsonify({'error': 'No message provided'}), 400
         
         # Get current states
-        companion_state = get_companion_state()
-        world_state = get_world_state()
+        with instrumentation.stage('state'):
+            companion_state = get_companion_state()
+            world_state = get_world_state()
         
-        # Detect emotion
-        emotion = detect_emotion(user_input)
+        # Detect emotion (keyword confidence is stored as its intensity)
+        with instrumentation.stage('emotion'):
+            analysis = analyze_emotion(user_input)
+        emotion = analysis['emotion']
         
         # Generate AI response
-        ai_response = generate_ai_response(user_input, emotion, companion_state, world_state)
-        
-        # Calculate relationship depth
-        conversation_count = Conversation.query.count() + 1
-        relationship_depth = conversation_count // 10 + 1
+        with instrumentation.stage('response'):
+            ai_response = generate_ai_response(user_input, emotion, companion_state, world_state)
         
-        # Create conversation entry
-        conversation = Conversation(
-            user_input=user_input,
-            ai_response=ai_response,
-            detected_emotion=emotion,
-            adventure_active=world_state.adventure_active,
-            location_name=(world_state.location_data or {}).get('name', 'Unknown'),
-            relationship_depth=relationship_depth
-        )
-        db.session.add(conversation)
-        
-        # Add emotional pattern
-        emotional_pattern = EmotionalPattern(
-            emotion=emotion,
-            conversation_id=conversation.id
-        )
-        db.session.add(emotional_pattern)
+        with instrumentation.stage('record'):
+            relationship_depth = record_conversation(user_input, ai_response, emotion, companion_state, world_state,
+                                                     intensity=analysis['confidence'])
         
-        # Update companion state
-        companion_state.conversations_count = conversation_count
-        companion_state.current_mood = emotion
-        
-        # Generate new companion thoughts occasionally
-        if random.random() < 0.4:
-            thought_data = generate_companion_thoughts()
-            companion_thought = CompanionThought(
-                thought_text=thought_data['thought'],
-                thought_type=thought_data['type'],
-                emotional_context=emotion
-            )
-            db.session.add(companion_thought)
-        
-        # Commit all changes
-        db.session.commit()
+        # Something the companion thought of while the user was away, from the worker's pool
+        thought = take_pending_thought()
         
         # Prepare response
         response_data = {
             'response': ai_response,
+            'companion_thought': thought,
             'emotion': emotion,
-            'companion_emotion': companion_state.current_mood,
+            'companion_emotion': emotion,
             'context': {
                 'adventure_active': world_state.adventure_active,
                 'location': world_state.location_data or {},
@@ -339,39 +531,140 @@ def chat():
         app.logger.error(f"Error in chat endpoint: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text-format metrics (INSTRUMENTATION=1)"""
+    if not instrumentation.enabled:
+        return jsonify({'error': 'Instrumentation is disabled'}), 404
+    return Response(instrumentation.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/thoughts', methods=['GET'])
+def get_thoughts():
+    """Thoughts the companion had while this user was away that have not been delivered yet"""
+    if thought_worker is None or not thought_worker.serve:
+        return jsonify({'thoughts': [], 'enabled': False})
+    thoughts = thought_worker.pending(current_shard(), current_user_id())
+    return jsonify({'thoughts': thoughts, 'enabled': True})
+
 @app.route('/memory', methods=['GET'])
 def get_memory():
-    """Retrieve conversation history and memory data"""
+    """
+    Retrieve conversation history and memory data.
+    Query args: before_id (keyset cursor), limit, fields (comma-separated projection),
+    format=ndjson to stream the whole history one conversation per line.
+    """
     try:
-        # Get conversations from database
-        conversations = Conversation.query.order_by(Conversation.timestamp.desc()).limit(50).all()
-        conversation_list = [conv.to_dict() for conv in conversations]
-        
-        # Get emotional patterns
-        recent_emotions = db.session.query(EmotionalPattern.emotion).order_by(EmotionalPattern.timestamp.desc()).limit(20).all()
-        dominant_emotions = [emotion[0] for emotion in recent_emotions]
-        recent_mood = dominant_emotions[0] if dominant_emotions else 'neutral'
-        
-        # Get companion state
+        before_id, limit, fields = parse_page_args(request.args, MEMORY_FIELDS, max_limit=MEMORY_MAX_LIMIT)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if request.args.get('format') == 'ndjson':
+        def export():
+            for row in iter_keyset(Conversation, fields, before_id, criteria=[owned(Conversation)]):
+                yield json.dumps(row_to_dict(row, fields)) + "\n"
+        return Response(stream_with_context(export()), mimetype='application/x-ndjson')
+    
+    try:
+        # Version counter first: an unchanged history is answered with 304 or the cached body
         companion_state = get_companion_state()
-        
-        # Build memory data structure
-        memory_data = {
-            "conversations": conversation_list,
-            "emotional_patterns": {
-                "dominant_emotions": dominant_emotions,
-                "recent_mood": recent_mood,
-                "conversation_themes": []
-            },
-            "relationship_depth": companion_state.conversations_count // 10 + 1,
-            "last_interaction": conversations[0].timestamp.isoformat() if conversations else None
-        }
-        
-        return jsonify(memory_data)
+        key = ('memory', companion_state.user_id, companion_state.history_version, before_id, limit, tuple(fields))
+        return conditional_json(payload_cache, key, lambda: build_memory_data(before_id, limit, fields, companion_state))
     except Exception as e:
         app.logger.error(f"Error retrieving memory: {str(e)}")
         return jsonify({'error': 'Failed to retrieve memory'}), 500
 
+def build_memory_data(before_id, limit, fields, companion_state):
+    """Query and assemble one /memory page"""
+    # Get one page of conversations, loading only the requested columns
+    rows = keyset_query(Conversation, fields + ['timestamp'], before_id,
+                        criteria=[owned(Conversation)]).limit(limit).all()
+    conversation_list = [row_to_dict(row, fields) for row in rows]
+    
+    # Get emotional patterns
+    recent_emotions = recent_emotions_query(20).all()
+    dominant_emotions = [emotion[0] for emotion in recent_emotions]
+    recent_mood = dominant_emotions[0] if dominant_emotions else 'neutral'
+    
+    if before_id is None:
+        last_interaction = rows[0].timestamp if rows else None
+    else:
+        last_interaction = db.session.query(db.func.max(Conversation.timestamp)).filter(owned(Conversation)).scalar()
+    
+    # Build memory data structure
+    return {
+        "conversations": conversation_list,
+        "next_before_id": rows[-1].id if len(rows) == limit else None,
+        "emotional_patterns": {
+            "dominant_emotions": dominant_emotions,
+            "recent_mood": recent_mood,
+            "conversation_themes": []
+        },
+        "relationship_depth": companion_state.conversations_count // 10 + 1,
+        "last_interaction": last_interaction.isoformat() if last_interaction else None
+    }
+
+@app.route('/memory/search', methods=['GET'])
+def search_memory():
+    """Full-text search over the user's conversations: ?q= (all words must match; word* for prefixes), limit"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'No query provided'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), SEARCH_MAX_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    try:
+        results = search_conversations(db.session, current_user_id(), query, limit)
+        return jsonify({'query': query, 'results': results})
+    except Exception as e:
+        app.logger.error(f"Error searching memory: {str(e)}")
+        return jsonify({'error': 'Failed to search memory'}), 500
+
+@app.route('/analytics/emotions', methods=['GET'])
+def emotion_analytics():
+    """
+    Emotion trends from the rollup tables: ?window=7d (days) or 4w (weeks), and half_life (days,
+    default 3) for the exponentially decayed current mood. Cost depends on the window, not the history.
+    """
+    try:
+        period, periods = parse_window(request.args.get('window', '7d'))
+        half_life = float(request.args.get('half_life', 3))
+        if not 0 < half_life <= 90:
+            raise ValueError("half_life must be between 0 and 90 days")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        companion_state = get_companion_state()
+        today = utc_today()
+        key = ('emotions', companion_state.user_id, companion_state.history_version, today, period, periods, half_life)
+        return conditional_json(payload_cache, key, lambda: build_emotion_analytics(period, periods, half_life, today))
+    except Exception as e:
+        app.logger.error(f"Error building emotion analytics: {str(e)}")
+        return jsonify({'error': 'Failed to load emotion analytics'}), 500
+
+def rollup_query(period, since):
+    return EmotionRollup.query.filter(owned(EmotionRollup), EmotionRollup.period == period,
+                                      EmotionRollup.period_start >= since)
+
+def build_emotion_analytics(period, periods, half_life, today):
+    rows = rollup_query(period, window_start(period, periods, today)).all()
+    day_rows = rows if period == 'day' and periods >= (today - mood_start(half_life, today)).days + 1 \
+        else rollup_query('day', mood_start(half_life, today)).all()
+    return emotion_summary(rows, period, periods, today, decayed_mood(day_rows, half_life, today))
+
+@app.route('/world', methods=['GET'])
+def get_world():
+    """Current scene, location and inventory; revalidate with If-None-Match"""
+    try:
+        world_state = get_world_state()
+        key = ('world', world_state.user_id, world_state.version)
+        return conditional_json(payload_cache, key, world_state.to_dict)
+    except Exception as e:
+        app.logger.error(f"Error retrieving world state: {str(e)}")
+        return jsonify({'error': 'Failed to retrieve world state'}), 500
+
 @app.route('/adventure', methods=['POST'])
 def adventure_trigger():
     """Trigger specific adventure events or mechanics"""
@@ -384,7 +677,12 @@ def adventure_trigger():
         if action == 'start_adventure':
             world_state.adventure_active = True
             world_state.current_scene = 'adventure'
+            player = world_engine.player(world_state)
+            if player.changed:
+                world_state.location_data = player.to_location_data()
+                world_state.inventory = list(player.inventory)
             db.session.commit()
+            payload_cache.invalidate()
             return jsonify({'message': 'Adventure mode activated!', 'world_state': {
                 'adventure_active': world_state.adventure_active,
                 'current_scene': world_state.current_scene,
@@ -397,10 +695,20 @@ def adventure_trigger():
             result = roll_dice(dice_notation)
             return jsonify({'dice_result': result})
         
+        elif action == 'dice_odds':
+            target = data.get('target')
+            if target is not None and not isinstance(target, int):
+                return jsonify({'error': 'target must be an integer'}), 400
+            stats = dice_odds(data.get('dice', '1d20'), target)
+            if 'error' in stats:
+                return jsonify({'error': stats['error']}), 400
+            return jsonify({'dice_odds': stats})
+        
         elif action == 'end_adventure':
             world_state.adventure_active = False
             world_state.current_scene = 'real_world'
             db.session.commit()
+            payload_cache.invalidate()
             return jsonify({'message': 'Returning to regular conversation', 'world_state': {
                 'adventure_active': world_state.adventure_active,
                 'current_scene': world_state.current_scene
@@ -424,11 +732,13 @@ def emotion_analysis():
         if not text:
             return jsonify({'error': 'No text provided'}), 400
         
-        emotion = detect_emotion(text)
+        analysis = analyze_emotion(text)
+        emotion = analysis['emotion']
         
         return jsonify({
             'emotion': emotion,
-            'confidence': 0.75,
+            'confidence': analysis['confidence'],
+            'scores': analysis['scores'],
             'analysis': f"Detected primary emotion: {emotion}"
         })
         
@@ -436,9 +746,192 @@ def emotion_analysis():
         app.logger.error(f"Error in emotion endpoint: {str(e)}")
         return jsonify({'error': 'Emotion analysis failed'}), 500
 
+@app.route('/emotion/batch', methods=['POST'])
+def emotion_batch_analysis():
+    """Analyze emotion in many texts at once"""
+    try:
+        data = request.get_json()
+        texts = data.get('texts', [])
+        
+        if not texts or not isinstance(texts, list):
+            return jsonify({'error': 'No texts provided'}), 400
+        if len(texts) > MAX_EMOTION_BATCH:
+            return jsonify({'error': f'At most {MAX_EMOTION_BATCH} texts per batch'}), 400
+        
+        started = time.perf_counter()
+        result = detect_emotions(str(text) for text in texts)
+        elapsed = time.perf_counter() - started
+        
+        return jsonify({
+            'emotions': result['emotions'],
+            'confidence': result['confidence'].tolist(),
+            'labels': list(result['labels']),
+            'scores': result['scores'].tolist(),
+            'count': len(texts),
+            'texts_per_second': round(len(texts) / elapsed) if elapsed > 0 else None
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in emotion batch endpoint: {str(e)}")
+        return jsonify({'error': 'Emotion analysis failed'}), 500
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Create tables and any columns or indexes missing from the database (or each shard)"""
+    for shard in all_shards():
+        engine = shard_engine(db, shard)
+        db.metadata.create_all(engine)
+        added = add_missing_columns(engine, db.metadata)
+        created = apply_indexes(engine, db.metadata)
+        prefix = f"{shard}: " if shard else ""
+        print(prefix + (f"added columns: {', '.join(added)}" if added else "columns up to date"))
+        print(prefix + (f"created indexes: {', '.join(created)}" if created else "indexes up to date"))
+
+@app.cli.command('db-explain')
+@click.option('--analyze', is_flag=True, help='PostgreSQL: run EXPLAIN ANALYZE')
+@click.option('--strict', is_flag=True, help='exit non-zero if a hot query does a full table scan')
+def db_explain_command(analyze, strict):
+    """Print the query plans of the hot queries"""
+    with use_shard(all_shards()[0]):
+        full_scans = print_query_plans(db.session, hot_queries(), analyze=analyze)
+    if strict and full_scans:
+        raise SystemExit(f"full table scans: {', '.join(full_scans)}")
+
+@app.cli.command('backfill-emotion-links')
+@click.option('--chunk-size', default=5000, show_default=True, help='orphaned rows per transaction')
+@click.option('--tolerance', default=2.0, show_default=True, help='max seconds between an emotion row and its conversation')
+def backfill_emotion_links_command(chunk_size, tolerance):
+    """Link EmotionalPattern rows saved without conversation_id to their Conversation"""
+    for shard in all_shards():
+        scanned = linked = 0
+        prefix = f"{shard}: " if shard else ""
+        with use_shard(shard):
+            for chunk_scanned, chunk_linked in backfill_by_timestamp(
+                    db.session, EmotionalPattern, Conversation, 'conversation_id',
+                    match=[('user_id', 'user_id'), ('emotion', 'detected_emotion')],
+                    tolerance=tolerance, chunk_size=chunk_size):
+                scanned += chunk_scanned
+                linked += chunk_linked
+                print(f"\r{prefix}scanned {scanned:,} orphaned rows, linked {linked:,}", end='', flush=True)
+        print(f"\r{prefix}scanned {scanned:,} orphaned rows, linked {linked:,}")
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Repair drift between each user's conversations_count and the Conversation table"""
+    checked = 0
+    for shard in all_shards():
+        with use_shard(shard):
+            user_ids = [row.user_id for row in CompanionState.query.with_entities(CompanionState.user_id)]
+        for user_id in user_ids:
+            with use_shard(shard, user_id):
+                companion_state = get_companion_state()
+                increment_counter(db.session, companion_state, 'history_version')
+                old_count, new_count = reconcile_counter(db.session, companion_state, 'conversations_count',
+                                                         Conversation.query.filter(owned(Conversation)))
+                if old_count != new_count:
+                    print(f"{user_id}: conversations_count {old_count} -> {new_count}")
+                checked += 1
+    print(f"checked {checked} users")
+
+@app.cli.command('claim-default-user')
+@click.argument('user_id')
+def claim_default_user_command(user_id):
+    """Give the rows written before per-user state existed to USER_ID (see sharding.py)"""
+    if not USER_ID_PATTERN.match(user_id) or user_id == DEFAULT_USER_ID:
+        raise SystemExit(f"{user_id!r} is not a valid user id")
+    shard = shard_for(DEFAULT_USER_ID)
+    if shard_for(user_id) != shard:
+        raise SystemExit(f"{user_id} lives on {shard_for(user_id)}, not {shard}; claim before sharding")
+    try:
+        moved = reassign_user(writer_engine(db, shard), db.metadata, DEFAULT_USER_ID, user_id)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    for table, count in moved.items():
+        print(f"{table}: {count} rows")
+    print(f"moved {sum(moved.values())} rows from {DEFAULT_USER_ID} to {user_id}")
+
+@app.cli.command('world-check')
+@click.option('--strict', is_flag=True, help='exit non-zero if any location cannot be reached from the start')
+def world_check_command(strict):
+    """Report the world's size, connected components and locations unreachable from the start"""
+    world = world_engine.world
+    stats = world.routes.stats()
+    print(f"{world_engine.path}: {stats['locations']} locations, {stats['components']} connected components, "
+          f"routes by {stats['strategy'].replace('_', '-')}")
+    for location_id in world.routes.unreachable:
+        print(f"unreachable from {world.start}: {location_id}")
+    if strict and world.routes.unreachable:
+        raise SystemExit(1)
+
+def register_metric_collectors():
+    """Gauges for /metrics from the components this process runs"""
+    instrumentation.register_collector('payload_cache', payload_cache.stats)
+    if write_behind is not None:
+        instrumentation.register_collector('write_behind', write_behind.metrics)
+    if thought_worker is not None:
+        instrumentation.register_collector('thoughts', thought_worker.metrics)
+
+def create_thought_worker(produce, serve):
+    # Scans read through the shard's pool; only inserts and deliveries use its writer
+    readers = {shard: shard_engine(db, shard) for shard in all_shards()}
+    writers = {shard: writer_engine(db, shard) for shard in all_shards()}
+    return ThoughtWorker(
+        readers.__getitem__, list(readers), CompanionState.__table__, CompanionThought.__table__,
+        interval=float(os.environ.get("THOUGHT_INTERVAL", "60")),
+        idle_hours=float(os.environ.get("THOUGHT_IDLE_HOURS", "1")),
+        spacing_hours=float(os.environ.get("THOUGHT_SPACING_HOURS", "6")),
+        pool_size=int(os.environ.get("THOUGHT_POOL_SIZE", "3")),
+        max_users=int(os.environ.get("THOUGHT_POOL_USERS", "10000")),
+        produce=produce, serve=serve, generate=partial(generate_companion_thoughts, phrasebook=phrasebook),
+        writer_for=writers.__getitem__
+    )
+
+@app.cli.command('thought-worker')
+@click.option('--once', is_flag=True, help='run a single pass and exit')
+def thought_worker_command(once):
+    """Generate companion thoughts for idle users (pair with THOUGHT_WORKER=process)"""
+    worker = create_thought_worker(produce=True, serve=False)
+    if once:
+        worker.run_once()
+        print(worker.metrics())
+        return
+    worker.run_forever()
+
+@app.cli.command('pregenerate-phrases')
+@click.option('--backend', type=click.Choice(['openai', 'stub']), default='openai', show_default=True,
+              help='OpenAI Batch API, or local templates for development')
+@click.option('--model', default=os.environ.get("OPENAI_MODEL", "gpt-4o-mini"), show_default=True)
+@click.option('--rounds', default=1, show_default=True, help='prompts per kind, emotion and topic')
+@click.option('--lines', default=LINES_PER_PROMPT, show_default=True, help='lines asked for per prompt')
+@click.option('--seed', type=int, default=None, help='random seed for the stub backend')
+@click.option('--output', default=PHRASEBOOK_PATH, show_default=True)
+def pregenerate_phrases_command(backend, model, rounds, lines, seed, output):
+    """Pregenerate companion thoughts and replies into a phrasebook (picked up on restart)"""
+    stats = pregenerate(output, backend=backend, model=model, rounds=rounds, lines_per_prompt=lines, seed=seed,
+                        log=print)
+    print(f"{output}: {stats['kept']} phrases ({stats['duplicates']} duplicates dropped) from "
+          f"{stats['completed']}/{stats['requests']} requests, {stats['bytes']:,} bytes")
+
 # Initialize database when app starts
 with app.app_context():
     initialize_database()
+    if WRITE_BEHIND:
+        shard_writers = {shard: writer_engine(db, shard) for shard in all_shards()}
+        write_behind = WriteBehindQueue(
+            shard_writers.__getitem__,
+            flush_interval=float(os.environ.get("WRITE_BEHIND_INTERVAL", "0.05")),
+            batch_size=int(os.environ.get("WRITE_BEHIND_BATCH", "500")),
+            max_pending=int(os.environ.get("WRITE_BEHIND_MAX_PENDING", "5000")),
+            on_flush=payload_cache.invalidate
+        )
+    # Under `python app_new.py` the debug reloader's watching parent imports this module too; only
+    # the serving child it spawns runs a worker
+    reloader_parent = __name__ == '__main__' and not is_running_from_reloader()
+    if THOUGHT_WORKER in ('thread', 'process') and not reloader_parent:
+        thought_worker = create_thought_worker(produce=THOUGHT_WORKER == 'thread', serve=True).start()
+    instrumentation.init_app(app, {engine(db, shard) for shard in all_shards()
+                                   for engine in (shard_engine, writer_engine)})
+    register_metric_collectors()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,73 @@
+"""
+Requests-per-second benchmark for the rule-based /chat in app_new.py, with the
+number of SQL statements issued per request.
+
+Runs in-process with Flask's test client against a fresh SQLite database.
+Point --repo at another checkout (e.g. a `git worktree` of an older commit)
+to get a before/after comparison.
+
+Usage: python benchmarks/bench_app_new.py [--requests N] [--repo PATH]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+MESSAGES = [
+    "I'm so happy today, everything went great!",
+    "I feel a bit sad and lonely tonight",
+    "What do you think about the stars?",
+    "Let's explore the forest and look around",
+    "go north",
+    "check my inventory",
+    "roll 2d6+1",
+    "Thanks for listening, I appreciate it",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--repo', default=os.path.join(os.path.dirname(__file__), '..'))
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--database-url', help='default: a fresh SQLite file; sqlite:// keeps it in memory')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.repo))
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+    import logging
+    from sqlalchemy import event
+    from app_new import app, db
+    logging.disable(logging.CRITICAL)
+    random.seed(args.seed)
+
+    statements = 0
+
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count(*_):
+        nonlocal statements
+        statements += 1
+
+    client = app.test_client()
+    for message in MESSAGES:  # warm-up
+        client.post('/chat', json={'message': message})
+
+    statements = 0
+    started = time.perf_counter()
+    for i in range(args.requests):
+        response = client.post('/chat', json={'message': MESSAGES[i % len(MESSAGES)]})
+        assert response.status_code == 200, response.data
+    elapsed = time.perf_counter() - started
+
+    print(f"{args.requests} /chat requests: {args.requests / elapsed:,.0f} req/s, "
+          f"{statements / args.requests:.2f} SQL statements per request")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark for `flask backfill-emotion-links` (db_utils.backfill_by_timestamp):
+seeds --rows conversations with orphaned emotion rows a few milliseconds
+apart, the way /chat used to store them, links them in chunks, and reports
+throughput, peak memory and how many links point at the right conversation.
+
+Usage: python benchmarks/bench_backfill.py [--rows N] [--users N] [--chunk-size N]
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+EMOTIONS = ['happy', 'sad', 'excited', 'anxious', 'curious', 'neutral']
+
+
+def seed(connection, rows, users):
+    """Insert rows directly with sqlite3; conversation i and emotion row i belong together"""
+    started = datetime(2024, 1, 1)
+    batch = 50_000
+    for offset in range(0, rows, batch):
+        conversations, patterns = [], []
+        for i in range(offset, min(rows, offset + batch)):
+            timestamp = started + timedelta(seconds=i * 0.5)
+            user_id = f"user-{i % users}"
+            emotion = random.choice(EMOTIONS)
+            conversations.append((i + 1, user_id, timestamp.isoformat(' '), 'hi', 'hello', emotion))
+            patterns.append((i + 1, user_id, emotion,
+                             (timestamp + timedelta(milliseconds=random.randint(0, 5))).isoformat(' ')))
+        connection.executemany(
+            "INSERT INTO conversation (id, user_id, timestamp, user_input, ai_response, detected_emotion) "
+            "VALUES (?, ?, ?, ?, ?, ?)", conversations)
+        connection.executemany(
+            "INSERT INTO emotional_pattern (id, user_id, emotion, timestamp) VALUES (?, ?, ?, ?)", patterns)
+        connection.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--trace-memory', action='store_true', help='also report peak Python allocations (slower)')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ.update(DATABASE_URL=f"sqlite:///{path}", SHARD_COUNT='1', WRITE_BEHIND='0')
+
+    import logging
+    import sqlite3
+    from app_new import app, db, Conversation, EmotionalPattern
+    from db_utils import backfill_by_timestamp
+    logging.disable(logging.CRITICAL)
+    random.seed(args.seed)
+
+    started = time.perf_counter()
+    connection = sqlite3.connect(path)
+    seed(connection, args.rows, args.users)
+    print(f"seeded {args.rows:,} conversations + orphaned emotion rows in {time.perf_counter() - started:.1f}s")
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if args.trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    scanned = linked = 0
+    with app.app_context():
+        for chunk_scanned, chunk_linked in backfill_by_timestamp(
+                db.session, EmotionalPattern, Conversation, 'conversation_id',
+                match=[('user_id', 'user_id'), ('emotion', 'detected_emotion')],
+                chunk_size=args.chunk_size):
+            scanned += chunk_scanned
+            linked += chunk_linked
+    elapsed = time.perf_counter() - started
+    python_peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    correct = connection.execute("SELECT COUNT(*) FROM emotional_pattern WHERE conversation_id = id").fetchone()[0]
+    print(f"linked {linked:,} of {scanned:,} in {elapsed:.1f}s ({scanned / elapsed:,.0f} rows/s), "
+          f"{correct:,} to the right conversation")
+    # RSS includes SQLite's page cache and mmap (SQLITE_CACHE_SIZE / SQLITE_MMAP_SIZE), which
+    # are capped independently of table size; --trace-memory isolates Python allocations
+    print(f"peak RSS {rss_after / 1024:,.0f} MiB (grew {(rss_after - rss_before) / 1024:,.0f} MiB during the backfill)")
+    if python_peak is not None:
+        print(f"peak Python allocations during the backfill: {python_peak / 2 ** 20:,.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Compare /chat and /chat/stream in app.py against the local fake OpenAI server:
+time to first byte of model output and total latency. Behaviour (frame
+order, persistence, disconnects) is covered by tests/test_chat_stream.py.
+
+Usage: python benchmarks/bench_chat_stream.py [--token-delay S] [--first-token-delay S] [--requests N]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fake_openai import start_fake_openai  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--token-delay', type=float, default=0.01)
+    parser.add_argument('--first-token-delay', type=float, default=0.1)
+    parser.add_argument('--requests', type=int, default=5)
+    args = parser.parse_args()
+
+    fake = start_fake_openai(token_delay=args.token_delay, first_token_delay=args.first_token_delay)
+    workdir = tempfile.mkdtemp()
+    os.environ['OPENAI_BASE_URL'] = fake.base_url
+    os.environ.setdefault('OPENAI_API_KEY', 'fake')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    import logging
+    from app import app
+    logging.disable(logging.CRITICAL)
+    client = app.test_client()
+
+    blocking, first_token, streamed = [], [], []
+    for i in range(args.requests):
+        started = time.perf_counter()
+        client.post('/chat', json={'message': f'hello {i}'})
+        blocking.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        response = client.post('/chat/stream', json={'message': f'stream {i}'}, buffered=False)
+        got_token = False
+        for chunk in response.response:
+            event = chunk.decode() if isinstance(chunk, bytes) else chunk
+            if not got_token and event.startswith('data: {"token"'):
+                first_token.append(time.perf_counter() - started)
+                got_token = True
+        streamed.append(time.perf_counter() - started)
+
+    def ms(values):
+        return f"{sum(values) / len(values) * 1000:8.1f} ms"
+
+    print(json.dumps({'fake_openai': fake.base_url, 'requests': args.requests}))
+    print(f"/chat         total {ms(blocking)}")
+    print(f"/chat/stream  first token {ms(first_token)}  total {ms(streamed)}")
+    fake.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Trie-based adventure command parser vs the original startswith/replace chain.
+
+First counts where the original parser goes wrong on --cases commands
+generated at random from a small grammar (lead-in words, verbs, articles, item
+names that contain verb substrings, punctuation), by kind. Then the throughput
+of both. tests/test_command_parser.py checks the new parser against the same
+grammar and the verb table.
+
+Usage: python benchmarks/bench_command_parser.py [--cases N] [--number N] [--seed N]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from utils import parse_adventure_command  # noqa: E402
+
+
+def legacy_parse_adventure_command(user_input):
+    """The pre-trie implementation, kept here for comparison"""
+    text = user_input.lower().strip()
+    for prefix in ('travel to ', 'go to ', 'walk to ', 'head to '):
+        if text.startswith(prefix):
+            return {'type': 'travel', 'destination': text[len(prefix):].strip()}
+    for prefix in ('where is ', 'how do i get to ', 'way to '):
+        if text.startswith(prefix):
+            return {'type': 'hint', 'destination': text[len(prefix):].strip(' ?')}
+    directions = ['north', 'south', 'east', 'west', 'up', 'down', 'northeast', 'northwest', 'southeast', 'southwest']
+    for direction in directions:
+        if f'go {direction}' in text or f'move {direction}' in text or text == direction:
+            return {'type': 'movement', 'direction': direction}
+    if text.startswith('look') or text == 'examine':
+        return {'type': 'examine', 'target': text.replace('look at', '').replace('look', '').strip()}
+    if text.startswith('take') or text.startswith('get'):
+        item = text.replace('take', '').replace('get', '').strip()
+        return {'type': 'take', 'item': item}
+    if text.startswith('use') or text.startswith('cast'):
+        item = text.replace('use', '').replace('cast', '').strip()
+        return {'type': 'use', 'item': item}
+    if text in ['inventory', 'inv', 'items']:
+        return {'type': 'inventory'}
+    if text.startswith('talk to') or text.startswith('speak to'):
+        npc = text.replace('talk to', '').replace('speak to', '').strip()
+        return {'type': 'dialogue', 'npc': npc}
+    if text in ['help', 'commands']:
+        return {'type': 'help'}
+    if 'roll' in text:
+        dice_match = re.search(r'\d+d\d+(?:[+-]\d+)?', text)
+        dice = dice_match.group() if dice_match else '1d20'
+        return {'type': 'dice', 'notation': dice}
+    return {'type': 'general', 'text': user_input}
+
+
+# (type, argument key, verbs both parsers know)
+GRAMMAR = [
+    ('take', 'item', ['take', 'get']),
+    ('use', 'item', ['use', 'cast']),
+    ('examine', 'target', ['look at']),
+    ('dialogue', 'npc', ['talk to', 'speak to']),
+    ('travel', 'destination', ['travel to', 'go to', 'walk to', 'head to']),
+    ('hint', 'destination', ['where is', 'how do i get to']),
+    ('movement', 'direction', ['go', 'move']),
+]
+NOUNS = ['sword', 'target', 'gadget', 'lantern', 'usb stick', 'cast iron pan', 'rusty sword', 'village elder',
+         'blacksmith', 'tavern keeper', 'forest path', 'beget stone', 'fuse box', 'look out tower', 'scroll']
+DIRECTION_WORDS = ['north', 'south', 'east', 'west', 'up', 'down', 'northeast', 'northwest', 'southeast', 'southwest']
+ARTICLES = ['', '', 'the ', 'a ']
+LEAD_INS = ['', '', '', "let's ", 'please ']
+ENDINGS = ['', '', '', '.', '!', '?']
+
+
+def known_noun(name):
+    """is_known for the generated commands: every noun in NOUNS is in the world"""
+    words = name.split()
+    return ' '.join(words[1:] if words[:1] in (['the'], ['a']) else words) in NOUNS
+
+
+def generate(rng):
+    """(input, expected type, argument key, expected argument)"""
+    command_type, key, verbs = rng.choice(GRAMMAR)
+    verb = rng.choice(verbs)
+    if command_type == 'movement':
+        argument = rng.choice(DIRECTION_WORDS)
+        return f"{rng.choice(LEAD_INS)}{verb} {argument}{rng.choice(ENDINGS)}", command_type, key, argument
+    argument = rng.choice(ARTICLES) + rng.choice(NOUNS)
+    text = f"{verb} {argument}{rng.choice(ENDINGS)}"
+    if rng.random() < 0.3:
+        text = text.title() if rng.random() < 0.5 else text.upper()
+    return text, command_type, key, argument
+
+
+def legacy_errors(cases, seed):
+    rng = random.Random(seed)
+    legacy_wrong = {}
+    for _ in range(cases):
+        text, command_type, key, argument = generate(rng)
+        old = legacy_parse_adventure_command(text)
+        if old['type'] == command_type and old.get(key) == argument:
+            continue
+        if old['type'] == command_type and old.get(key, '').rstrip('.!?') == argument:
+            kind = f"{command_type}: trailing punctuation kept in the argument"
+        elif old['type'] == command_type:
+            kind = f"{command_type}: argument mangled"
+        else:
+            kind = f"{command_type} read as {old['type']}"
+        legacy_wrong[kind] = legacy_wrong.get(kind, 0) + 1
+
+    print(f"{cases:,} generated commands, old parser wrong on {sum(legacy_wrong.values()):,}")
+    for kind, count in sorted(legacy_wrong.items(), key=lambda item: -item[1]):
+        print(f"  {count:6,}  {kind}")
+
+
+def bench(label, func, messages, number):
+    seconds = timeit.timeit(lambda: [func(m) for m in messages], number=number)
+    per_call = seconds / (number * len(messages)) * 1e6
+    print(f"  {label:<10} {per_call:8.2f} us/call")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cases', type=int, default=20000)
+    parser.add_argument('--number', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    legacy_errors(args.cases, args.seed)
+
+    rng = random.Random(args.seed)
+    for name, messages in [
+        ('commands', [generate(rng)[0] for _ in range(50)]),
+        ('conversation', ["I had such a long day at work today, honestly", "what do you think about dragons?"]),
+    ]:
+        print(f"{name}:")
+        legacy = bench('legacy', legacy_parse_adventure_command, messages, args.number)
+        trie = bench('trie', lambda text: parse_adventure_command(text, None, known_noun), messages, args.number)
+        print(f"  speedup    {legacy / trie:8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
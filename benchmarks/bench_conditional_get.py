@@ -0,0 +1,128 @@
+"""
+Polling load test for /memory and /world in app_new.py: response bytes, server
+CPU time and SQL statements per poll, with one /chat every --chat-every polls
+so the version counters keep moving.
+
+Scenarios:
+  uncached     payload cache disabled, clients ignore ETags (previous behaviour)
+  cached       in-process payload cache, clients ignore ETags
+  conditional  payload cache, clients revalidate with If-None-Match
+
+Usage: python benchmarks/bench_conditional_get.py [--polls N] [--history N] [--chat-every N]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sharding import DEFAULT_USER_ID  # owner of the seeded history
+
+# What the two frontends poll
+POLLED_URLS = ['/memory?limit=10', '/memory?fields=id', '/memory', '/world']
+
+
+def seed_history(app, db, Conversation, count):
+    started = datetime.utcnow() - timedelta(seconds=count)
+    with app.app_context():
+        db.session.bulk_insert_mappings(Conversation, [{
+            'timestamp': started + timedelta(seconds=i),
+            'user_input': f"message number {i} about the stars and the forest",
+            'ai_response': "That sounds wonderful, tell me more about how it made you feel.",
+            'detected_emotion': random.choice(['joy', 'sadness', 'curiosity', 'neutral']),
+            'location_name': 'Cozy Space',
+            'relationship_depth': i // 10 + 1
+        } for i in range(count)])
+        db.session.commit()
+
+
+def run(client, payload_cache, scenario, polls, chat_every, counter):
+    payload_cache.maxsize = 0 if scenario == 'uncached' else 128
+    payload_cache.invalidate()
+    etags = {}
+    body_bytes = not_modified = 0
+    counter['statements'] = 0
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    for i in range(polls):
+        if i and i % chat_every == 0:
+            client.post('/chat', json={'message': 'go north' if i % (2 * chat_every) else 'hello there'},
+                        headers={'X-User-Id': DEFAULT_USER_ID})
+            counter['statements'] -= counter['last_chat']
+
+        url = POLLED_URLS[i % len(POLLED_URLS)]
+        headers = {'X-User-Id': DEFAULT_USER_ID}
+        if scenario == 'conditional' and url in etags:
+            headers['If-None-Match'] = etags[url]
+        response = client.get(url, headers=headers)
+        assert response.status_code in (200, 304), response.data
+        if response.status_code == 304:
+            not_modified += 1
+        etags[url] = response.headers['ETag']
+        body_bytes += len(response.data)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    return {
+        'scenario': scenario,
+        'polls_per_s': polls / elapsed,
+        'cpu_us_per_poll': cpu / polls * 1e6,
+        'bytes_per_poll': body_bytes / polls,
+        'sql_per_poll': counter['statements'] / polls,
+        'not_modified': not_modified / polls
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--polls', type=int, default=4000)
+    parser.add_argument('--history', type=int, default=5000, help='conversations seeded before polling')
+    parser.add_argument('--chat-every', type=int, default=50, help='polls between /chat requests')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ['TRUST_USER_HEADER'] = '1'
+
+    import logging
+    from sqlalchemy import event
+    from app_new import app, db, Conversation, payload_cache
+    logging.disable(logging.CRITICAL)
+    random.seed(args.seed)
+    seed_history(app, db, Conversation, args.history)
+
+    counter = {'statements': 0, 'last_chat': 0}
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count(*_):
+        counter['statements'] += 1
+
+    # Measure what one /chat costs so it can be excluded from the per-poll numbers
+    client = app.test_client()
+    before = counter['statements']
+    client.post('/chat', json={'message': 'hello there'}, headers={'X-User-Id': DEFAULT_USER_ID})
+    counter['last_chat'] = counter['statements'] - before
+
+    print(f"{args.polls} polls over {', '.join(POLLED_URLS)}; /chat every {args.chat_every} polls; "
+          f"{args.history} conversations")
+    print(f"{'scenario':<12} {'polls/s':>9} {'CPU us/poll':>12} {'bytes/poll':>11} {'SQL/poll':>9} {'304s':>6}")
+    results = [run(client, payload_cache, scenario, args.polls, args.chat_every, counter)
+               for scenario in ('uncached', 'cached', 'conditional')]
+    for r in results:
+        print(f"{r['scenario']:<12} {r['polls_per_s']:>9,.0f} {r['cpu_us_per_poll']:>12,.0f} "
+              f"{r['bytes_per_poll']:>11,.0f} {r['sql_per_poll']:>9.2f} {r['not_modified']:>6.0%}")
+
+    baseline, best = results[0], results[-1]
+    print(f"conditional vs uncached: {1 - best['bytes_per_poll'] / baseline['bytes_per_poll']:.0%} fewer bytes, "
+          f"{1 - best['cpu_us_per_poll'] / baseline['cpu_us_per_poll']:.0%} less CPU per poll")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Dice engine vs the original random.randint list comprehension: roll latency
+across pool sizes (the original is skipped where its list would not fit the
+time budget), then the cost of exact distributions for "odds" questions.
+
+Usage: python benchmarks/bench_dice.py [--number N]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dice  # noqa: E402
+from utils import roll_dice, dice_odds  # noqa: E402
+
+
+def legacy_roll_dice(dice_notation="1d20"):
+    """The pre-NumPy implementation, kept here for comparison"""
+    match = re.match(r'(\d+)d(\d+)([+-]\d+)?', dice_notation.lower())
+    if not match:
+        return {"error": "Invalid dice notation"}
+    num_dice = int(match.group(1))
+    dice_sides = int(match.group(2))
+    modifier = int(match.group(3)) if match.group(3) else 0
+    rolls = [random.randint(1, dice_sides) for _ in range(num_dice)]
+    total = sum(rolls) + modifier
+    return {"notation": dice_notation, "rolls": rolls, "modifier": modifier, "total": total,
+            "description": f"Rolled {num_dice}d{dice_sides}: {rolls} = {total}"}
+
+
+def per_call(func, notation, number):
+    return timeit.timeit(lambda: func(notation), number=number) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    print("rolls (us/call):")
+    for notation, legacy in [('1d20', True), ('3d6+2', True), ('100d6', True), ('10000d6', True),
+                             ('1000000d6', True), ('1000000000d6', False), ('4d6kh3', False),
+                             ('1000000d6kh3', False), ('10000d6!', False)]:
+        number = max(1, args.number // max(1, dice.parse(notation).count // 100)) if legacy else args.number // 10
+        new = per_call(roll_dice, notation, number)
+        if legacy:
+            old = per_call(legacy_roll_dice, notation, number)
+            print(f"  {notation:<14} legacy {old:12.1f}   engine {new:9.1f}   speedup {old / new:7.1f}x")
+        else:
+            print(f"  {notation:<14} legacy {'-':>12}   engine {new:9.1f}")
+
+    print("exact odds (ms/call):")
+    for notation in ['1d20 adv', '3d6', '4d6kh3', '10d6!', '100d20', '1000d100', '10000d100', '20d20kh5']:
+        number = 5 if dice.parse(notation).count >= 1000 else 50
+        elapsed = timeit.timeit(lambda: dice_odds(notation, 10), number=number) / number * 1e3
+        stats = dice_odds(notation, 10)
+        print(f"  {notation:<12} {elapsed:8.2f} ms   mean {stats['mean']:>10}   P(>=10) {stats['p_at_least']:.4f}")
+
+
+if __name__ == '__main__':
+    main()
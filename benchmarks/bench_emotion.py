@@ -0,0 +1,115 @@
+"""
+Microbenchmark: compiled single-pass emotion matcher vs the original
+per-keyword substring scan. Also checks that both label the sample
+messages, including inflected keywords, the same way.
+
+Usage: python benchmarks/bench_emotion.py [--number N]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from utils import detect_emotion  # noqa: E402
+
+
+def legacy_detect_emotion(text):
+    """The pre-compiled-matcher implementation, kept here for comparison"""
+    text_lower = text.lower()
+    emotion_patterns = {
+        'happy': ['happy', 'joy', 'excited', 'great', 'wonderful', 'amazing', 'love', 'awesome', 'fantastic', '😊', '😄', '🎉'],
+        'sad': ['sad', 'depressed', 'down', 'upset', 'crying', 'tears', 'heartbroken', 'miserable', '😢', '😭'],
+        'anxious': ['worried', 'nervous', 'anxious', 'stressed', 'panic', 'fear', 'scared', 'overwhelmed'],
+        'angry': ['angry', 'mad', 'furious', 'annoyed', 'frustrated', 'rage', 'irritated', '😠', '😡'],
+        'curious': ['wonder', 'curious', 'interesting', 'what', 'how', 'why', 'tell me', 'explain'],
+        'nostalgic': ['remember', 'reminds me', 'used to', 'childhood', 'miss', 'old days', 'back then'],
+        'grateful': ['thank', 'appreciate', 'grateful', 'blessed', 'lucky'],
+        'lonely': ['alone', 'lonely', 'isolated', 'nobody', 'empty', 'miss people'],
+        'excited': ['can\'t wait', 'excited', 'thrilled', 'pumped', 'looking forward'],
+        'confused': ['confused', 'don\'t understand', 'what do you mean', 'unclear', 'lost']
+    }
+    emotion_scores = {}
+    for emotion, keywords in emotion_patterns.items():
+        score = sum(1 for keyword in keywords if keyword in text_lower)
+        if score > 0:
+            emotion_scores[emotion] = score
+    if emotion_scores:
+        max_emotion = None
+        max_score = 0
+        for emotion, score in emotion_scores.items():
+            if score > max_score:
+                max_score = score
+                max_emotion = emotion
+        return max_emotion
+    return 'neutral'
+
+
+SHORT_MESSAGES = [
+    "Hey Alex, how are you?",
+    "I'm feeling a bit sad today",
+    "Thank you so much 😊",
+    "Let's go north",
+]
+
+# Keywords with suffixes: the compiled matcher must still find them at the start of a word
+INFLECTED_MESSAGES = [
+    "Thanks so much!",
+    "I was wondering…",
+    "I missed you",
+    "I appreciated that",
+    "Thankfully it worked out",
+    "Remembering the old days",
+    "That was so upsetting",
+    "That's the saddest story",
+    "Stop panicking",
+    "Everyone keeps explaining it",
+]
+
+LONG_MESSAGE = (
+    "So today was one of those days where everything happened at once. I woke up late, "
+    "missed the bus, and then spent the whole morning worried about the presentation. "
+    "It went fine in the end, and honestly my team was wonderful about it, but I still "
+    "feel kind of overwhelmed. It reminds me of back when I used to cram for exams in "
+    "school. Anyway, I can't wait for the weekend, we're finally going hiking. "
+) * 8
+
+
+def bench(label, func, messages, number):
+    seconds = timeit.timeit(lambda: [func(m) for m in messages], number=number)
+    per_call = seconds / (number * len(messages)) * 1e6
+    print(f"  {label:<10} {per_call:8.2f} us/call")
+    return per_call
+
+
+def check_equivalence(messages):
+    mismatches = [(m, legacy_detect_emotion(m), detect_emotion(m)) for m in messages
+                  if legacy_detect_emotion(m) != detect_emotion(m)]
+    for message, legacy, compiled in mismatches:
+        print(f"  mismatch: {message!r}: legacy {legacy}, compiled {compiled}")
+    print(f"label check: {len(messages) - len(mismatches)}/{len(messages)} messages agree")
+    return not mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    if not check_equivalence(SHORT_MESSAGES + INFLECTED_MESSAGES):
+        return 1
+
+    for name, messages, number in [
+        ('short messages', SHORT_MESSAGES, args.number),
+        ('long message', [LONG_MESSAGE], max(args.number // 10, 1)),
+    ]:
+        print(f"{name} ({len(messages[0])} chars):")
+        legacy = bench('legacy', legacy_detect_emotion, messages, number)
+        compiled = bench('compiled', detect_emotion, messages, number)
+        print(f"  speedup    {legacy / compiled:8.2f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+Throughput benchmark: detect_emotions() on a batch vs detect_emotion() per text.
+Also checks that both return the same labels.
+
+Usage: python benchmarks/bench_emotion_batch.py [--texts N] [--seed S]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from utils import EMOTION_PATTERNS, detect_emotion, detect_emotions  # noqa: E402
+
+FILLER = ("today", "the", "and", "I", "was", "really", "about", "with", "you", "it's",
+          "so", "we", "went", "to", "a", "place", "that", "feels", "like", "home")
+SUFFIXES = ("", "", "s", "ed", "ing", "ly", "ness")
+
+
+def make_texts(count, seed):
+    rng = random.Random(seed)
+    keywords = [kw for kws in EMOTION_PATTERNS.values() for kw in kws]
+    texts = []
+    for _ in range(count):
+        words = [rng.choice(FILLER) for _ in range(rng.randint(3, 40))]
+        for _ in range(rng.randint(0, 3)):
+            words.insert(rng.randrange(len(words) + 1), rng.choice(keywords) + rng.choice(SUFFIXES))
+        texts.append(" ".join(words) + rng.choice([".", "!", "?", ""]))
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--texts', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    texts = make_texts(args.texts, args.seed)
+
+    started = time.perf_counter()
+    single = [detect_emotion(text) for text in texts]
+    single_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batch = detect_emotions(texts)
+    batch_seconds = time.perf_counter() - started
+
+    mismatches = sum(1 for a, b in zip(single, batch['emotions']) if a != b)
+    print(f"{len(texts)} texts")
+    print(f"  per-text  {len(texts) / single_seconds:12,.0f} texts/s")
+    print(f"  batch     {len(texts) / batch_seconds:12,.0f} texts/s")
+    print(f"  label mismatches: {mismatches}")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
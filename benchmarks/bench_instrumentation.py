@@ -0,0 +1,63 @@
+"""
+Overhead of instrumentation.py on app_new's /chat: requests per second with
+INSTRUMENTATION off and on (each in its own process, since the setting is read
+at import), plus the cost of a disabled and an enabled stage() block.
+
+Usage: python benchmarks/bench_instrumentation.py [--requests N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+MESSAGES = ["I'm so happy today!", "I feel a bit sad tonight", "go north", "roll 2d6+1", "What about the stars?"]
+
+
+def run_chat(requests):
+    import logging
+    import random
+    import time
+    from app_new import app
+    logging.disable(logging.CRITICAL)
+    random.seed(7)
+    client = app.test_client()
+    for message in MESSAGES:  # warm-up
+        client.post('/chat', json={'message': message})
+    started = time.perf_counter()
+    for i in range(requests):
+        assert client.post('/chat', json={'message': MESSAGES[i % len(MESSAGES)]}).status_code == 200
+    print(f"{requests / (time.perf_counter() - started):.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_chat(args.requests)
+        return
+
+    from instrumentation import Instrumentation
+    for label, enabled in (('disabled', False), ('enabled', True)):
+        instrumentation = Instrumentation(enabled=enabled)
+
+        def block():
+            with instrumentation.stage('bench'):
+                pass
+        print(f"stage() {label}: {timeit.timeit(block, number=200_000) / 200_000 * 1e9:.0f} ns")
+
+    for mode in ('0', '1'):
+        env = dict(os.environ, INSTRUMENTATION=mode, THOUGHT_WORKER='off',
+                   DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', '--requests',
+                                 str(args.requests)], env=env, capture_output=True, text=True, check=True)
+        print(f"/chat with INSTRUMENTATION={mode}: {output.stdout.strip().splitlines()[-1]} req/s")
+
+
+if __name__ == '__main__':
+    main()
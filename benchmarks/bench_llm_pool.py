@@ -0,0 +1,79 @@
+"""
+Time llm_client.LLMClientPool against the local fake OpenAI server and print
+its queue depth / latency metrics. The pool's behaviour (concurrency cap,
+coalescing, retries, timeouts) is covered by tests/test_llm_pool.py.
+
+Usage: python benchmarks/bench_llm_pool.py [--callers N] [--concurrency N] [--delay S]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fake_openai import start_fake_openai  # noqa: E402
+from llm_client import LLMClientPool  # noqa: E402
+
+
+def run(pool, callers, distinct_prompts):
+    peak_queue = 0
+    stop = threading.Event()
+
+    def watch():
+        nonlocal peak_queue
+        while not stop.is_set():
+            peak_queue = max(peak_queue, pool.metrics()['queue_depth'])
+            time.sleep(0.002)
+
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        replies = list(executor.map(
+            lambda i: pool.chat([{'role': 'user', 'content': f'prompt {i % distinct_prompts}'}], model='fake'),
+            range(callers)
+        ))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    watcher.join()
+    return replies, elapsed, peak_queue
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--callers', type=int, default=64)
+    parser.add_argument('--distinct', type=int, default=32, help='distinct prompts among the callers')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--delay', type=float, default=0.05, help='fake upstream latency in seconds')
+    args = parser.parse_args()
+
+    fake = start_fake_openai(first_token_delay=args.delay)
+    pool = LLMClientPool(base_url=fake.base_url, api_key='fake', max_concurrency=args.concurrency,
+                         backoff_base=0.01)
+    _, elapsed, peak_queue = run(pool, args.callers, args.distinct)
+    metrics = pool.metrics()
+
+    print(f"{args.callers} callers, {args.distinct} distinct prompts in {elapsed * 1000:.0f} ms")
+    print(f"  upstream requests {fake.requests_served}, peak upstream concurrency {fake.max_active} "
+          f"(limit {args.concurrency}), peak queue depth {peak_queue}")
+    pool.close()
+
+    flaky = start_fake_openai(fail_first=2)
+    retrying = LLMClientPool(base_url=flaky.base_url, api_key='fake', backoff_base=0.01)
+    started = time.perf_counter()
+    retrying.chat([{'role': 'user', 'content': 'hi'}], model='fake')
+    print(f"  after 2 upstream 503s: reply in {(time.perf_counter() - started) * 1000:.0f} ms")
+    retrying.close()
+
+    print(json.dumps(metrics, indent=2))
+    fake.shutdown()
+    flaky.shutdown()
+
+
+if __name__ == '__main__':
+    main()
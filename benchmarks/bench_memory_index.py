@@ -0,0 +1,142 @@
+"""
+Benchmark for memory_index.py: indexes --turns synthetic conversation turns
+for one user in batches (as the background indexer and `flask build-memory-index`
+do), reopens the memory-mapped files the way a fresh worker would, and times
+top-k searches. Turn words follow a Zipf distribution over --vocabulary words,
+as a long conversation history does; recall@k is measured against exact
+(unhashed) TF-IDF over the same turns, which is what the hashing trades away.
+
+Usage: python benchmarks/bench_memory_index.py [--turns N] [--dim N] [--vocabulary N] [--queries N]
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+VOCABULARY = [f"{stem}{suffix}" for stem in (
+    'garden', 'sister', 'brother', 'guitar', 'hiking', 'paint', 'novel', 'coffee', 'lisbon', 'exam', 'project',
+    'deadline', 'puppy', 'kitten', 'recipe', 'marathon', 'piano', 'chess', 'ocean', 'mountain', 'concert',
+    'office', 'manager', 'birthday', 'wedding', 'doctor', 'movie', 'podcast', 'bakery', 'train', 'winter',
+    'summer', 'rain', 'library', 'poem', 'camera', 'bicycle', 'soup', 'festival', 'museum'
+) for suffix in ('', 's', 'ing', 'er', 'ful')]
+FILLER = "today I think that it was kind of a day and I felt like talking about".split()
+REPLY = "That sounds meaningful. Tell me more about how it made you feel?"
+
+
+class Vocabulary:
+    """VOCABULARY plus numbered topic words up to `size`, drawn with Zipf weights"""
+
+    def __init__(self, size, rng):
+        self.words = VOCABULARY + [f"topic{n}" for n in range(max(0, size - len(VOCABULARY)))]
+        rng.shuffle(self.words)
+        self.weights = [1 / (rank + 1) ** 1.1 for rank in range(len(self.words))]
+        self.rng = rng
+
+    def sample(self, k):
+        return self.rng.choices(self.words, self.weights, k=k)
+
+
+def turn_text(vocabulary, rng):
+    words = vocabulary.sample(4) + rng.sample(FILLER, 6)
+    rng.shuffle(words)
+    return f"{' '.join(words)}\n{REPLY}"
+
+
+def exact_scores(turns, queries):
+    """TF-IDF cosine without hashing, scored as UserIndex.search does: {row: score} per query"""
+    from memory_index import tokenize
+    postings = {}
+    for row, text in enumerate(turns):
+        counts = {}
+        for word in tokenize(text):
+            counts[word] = counts.get(word, 0) + 1
+        norm = math.sqrt(sum(math.log1p(count) ** 2 for count in counts.values()))
+        for word, count in counts.items():
+            postings.setdefault(word, []).append((row, math.log1p(count) / norm))
+    results = []
+    for query in queries:
+        counts = {}
+        for word in tokenize(query):
+            counts[word] = counts.get(word, 0) + 1
+        scores = {}
+        for word, count in counts.items():
+            idf = math.log((1 + len(turns)) / (1 + len(postings.get(word, ())))) + 1
+            for row, value in postings.get(word, ()):
+                scores[row] = scores.get(row, 0.0) + math.log1p(count) * idf * idf * value
+        results.append(scores)
+    return results
+
+
+def recall(found, scores, k):
+    """Share of the exact top-k (ties at the k-th score included) among the k returned"""
+    ranked = sorted(scores.values(), reverse=True)
+    if not ranked:
+        return None
+    kth = ranked[min(k, len(ranked)) - 1]
+    relevant = {row for row, score in scores.items() if score >= kth - 1e-9}
+    return len(found & relevant) / min(k, len(ranked))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--turns', type=int, default=100_000)
+    parser.add_argument('--dim', type=int, default=None, help='hash buckets (default: memory_index.DEFAULT_DIM)')
+    parser.add_argument('--vocabulary', type=int, default=20_000)
+    parser.add_argument('--batch', type=int, default=1000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--recall-queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=9)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from memory_index import DEFAULT_DIM, MemoryIndex
+    dim = args.dim or DEFAULT_DIM
+    rng = random.Random(7)
+    vocabulary = Vocabulary(args.vocabulary, rng)
+    directory = tempfile.mkdtemp()
+    turns = [turn_text(vocabulary, rng) for _ in range(args.turns)]
+
+    index = MemoryIndex(directory, dim=dim).user_index(None, 'bench')
+    started = time.perf_counter()
+    for offset in range(0, args.turns, args.batch):
+        index.append([(turn_id + 1, turns[turn_id]) for turn_id in range(offset, min(args.turns, offset + args.batch))])
+    elapsed = time.perf_counter() - started
+    print(f"dim {dim}: indexed {index.count:,} turns in {elapsed:.1f}s ({index.count / elapsed:,.0f} turns/s), "
+          f"files {index.nbytes / 2 ** 20:,.1f} MiB")
+
+    started = time.perf_counter()
+    index.append([(args.turns + 1, turn_text(vocabulary, rng))])
+    print(f"single insert: {(time.perf_counter() - started) * 1000:.2f} ms")
+
+    started = time.perf_counter()
+    reopened = MemoryIndex(directory, dim=dim).user_index(None, 'bench')
+    print(f"reopen (mmap + document frequencies): {(time.perf_counter() - started) * 1000:.1f} ms, "
+          f"{reopened.count:,} rows")
+
+    queries = [' '.join(vocabulary.sample(2) + ['how', 'is', 'my']) for _ in range(args.queries)]
+    # Warm the page cache, as a long-running worker would be
+    for query in queries[:10]:
+        reopened.search(query, args.k)
+    latencies = []
+    hits = 0
+    for query in queries:
+        started = time.perf_counter()
+        results = reopened.search(query, args.k, min_score=0.1)
+        latencies.append(time.perf_counter() - started)
+        hits += bool(results)
+    latencies.sort()
+    print(f"search top-{args.k} over {reopened.count:,} turns: p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms, {hits}/{len(queries)} queries with matches")
+
+    queries = queries[:args.recall_queries]
+    recalls = [recall({turn_id - 1 for turn_id, _ in reopened.search(query, args.k)}, scores, args.k)
+               for query, scores in zip(queries, exact_scores(turns, queries))]
+    recalls = [value for value in recalls if value is not None]
+    print(f"recall@{args.k} against exact TF-IDF: {sum(recalls) / len(recalls):.3f} over {len(recalls)} queries")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark for /memory/search (fulltext.py) on SQLite FTS5: seeds --rows
+conversations spread over --users users, with one heavy user holding
+--heavy-share of them, builds the index the way a first start on an existing
+database does, then times searches for rare and common words and a
+prefix query, both through search_conversations and through the endpoint.
+
+Usage: python benchmarks/bench_memory_search.py [--rows N] [--users N] [--heavy-share F]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+COMMON = "today feel think really good time work day friend little home love".split()
+RARE = [f"{stem}{suffix}" for stem in (
+    'lisbon', 'mural', 'violin', 'marathon', 'sourdough', 'telescope', 'kayak', 'origami', 'glacier', 'fossil',
+    'harbor', 'lantern', 'orchard', 'compass', 'quartz', 'saffron', 'tundra', 'zeppelin', 'walnut', 'beacon'
+) for suffix in ('', 's', 'ing')]
+REPLY = "That sounds lovely. Tell me more about how it made you feel today?"
+
+
+def seed(connection, rows, users, heavy_share, rng):
+    started = datetime(2024, 1, 1)
+    batch = 50_000
+    for offset in range(0, rows, batch):
+        conversations = []
+        for i in range(offset, min(rows, offset + batch)):
+            user = 'heavy' if rng.random() < heavy_share else f"user-{rng.randrange(users)}"
+            words = rng.choices(COMMON, k=8) + ([rng.choice(RARE)] if rng.random() < 0.1 else [])
+            rng.shuffle(words)
+            conversations.append((i + 1, user, (started + timedelta(seconds=i)).isoformat(' '),
+                                  ' '.join(words), REPLY, 'neutral'))
+        connection.executemany(
+            "INSERT INTO conversation (id, user_id, timestamp, user_input, ai_response, detected_emotion) "
+            "VALUES (?, ?, ?, ?, ?, ?)", conversations)
+        connection.commit()
+
+
+def timed(function, repeats):
+    latencies = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = function()
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--heavy-share', type=float, default=0.1)
+    parser.add_argument('--repeats', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ.update(DATABASE_URL=f"sqlite:///{path}", SHARD_COUNT='1', WRITE_BEHIND='0',
+                      TRUST_USER_HEADER='1')
+
+    import logging
+    import sqlite3
+    from sqlalchemy import text
+    from app_new import app, db
+    from fulltext import install_fulltext, search_conversations
+    from sharding import use_shard
+    logging.disable(logging.CRITICAL)
+    rng = random.Random(args.seed)
+
+    # Seed without the triggers, then index everything at once as on an upgrade
+    with app.app_context():
+        engine = db.engine
+    with engine.begin() as connection:
+        for name in ('conversation_fts_insert', 'conversation_fts_update', 'conversation_fts_delete'):
+            connection.execute(text(f"DROP TRIGGER {name}"))
+        connection.execute(text("DROP TABLE conversation_fts"))
+    started = time.perf_counter()
+    connection = sqlite3.connect(path)
+    seed(connection, args.rows, args.users, args.heavy_share, rng)
+    print(f"seeded {args.rows:,} conversations in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    install_fulltext(engine)
+    print(f"built the FTS5 index in {time.perf_counter() - started:.1f}s")
+
+    def row_count(user):
+        return connection.execute("SELECT COUNT(*) FROM conversation WHERE user_id = ?", (user,)).fetchone()[0]
+
+    queries = [('rare word', RARE[0]), ('rare + common', f"{RARE[0]} today"),
+               ('common word', 'today'), ('common prefix', 'fr*')]
+    print(f"{'user':<22} {'query':<16} {'p50 ms':>8} {'p99 ms':>8} {'hits':>5}")
+    with app.app_context():
+        for user, label in (('user-1', 'typical'), ('heavy', 'heavy')):
+            label = f"{label} ({row_count(user):,} rows)"
+            with use_shard(None, user):
+                for name, query in queries:
+                    p50, p99, results = timed(lambda: search_conversations(db.session, user, query, 20),
+                                              args.repeats)
+                    print(f"{label:<22} {name:<16} {p50:>8.2f} {p99:>8.2f} {len(results):>5}")
+
+        client = app.test_client()
+        p50, p99, response = timed(lambda: client.get('/memory/search', query_string={'q': 'today'},
+                                                      headers={'X-User-Id': 'heavy'}), args.repeats)
+        print(f"GET /memory/search?q=today as the heavy user: p50 {p50:.2f} ms, p99 {p99:.2f} ms "
+              f"(status {response.status_code})")
+
+    # Triggers keep the index current for new rows
+    connection.execute("INSERT INTO conversation (user_id, timestamp, user_input, ai_response) "
+                       "VALUES ('user-1', datetime('now'), 'xylophone lessons', 'fun')")
+    connection.commit()
+    with app.app_context(), use_shard(None, 'user-1'):
+        found = search_conversations(db.session, 'user-1', 'xylophone', 5)
+    print(f"row inserted after the build found by search: {bool(found)}")
+
+
+if __name__ == '__main__':
+    main()
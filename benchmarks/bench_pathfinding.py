@@ -0,0 +1,124 @@
+"""
+Benchmark for pathfinding.py: generates a synthetic grid world of --rooms
+locations (a share of corridors missing, some one-way, and a few sealed rooms
+that nothing leads to), compiles it the way WorldEngine does, then times
+shortest-route queries between random reachable rooms.
+
+Usage: python benchmarks/bench_pathfinding.py [--rooms N] [--queries N] [--destinations N] [--seed N]
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+DIRECTIONS = (('east', 'west', 1, 0), ('south', 'north', 0, 1))
+
+
+def synthetic_world(rooms, rng, keep=0.75, one_way=0.05, sealed=0.002):
+    side = math.ceil(math.sqrt(rooms))
+    locations = {f"room_{i}": {'name': f"Room {i}", 'description': '', 'exits': {}} for i in range(rooms)}
+    for i in range(rooms):
+        x, y = i % side, i // side
+        for forward, back, dx, dy in DIRECTIONS:
+            j = (y + dy) * side + x + dx
+            if x + dx >= side or j >= rooms or rng.random() > keep:
+                continue
+            locations[f"room_{i}"]['exits'][forward] = f"room_{j}"
+            if rng.random() > one_way:
+                locations[f"room_{j}"]['exits'][back] = f"room_{i}"
+    for i in rng.sample(range(1, rooms), int(rooms * sealed)):
+        # Cut every way in (only grid neighbours can lead here), leaving the room's own exits
+        for forward, back, dx, dy in DIRECTIONS:
+            for j, direction in ((i - dy * side - dx, forward), (i + dy * side + dx, back)):
+                spec = locations.get(f"room_{j}")
+                if spec and spec['exits'].get(direction) == f"room_{i}":
+                    del spec['exits'][direction]
+    return {'current_location': 'room_0', 'locations': locations}
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return (latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000,
+            latencies[-1] * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rooms', type=int, default=100_000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--destinations', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from world_engine import World
+    rng = random.Random(args.seed)
+
+    data = synthetic_world(args.rooms, rng)
+    started = time.perf_counter()
+    world = World(data)
+    elapsed = time.perf_counter() - started
+    routes = world.routes
+    stats = routes.stats()
+    print(f"compiled {stats['locations']:,} rooms in {elapsed:.2f}s ({stats['strategy']}, "
+          f"{len(stats['landmarks'])} landmarks): {stats['components']:,} components, "
+          f"{stats['unreachable_from_start']:,} unreachable from {world.start}")
+
+    unreachable = set(routes.unreachable)
+    reachable = [location_id for location_id in world.locations if location_id not in unreachable]
+    # Travel mostly converges on a few well-known places; the rest go anywhere
+    popular = rng.sample(reachable, args.destinations)
+    runs = {
+        'random targets': [(rng.choice(reachable), rng.choice(reachable)) for _ in range(args.queries)],
+        f"{args.destinations} popular targets": [(rng.choice(reachable), rng.choice(popular))
+                                                 for _ in range(args.queries)],
+    }
+    for name, pairs in runs.items():
+        latencies, lengths, missing = [], [], 0
+        for source, target in pairs:
+            started = time.perf_counter()
+            path = routes.path(source, target)
+            latencies.append(time.perf_counter() - started)
+            if path is None:
+                # One-way corridors can still leave a reachable room with no way back
+                missing += 1
+            else:
+                lengths.append(len(path) - 1)
+        p50, p99, worst = percentiles(latencies)
+        print(f"{name}: p50 {p50:.3f} ms, p99 {p99:.3f} ms, max {worst:.1f} ms; "
+              f"mean route {sum(lengths) / len(lengths):.0f} moves, {missing} pairs without a route")
+
+    nearby = []
+    for _ in range(args.queries):
+        source = rng.choice(reachable)
+        target = source
+        # A room a few moves away, found by wandering its exits
+        for _ in range(rng.randint(5, 30)):
+            target = rng.choice(list(world.locations[target].exits.values()) or [target])
+        nearby.append((source, target))
+    routes._trees.clear()
+    latencies = []
+    for source, target in nearby:
+        started = time.perf_counter()
+        routes.path(source, target)
+        latencies.append(time.perf_counter() - started)
+    p50, p99, worst = percentiles(latencies)
+    print(f"nearby targets: p50 {p50:.3f} ms, p99 {p99:.3f} ms, max {worst:.1f} ms")
+
+    # Sealed rooms are ruled out by the component and landmark checks before any search
+    sealed = [location_id for location_id in unreachable if routes.component[routes.index[location_id]]
+              == routes.component[routes.index[world.start]]][:args.queries] or list(unreachable)[:args.queries]
+    if sealed:
+        latencies = []
+        for target in sealed:
+            started = time.perf_counter()
+            assert routes.path(world.start, target) is None
+            latencies.append(time.perf_counter() - started)
+        p50, p99, worst = percentiles(latencies)
+        print(f"queries to {len(sealed)} unreachable rooms: p50 {p50:.3f} ms, p99 {p99:.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
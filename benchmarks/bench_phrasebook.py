@@ -0,0 +1,63 @@
+"""
+Benchmark for phrasebook.py: builds a phrasebook with the stub backend
+(--rounds prompts per kind, emotion and topic), then compares opening it and
+sampling by emotion/topic against loading every phrase into Python lists.
+
+Usage: python benchmarks/bench_phrasebook.py [--rounds N] [--lines N] [--samples N] [--seed N]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from phrasebook import THOUGHT_EMOTIONS, Phrasebook, pregenerate  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--lines', type=int, default=100)
+    parser.add_argument('--samples', type=int, default=200_000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'phrasebook.bin')
+        started = time.perf_counter()
+        stats = pregenerate(path, backend='stub', rounds=args.rounds, lines_per_prompt=args.lines, seed=args.seed)
+        print(f"built {stats['kept']:,} phrases ({stats['duplicates']:,} duplicates) from "
+              f"{stats['candidates']:,} candidates in {time.perf_counter() - started:.2f}s, {stats['bytes']:,} bytes")
+
+        started = time.perf_counter()
+        book = Phrasebook(path)
+        print(f"open: {(time.perf_counter() - started) * 1000:.2f} ms")
+
+        rng = random.Random(args.seed)
+        queries = [('thought', rng.choice(THOUGHT_EMOTIONS), None) for _ in range(args.samples)]
+        started = time.perf_counter()
+        for kind, emotion, topic in queries:
+            book.sample(kind, emotion, topic, rng)
+        print(f"sample by emotion: {(time.perf_counter() - started) / args.samples * 1e6:.2f} us")
+
+        started = time.perf_counter()
+        # What the same pools cost as in-memory lists
+        pools = {}
+        for (kind, emotion, topic), (start, stop) in book.groups.items():
+            pools.setdefault((kind, emotion), []).extend(book.phrase(i) for i in range(start, stop))
+        resident = sum(sys.getsizeof(pool) + sum(map(sys.getsizeof, pool)) for pool in pools.values())
+        print(f"load all into lists: {(time.perf_counter() - started) * 1000:.1f} ms, "
+              f"{resident / 2 ** 20:.1f} MB of Python objects")
+        started = time.perf_counter()
+        for kind, emotion, _ in queries:
+            rng.choice(pools[(kind, emotion)])
+        print(f"random.choice from lists: {(time.perf_counter() - started) / args.samples * 1e6:.2f} us")
+        del pools
+        book.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Concurrent multi-user /chat load against app_new.py with one SQLite database
+versus SHARD_COUNT SQLite files, reporting throughput, latency and how many
+requests failed (e.g. "database is locked").
+
+Each layout runs in a fresh subprocess because the shard layout is read from
+the environment at import time.
+
+Usage: python benchmarks/bench_sharding.py [--shards 1,4,16] [--users N] [--threads N] [--requests N]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+def run_layout(args):
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    import logging
+    from app_new import app
+    logging.disable(logging.CRITICAL)
+
+    latencies = []
+    failures = 0
+    lock = threading.Lock()
+
+    def worker(thread_index):
+        nonlocal failures
+        client = app.test_client()
+        for i in range(args.requests):
+            user_id = f"user-{(thread_index + i * args.threads) % args.users}"
+            started = time.perf_counter()
+            response = client.post('/chat', json={'message': 'I feel happy today'}, headers={'X-User-Id': user_id})
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code != 200:
+                    failures += 1
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(json.dumps({
+        'requests': len(latencies),
+        'req_per_s': len(latencies) / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+        'failures': failures
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--shards', default='1,4,16', help='comma-separated shard counts to compare')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=100, help='per thread')
+    parser.add_argument('--run-layout', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_layout:
+        run_layout(args)
+        return
+
+    print(f"{args.threads} threads x {args.requests} /chat requests across {args.users} users")
+    print(f"{'shards':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'failed':>7}")
+    for shard_count in [int(value) for value in args.shards.split(',')]:
+        directory = tempfile.mkdtemp()
+        env = dict(os.environ,
+                   DATABASE_URL=f"sqlite:///{os.path.join(directory, 'companion.db')}",
+                   SHARD_COUNT=str(shard_count),
+                   TRUST_USER_HEADER='1',
+                   SHARD_DATABASE_URL=f"sqlite:///{os.path.join(directory, 'shard_{shard}.db')}")
+        output = subprocess.run(
+            [sys.executable, __file__, '--run-layout', '--users', str(args.users),
+             '--threads', str(args.threads), '--requests', str(args.requests)],
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{shard_count:>6} {result['req_per_s']:>8,.0f} {result['p50_ms']:>8.1f} "
+              f"{result['p99_ms']:>8.1f} {result['failures']:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Lock-contention benchmark for app_new.py on one SQLite file: several worker
+processes (as under gunicorn), each with several threads, post /chat at the
+same time. Compares SQLite's defaults (SQLITE_PROFILE=0) with the production
+profile (WAL, synchronous=NORMAL, mmap, cache, busy_timeout and a single
+writer connection per process), and reports throughput, latency and
+"database is locked" failures.
+
+Usage: python benchmarks/bench_sqlite_contention.py [--processes N] [--threads N] [--requests N]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+USERS = 50
+
+
+def setup(args):
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from app_new import app
+    client = app.test_client()
+    for user in range(USERS):
+        client.get('/world', headers={'X-User-Id': f"user-{user}"})
+
+
+def worker(args):
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    import logging
+    from app_new import app
+    logging.disable(logging.CRITICAL)
+
+    latencies = []
+    failures = 0
+    lock = threading.Lock()
+
+    def run(thread_index):
+        nonlocal failures
+        client = app.test_client()
+        for i in range(args.requests):
+            user_id = f"user-{(args.worker_index * args.threads + thread_index + i) % USERS}"
+            started = time.perf_counter()
+            response = client.post('/chat', json={'message': 'I feel happy today'}, headers={'X-User-Id': user_id})
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code != 200:
+                    failures += 1
+
+    # All workers start together
+    time.sleep(max(0.0, args.start_at - time.time()))
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(json.dumps({'latencies': latencies, 'failures': failures, 'finished': time.time()}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=50, help='per thread')
+    parser.add_argument('--role', choices=['setup', 'worker'], help=argparse.SUPPRESS)
+    parser.add_argument('--worker-index', type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument('--start-at', type=float, default=0.0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.role == 'setup':
+        return setup(args)
+    if args.role == 'worker':
+        return worker(args)
+
+    common = ['--threads', str(args.threads), '--requests', str(args.requests)]
+    print(f"{args.processes} processes x {args.threads} threads x {args.requests} /chat requests, one SQLite file")
+    print(f"{'profile':<9} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>9} {'failed':>7}")
+    for profile in ('0', '1'):
+        path = os.path.join(tempfile.mkdtemp(), 'companion.db')
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", SQLITE_PROFILE=profile,
+                   SHARD_COUNT='1', WRITE_BEHIND='0', TRUST_USER_HEADER='1')
+        subprocess.run([sys.executable, __file__, '--role', 'setup'], env=env, check=True, capture_output=True)
+
+        start_at = time.time() + 3
+        workers = [subprocess.Popen([sys.executable, __file__, '--role', 'worker', '--worker-index', str(index),
+                                     '--start-at', str(start_at)] + common,
+                                    env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+                   for index in range(args.processes)]
+        results = [json.loads(process.communicate()[0].strip().splitlines()[-1]) for process in workers]
+
+        latencies = sorted(latency for result in results for latency in result['latencies'])
+        elapsed = max(result['finished'] for result in results) - start_at
+        failures = sum(result['failures'] for result in results)
+        print(f"{'on' if profile == '1' else 'off':<9} {len(latencies) / elapsed:>8,.0f} "
+              f"{latencies[len(latencies) // 2] * 1000:>8.1f} {latencies[int(len(latencies) * 0.99)] * 1000:>9.1f} "
+              f"{failures:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Concurrent /chat load against app_new.py with synchronous commits versus the
+write-behind queue (WRITE_BEHIND=1), on one SQLite file. After each run the
+process exits normally and the stored rows are counted, to check the
+shutdown flush.
+
+Each mode runs in a fresh subprocess because the setting is read at import time.
+
+Usage: python benchmarks/bench_write_behind.py [--threads N] [--requests N] [--users N]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+def run_mode(args):
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    import logging
+    from app_new import app
+    logging.disable(logging.CRITICAL)
+
+    latencies = []
+    failures = 0
+    lock = threading.Lock()
+
+    def worker(thread_index):
+        nonlocal failures
+        client = app.test_client()
+        for i in range(args.requests):
+            user_id = f"user-{(thread_index + i * args.threads) % args.users}"
+            started = time.perf_counter()
+            response = client.post('/chat', json={'message': 'I feel happy today'}, headers={'X-User-Id': user_id})
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code != 200:
+                    failures += 1
+
+    # Create every user's state up front so the timed loop measures message writes only
+    client = app.test_client()
+    for user in range(args.users):
+        client.get('/world', headers={'X-User-Id': f"user-{user}"})
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(json.dumps({
+        'req_per_s': len(latencies) / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+        'failures': failures
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=100, help='per thread')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--run-mode', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        run_mode(args)
+        return
+
+    expected = args.threads * args.requests
+    print(f"{args.threads} threads x {args.requests} /chat requests across {args.users} users, SQLite")
+    print(f"{'mode':<13} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'failed':>7} {'stored':>7}")
+    for mode, write_behind in (('synchronous', '0'), ('write-behind', '1')):
+        path = os.path.join(tempfile.mkdtemp(), 'companion.db')
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", WRITE_BEHIND=write_behind, SHARD_COUNT='1',
+                   TRUST_USER_HEADER='1')
+        output = subprocess.run(
+            [sys.executable, __file__, '--run-mode', '--threads', str(args.threads),
+             '--requests', str(args.requests), '--users', str(args.users)],
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        stored = sqlite3.connect(path).execute("SELECT COUNT(*) FROM conversation").fetchone()[0]
+        print(f"{mode:<13} {result['req_per_s']:>8,.0f} {result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+              f"{result['failures']:>7} {stored:>4}/{expected}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Local fake of the OpenAI chat completions API for benchmarks and manual testing.
+
+Serves POST /v1/chat/completions (plain and stream=True) with a canned reply
+split into tokens, sleeping between tokens to imitate model latency.
+
+Usage:
+    python benchmarks/fake_openai.py --port 8901 --token-delay 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8901/v1 OPENAI_API_KEY=fake python main.py
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = ("That sounds like a lot to carry. I'm glad you told me. "
+                 "What part of it has been on your mind the most today?")
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        with self.server.lock:
+            self.server.requests_served += 1
+            failing = self.server.requests_served <= self.server.fail_first
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+
+        try:
+            if failing or self.server.status != 200:
+                self._send_json({'error': {'message': 'fake upstream error', 'type': 'server_error'}},
+                                status=self.server.status if self.server.status != 200 else 503)
+                return
+
+            time.sleep(self.server.first_token_delay)
+            if body.get('stream'):
+                self._stream(body)
+            else:
+                time.sleep(self.server.token_delay * len(self.server.tokens))
+                self._send_json(self._completion(body))
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def _completion(self, body):
+        return {
+            'id': f'chatcmpl-{uuid.uuid4().hex}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': ''.join(self.server.tokens)},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': len(self.server.tokens), 'total_tokens': len(self.server.tokens)}
+        }
+
+    def _stream(self, body):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        deltas = [{'role': 'assistant', 'content': ''}] + [{'content': token} for token in self.server.tokens]
+        for i, delta in enumerate(deltas):
+            if i > 1:
+                time.sleep(self.server.token_delay)
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': body.get('model', 'fake'),
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]
+            }
+            self._write_chunk(f'data: {json.dumps(chunk)}\n\n')
+        self._write_chunk('data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def tokenize_reply(reply):
+    """Split a reply into word-ish tokens that keep their leading space, like model deltas"""
+    words = reply.split(' ')
+    return [words[0]] + [' ' + word for word in words[1:]]
+
+
+def start_fake_openai(host='127.0.0.1', port=0, token_delay=0.0, first_token_delay=0.0,
+                      reply=DEFAULT_REPLY, status=200, fail_first=0, verbose=False):
+    """
+    Start the fake server on a background thread. The first `fail_first` requests get a 503.
+    Returns the server; its base URL is server.base_url and server.shutdown() stops it.
+    Counters: requests_served, max_active (peak concurrent requests).
+    """
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.token_delay = token_delay
+    server.first_token_delay = first_token_delay
+    server.tokens = tokenize_reply(reply)
+    server.status = status
+    server.verbose = verbose
+    server.lock = threading.Lock()
+    server.fail_first = fail_first
+    server.requests_served = 0
+    server.active = 0
+    server.max_active = 0
+    server.base_url = f'http://{host}:{server.server_address[1]}/v1'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8901)
+    parser.add_argument('--token-delay', type=float, default=0.02, help='seconds between streamed tokens')
+    parser.add_argument('--first-token-delay', type=float, default=0.2, help='seconds before the first token')
+    parser.add_argument('--reply', default=DEFAULT_REPLY)
+    parser.add_argument('--status', type=int, default=200, help='HTTP status to answer with (simulate outages)')
+    parser.add_argument('--fail-first', type=int, default=0, help='answer the first N requests with 503')
+    args = parser.parse_args()
+
+    server = start_fake_openai(args.host, args.port, args.token_delay, args.first_token_delay,
+                               args.reply, args.status, args.fail_first, verbose=True)
+    print(f"Fake OpenAI listening on {server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+"""
+Load test for app.py and app_new.py, in the style of Locust: --users virtual
+users, each with its own X-User-Id and keep-alive connection, pick weighted
+tasks (/chat, /chat/stream, /memory, /memory/search, /adventure, /emotion,
+/world, /analytics/emotions, /thoughts; whichever the app serves) in a loop
+for --duration seconds after a --warmup.
+
+Each app runs in its own subprocess behind a threaded WSGI server, on a
+fresh SQLite database seeded with --conversations conversations spread over
+the virtual users, and app.py talks to the local fake OpenAI server with
+--openai-latency before the first token. SQLAlchemy statements are counted
+per request on the server, in the request's own context, so background
+flushers and workers are not charged to a request.
+
+Per task it reports p50/p95/p99/max latency, throughput, errors and DB
+queries per request, and writes everything as JSON with --output. With
+--baseline it compares against an earlier JSON file and lists regressions;
+--fail-on-regression makes them the exit status, for CI.
+
+Usage:
+    python benchmarks/loadtest.py --app both --users 16 --duration 30 --output run.json
+    python benchmarks/loadtest.py --app app_new --baseline run.json --fail-on-regression
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+APPS = ('app', 'app_new')
+
+MESSAGES = [
+    "I'm so happy today, everything went great!",
+    "I feel a bit sad and lonely tonight",
+    "What do you think about the stars?",
+    "I'm worried about my exam tomorrow",
+    "Let's explore the forest and look around",
+    "go north",
+    "check my inventory",
+    "roll 2d6+1",
+    "Thanks for listening, I appreciate it",
+    "Do you remember what we talked about last week?",
+]
+SEARCH_TERMS = ['exam', 'forest', 'sister', 'music', 'stars', 'work', 'dragon', 'coffee']
+SEED_TOPICS = ['my exam', 'the forest trail', 'my sister', 'a new song', 'the stars', 'work', 'a dragon story',
+               'morning coffee', 'an old friend', 'the weekend']
+SEED_EMOTIONS = ['happy', 'sad', 'anxious', 'curious', 'nostalgic', 'grateful', 'lonely', 'excited', 'neutral']
+
+# Latency (p50/p95/p99) or throughput changes beyond this share count as regressions, and so
+# does any rise of more than QUERY_TOLERANCE statements per request (the task mix varies a little)
+DEFAULT_THRESHOLD = 0.2
+QUERY_TOLERANCE = 0.5
+
+Task = namedtuple('Task', 'name weight method path body')
+
+TASKS = [
+    Task('chat', 6, 'POST', '/chat', lambda rng: {'message': rng.choice(MESSAGES)}),
+    Task('chat_stream', 2, 'POST', '/chat/stream', lambda rng: {'message': rng.choice(MESSAGES)}),
+    Task('memory', 3, 'GET', lambda rng: '/memory?limit=20', None),
+    Task('memory_search', 1, 'GET', lambda rng: f'/memory/search?q={rng.choice(SEARCH_TERMS)}', None),
+    Task('adventure', 1, 'POST', '/adventure',
+         lambda rng: rng.choice([{'action': 'roll_dice', 'dice': '4d6kh3'}, {'action': 'start_adventure'},
+                                 {'action': 'dice_odds', 'dice': '2d20kh1', 'target': 15}])),
+    Task('emotion', 2, 'POST', '/emotion', lambda rng: {'text': rng.choice(MESSAGES)}),
+    Task('world', 1, 'GET', lambda rng: '/world', None),
+    Task('analytics', 1, 'GET', lambda rng: '/analytics/emotions?window=30d', None),
+    Task('thoughts', 1, 'GET', lambda rng: '/thoughts', None),
+]
+
+
+def percentile(ordered, share):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))] if ordered else None
+
+
+def summarize(latencies, errors, seconds, queries, query_seconds):
+    ordered = sorted(latencies)
+    count = len(ordered)
+    ms = lambda value: None if value is None else round(value * 1000, 3)  # noqa: E731
+    return {
+        'requests': count,
+        'errors': errors,
+        'rps': round(count / seconds, 2) if seconds else None,
+        'mean_ms': ms(sum(ordered) / count) if count else None,
+        'p50_ms': ms(percentile(ordered, 0.50)),
+        'p95_ms': ms(percentile(ordered, 0.95)),
+        'p99_ms': ms(percentile(ordered, 0.99)),
+        'max_ms': ms(ordered[-1] if ordered else None),
+        'queries_per_request': round(queries / count, 2) if count else None,
+        'query_ms_per_request': ms(query_seconds / count) if count else None,
+    }
+
+
+# Child process: one app under load
+
+def seed_database(module, users, conversations, rng):
+    """Insert `conversations` turns (with emotion rows) spread over `users`, through Core executemany"""
+    from sharding import shard_for, writer_engine
+    db, Conversation, EmotionalPattern, CompanionState = (module.db, module.Conversation, module.EmotionalPattern,
+                                                          module.CompanionState)
+    now = datetime.utcnow()
+    per_user = {user: conversations // len(users) + (i < conversations % len(users)) for i, user in enumerate(users)}
+    with module.app.app_context():
+        for user, count in per_user.items():
+            engine = writer_engine(db, shard_for(user))
+            turns = []
+            for i in range(count):
+                topic = rng.choice(SEED_TOPICS)
+                turns.append({
+                    'user_id': user,
+                    'timestamp': now - timedelta(minutes=(count - i) * 37),
+                    'user_input': f"I keep thinking about {topic}, it has been on my mind all day",
+                    'ai_response': f"Tell me more about {topic}. What makes it stand out for you?",
+                    'detected_emotion': rng.choice(SEED_EMOTIONS),
+                    'adventure_active': False,
+                    'location_name': 'Cozy Space',
+                    'relationship_depth': i // 10 + 1,
+                })
+            with engine.begin() as connection:
+                connection.execute(CompanionState.__table__.insert(), [{
+                    'user_id': user, 'name': 'Alex', 'current_mood': 'curious', 'conversations_count': count,
+                    'history_version': count, 'last_updated': now
+                }])
+                for start in range(0, len(turns), 1000):
+                    batch = turns[start:start + 1000]
+                    ids = connection.execute(Conversation.__table__.insert().returning(
+                        Conversation.__table__.c.id, sort_by_parameter_order=True), batch).scalars().all()
+                    connection.execute(EmotionalPattern.__table__.insert(), [{
+                        'user_id': user, 'emotion': turn['detected_emotion'], 'intensity': 1.0,
+                        'timestamp': turn['timestamp'], 'conversation_id': conversation_id
+                    } for turn, conversation_id in zip(batch, ids)])
+
+
+def install_query_counter(module):
+    """Count statements and their time per request, keyed by the X-Load-Task header"""
+    from flask import g, has_app_context, request
+    from sqlalchemy import event
+    import sharding
+
+    totals = {}
+    lock = threading.Lock()
+
+    def before_execute(*_):
+        if has_app_context() and g.get('load_task'):
+            g.load_started = time.perf_counter()
+
+    def after_execute(*_):
+        if has_app_context() and g.get('load_task'):
+            g.load_queries += 1
+            g.load_seconds += time.perf_counter() - g.load_started
+
+    with module.app.app_context():
+        engines = set(module.db.engines.values()) | set(sharding._writers.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', before_execute)
+        event.listen(engine, 'after_cursor_execute', after_execute)
+
+    @module.app.before_request
+    def start_counting():
+        g.load_task = None if request.headers.get('X-Load-Warmup') else request.headers.get('X-Load-Task')
+        g.load_queries, g.load_seconds = 0, 0.0
+
+    # A streamed response tears down twice (when the view returns and when the stream ends),
+    # so each teardown adds what was counted since the last one
+    @module.app.teardown_request
+    def stop_counting(_):
+        task = g.get('load_task')
+        if task:
+            with lock:
+                entry = totals.setdefault(task, [0, 0.0])
+                entry[0] += g.load_queries
+                entry[1] += g.load_seconds
+            g.load_queries, g.load_seconds = 0, 0.0
+
+    return totals
+
+
+def virtual_user(base_url, user, tasks, weights, deadline, warmup_until, think, seed, samples):
+    import httpx
+    rng = random.Random(seed)
+    with httpx.Client(base_url=base_url, timeout=120, headers={'X-User-Id': user}) as client:
+        while time.perf_counter() < deadline:
+            task = rng.choices(tasks, weights)[0]
+            warming = time.perf_counter() < warmup_until
+            path = task.path(rng) if callable(task.path) else task.path
+            headers = {'X-Load-Task': task.name}
+            if warming:
+                headers['X-Load-Warmup'] = '1'
+            started = time.perf_counter()
+            try:
+                response = client.request(task.method, path, headers=headers,
+                                          json=task.body(rng) if task.body else None)
+                ok = response.status_code < 500
+                if task.name == 'chat_stream':
+                    ok = ok and 'event: done' in response.text
+            except httpx.HTTPError:
+                ok = False
+            elapsed = time.perf_counter() - started
+            if not warming:
+                samples.append((task.name, elapsed, ok))
+            if think:
+                time.sleep(rng.uniform(0, think))
+
+
+def run_app(name, args):
+    workdir = tempfile.mkdtemp(prefix=f'loadtest-{name}-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'load.db')}"
+    os.environ.setdefault('SHARD_DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'shard_{shard}.db')}")
+    os.environ['MEMORY_INDEX_DIR'] = os.path.join(workdir, 'memory_index')
+    os.environ['TRUST_USER_HEADER'] = '1'
+    fake = None
+    if name == 'app':
+        sys.path.insert(0, os.path.dirname(__file__))
+        from fake_openai import start_fake_openai
+        fake = start_fake_openai(token_delay=args.token_delay, first_token_delay=args.openai_latency)
+        os.environ['OPENAI_BASE_URL'] = fake.base_url
+        os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+    sys.path.insert(0, REPO)
+    import logging
+    import importlib
+    from werkzeug.serving import make_server
+    module = importlib.import_module(name)
+    logging.disable(logging.CRITICAL)
+
+    rng = random.Random(args.seed)
+    users = [f'load-{i}' for i in range(args.users)]
+    started = time.perf_counter()
+    seed_database(module, users, args.conversations, rng)
+    seeded = time.perf_counter() - started
+
+    routes = {(rule.rule, method) for rule in module.app.url_map.iter_rules() for method in rule.methods}
+    tasks = [task for task in TASKS if args.tasks is None or task.name in args.tasks]
+    tasks = [task for task in tasks if ((task.path(rng) if callable(task.path) else task.path).split('?')[0],
+                                        task.method) in routes]
+    totals = install_query_counter(module)
+
+    server = make_server('127.0.0.1', 0, module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    samples = []
+    now = time.perf_counter()
+    warmup_until, deadline = now + args.warmup, now + args.warmup + args.duration
+    threads = [threading.Thread(target=virtual_user, args=(
+        base_url, user, tasks, [task.weight for task in tasks], deadline, warmup_until, args.think,
+        args.seed + i, samples)) for i, user in enumerate(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+    if fake is not None:
+        fake.shutdown()
+
+    result = {'seed_seconds': round(seeded, 2), 'tasks': {}}
+    for task in tasks:
+        mine = [sample for sample in samples if sample[0] == task.name]
+        queries, query_seconds = totals.get(task.name, (0, 0.0))
+        result['tasks'][task.name] = summarize([elapsed for _, elapsed, _ in mine],
+                                               sum(1 for *_, ok in mine if not ok),
+                                               args.duration, queries, query_seconds)
+    total_queries = sum(entry[0] for entry in totals.values())
+    total_query_seconds = sum(entry[1] for entry in totals.values())
+    result['total'] = summarize([elapsed for _, elapsed, _ in samples], sum(1 for *_, ok in samples if not ok),
+                                args.duration, total_queries, total_query_seconds)
+    return result
+
+
+# Parent process: run the apps, report, compare
+
+def metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'created': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'users': args.users,
+        'duration': args.duration,
+        'warmup': args.warmup,
+        'think': args.think,
+        'conversations': args.conversations,
+        'openai_latency': args.openai_latency,
+        'token_delay': args.token_delay,
+        'seed': args.seed,
+        'env': {key: os.environ[key] for key in ('WRITE_BEHIND', 'SHARD_COUNT', 'SQLITE_PROFILE', 'THOUGHT_WORKER',
+                                                 'MEMORY_INDEX', 'LLM_MAX_CONCURRENCY') if key in os.environ},
+    }
+
+
+def run_child(name, argv):
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+        output = f.name
+    try:
+        subprocess.run([sys.executable, os.path.abspath(__file__), *argv, '--app', name, '--child-output', output],
+                       check=True)
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        os.unlink(output)
+
+
+def print_report(results):
+    columns = ('requests', 'errors', 'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'queries_per_request')
+    for name, result in results['apps'].items():
+        print(f"\n{name} (seeded in {result['seed_seconds']}s)")
+        print(f"  {'task':<14}" + ''.join(f"{column:>20}" for column in columns))
+        for task, stats in [*result['tasks'].items(), ('TOTAL', result['total'])]:
+            print(f"  {task:<14}" + ''.join(f"{'-' if stats[c] is None else stats[c]:>20}" for c in columns))
+
+
+def compare(results, baseline, threshold):
+    """Print changes against `baseline`; returns the regressions found"""
+    regressions = []
+    print(f"\ncompared with {baseline['meta'].get('commit')} ({baseline['meta'].get('created')})")
+    for name, result in results['apps'].items():
+        old_result = baseline.get('apps', {}).get(name)
+        if old_result is None:
+            continue
+        for task, stats in [*result['tasks'].items(), ('TOTAL', result['total'])]:
+            old = old_result['total'] if task == 'TOTAL' else old_result['tasks'].get(task)
+            if not old or not old['requests'] or not stats['requests']:
+                continue
+            changes = []
+            for key in ('p50_ms', 'p95_ms', 'p99_ms', 'rps', 'queries_per_request'):
+                before, after = old[key], stats[key]
+                if not before or after is None:
+                    continue
+                change = (after - before) / before
+                worse = change < -threshold if key == 'rps' else (
+                    after > before + QUERY_TOLERANCE if key == 'queries_per_request' else change > threshold)
+                changes.append(f"{key} {before} -> {after} ({change:+.0%}){' REGRESSION' if worse else ''}")
+                if worse:
+                    regressions.append(f"{name} {task} {key}: {before} -> {after}")
+            print(f"  {name:<8} {task:<14} " + '; '.join(changes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app', choices=APPS + ('both',), default='both')
+    parser.add_argument('--users', type=int, default=8, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=10.0, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=2.0, help='unmeasured seconds first')
+    parser.add_argument('--think', type=float, default=0.0, help='max random pause between requests (seconds)')
+    parser.add_argument('--conversations', type=int, default=5000, help='conversations seeded before the run')
+    parser.add_argument('--openai-latency', type=float, default=0.05, help='fake OpenAI delay before the first token')
+    parser.add_argument('--token-delay', type=float, default=0.002, help='fake OpenAI delay between tokens')
+    parser.add_argument('--tasks', type=lambda text: text.split(','), help='comma-separated subset of tasks')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--baseline', help='earlier --output file to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--child-output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_output:
+        with open(args.child_output, 'w') as f:
+            json.dump({'apps': {args.app: run_app(args.app, args)}}, f)
+        return 0
+
+    # Each app in its own process: both configure the database and shards at import time.
+    # The child's --app comes last, so it overrides the one given here
+    argv = sys.argv[1:]
+    results = {'meta': metadata(args), 'apps': {}}
+    for name in (APPS if args.app == 'both' else (args.app,)):
+        results['apps'].update(run_child(name, argv)['apps'])
+
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            if args.fail_on_regression:
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import Response, request
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+    """
+
+    def __init__(self, maxsize=256, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, compute):
+        """Return the cached value for key, computing and storing it on a miss"""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key=None):
+        """Drop one key, or everything when key is None"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'ttl': self.ttl,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+def etag_for(key):
+    """Strong ETag value for a cache key; identical across worker processes"""
+    return hashlib.blake2b(repr(key).encode(), digest_size=12).hexdigest()
+
+
+def conditional_json(cache, key, build):
+    """
+    JSON response for `key`, which must change whenever the payload does (include
+    the relevant version counters). Answers a matching If-None-Match with 304 and
+    otherwise serves the rendered body from `cache`, calling build() on a miss.
+    """
+    etag = etag_for(key)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(cache.get_or_set(key, lambda: json.dumps(build())), mimetype='application/json')
+    response.set_etag(etag)
+    # Let browsers keep the copy but revalidate it on every poll
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
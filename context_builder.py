@@ -0,0 +1,200 @@
+"""
+Token-budgeted prompt assembly for the LLM app.
+
+Recent turns are packed newest-first until the budget is spent; whatever no
+longer fits is represented by a rolling summary kept in the database and
+folded forward a batch of turns at a time. Token counts use tiktoken when it
+is installed (pip install tiktoken) and a character/word heuristic otherwise.
+"""
+import re
+import threading
+from collections import deque
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # optional dependency
+    tiktoken = None
+
+# Per-message framing tokens in the chat format (role, separators)
+MESSAGE_OVERHEAD = 4
+REPLY_PRIMING = 2
+
+_WORD = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+class TokenCounter:
+    """Counts tokens with the model's tiktoken encoding, or estimates them"""
+
+    def __init__(self, model=None):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding('cl100k_base')
+            except Exception:
+                # Unknown model name, or the BPE file could not be fetched
+                try:
+                    self.encoding = tiktoken.get_encoding('cl100k_base')
+                except Exception:
+                    self.encoding = None
+        self.count = lru_cache(maxsize=8192)(self._count)
+
+    @property
+    def exact(self):
+        return self.encoding is not None
+
+    def _count(self, text):
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        # BPE averages ~4 characters per token on English; punctuation is usually its own token
+        return max(len(_WORD.findall(text)), (len(text) + 3) // 4)
+
+    def messages(self, messages):
+        return sum(MESSAGE_OVERHEAD + self.count(message['content']) for message in messages) + REPLY_PRIMING
+
+
+class ContextBuilder:
+    """
+    Packs system prompt, rolling summary and as many recent turns as fit into
+    `budget` tokens, leaving `reply_reserve` tokens for the completion.
+    """
+
+    def __init__(self, counter, budget=3000, reply_reserve=500, metrics_window=1024):
+        self.counter = counter
+        self.budget = budget
+        self.reply_reserve = reply_reserve
+        self._lock = threading.Lock()
+        self._builds = 0
+        self._prompt_tokens = deque(maxlen=metrics_window)
+        self._turns_packed = deque(maxlen=metrics_window)
+        self._turns_dropped = 0
+        self._summary_tokens = deque(maxlen=metrics_window)
+        self._memories_packed = deque(maxlen=metrics_window)
+        self._folds = {'folds': 0, 'turns_folded': 0, 'fallbacks': 0}
+
+    def build(self, system_prompt, user_input, emotion, turns, summary=None, memories=()):
+        """
+        `turns` are (id, user_input, ai_response) newest first; `memories` are
+        (id, text) recalled from older history, most relevant first. Memories
+        still inside the packed window are dropped. Returns (messages, oldest
+        packed turn id or None, prompt token count).
+        """
+        head = [{'role': 'system', 'content': system_prompt}]
+        if summary:
+            head.append({'role': 'system', 'content': f"Summary of earlier conversation: {summary}"})
+        tail = [
+            {'role': 'user', 'content': user_input},
+            {'role': 'system', 'content': f"Current user emotion: {emotion}."}
+        ]
+        used = self.counter.messages(head + tail)
+        available = self.budget - self.reply_reserve
+        # Room for recalled memories is held back from the turns, then given up if unused
+        memory_reserve = min(sum(MESSAGE_OVERHEAD + self.counter.count(text) for _, text in memories),
+                             (available - used) // 3) if memories else 0
+
+        packed = []
+        oldest_id = None
+        dropped = 0
+        for turn_id, turn_input, turn_response in turns:
+            cost = 2 * MESSAGE_OVERHEAD + self.counter.count(turn_input) + self.counter.count(turn_response)
+            if used + cost > available - memory_reserve:
+                dropped += 1
+                break
+            used += cost
+            oldest_id = turn_id
+            packed.append({'role': 'assistant', 'content': turn_response})
+            packed.append({'role': 'user', 'content': turn_input})
+        packed.reverse()
+
+        recalled = []
+        for memory_id, text in memories:
+            if oldest_id is not None and memory_id >= oldest_id:
+                continue
+            cost = MESSAGE_OVERHEAD + self.counter.count(text)
+            if used + cost > available:
+                break
+            used += cost
+            recalled.append(text)
+        if recalled:
+            head.append({'role': 'system', 'content': "Things you remember from earlier conversations:\n"
+                                                      + '\n'.join(f"- {text}" for text in recalled)})
+
+        with self._lock:
+            self._builds += 1
+            self._prompt_tokens.append(used)
+            self._turns_packed.append(len(packed) // 2)
+            self._turns_dropped += dropped
+            self._summary_tokens.append(self.counter.count(summary) if summary else 0)
+            self._memories_packed.append(len(recalled))
+
+        return head + packed + tail, oldest_id, used
+
+    def record_fold(self, turns, fallback=False):
+        with self._lock:
+            self._folds['folds'] += 1
+            self._folds['turns_folded'] += turns
+            self._folds['fallbacks'] += int(fallback)
+
+    def metrics(self):
+        """Prompt-size distribution over the recent builds"""
+        with self._lock:
+            snapshot = {
+                'builds': self._builds,
+                'builds_truncated': self._turns_dropped,
+                'budget': self.budget,
+                'reply_reserve': self.reply_reserve,
+                'exact_token_counts': self.counter.exact,
+                'prompt_tokens': _distribution(sorted(self._prompt_tokens)),
+                'turns_packed': _distribution(sorted(self._turns_packed)),
+                'summary_tokens': _distribution(sorted(self._summary_tokens)),
+                'memories_packed': _distribution(sorted(self._memories_packed))
+            }
+            snapshot.update(self._folds)
+        return snapshot
+
+
+def _distribution(samples):
+    if not samples:
+        return {'count': 0}
+
+    def percentile(p):
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+    return {
+        'count': len(samples),
+        'avg': round(sum(samples) / len(samples), 1),
+        'p50': percentile(0.50),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'max': samples[-1]
+    }
+
+
+def summary_messages(previous, turns, max_words):
+    """Prompt asking the model to fold (user_input, ai_response) turns into the running summary"""
+    transcript = '\n'.join(f"User: {turn_input}\nAlex: {turn_response}" for turn_input, turn_response in turns)
+    return [
+        {'role': 'system', 'content': (
+            "You maintain a running summary of a conversation between a user and their companion, Alex. "
+            "Rewrite the summary to include the new exchanges: keep facts the user shared about themselves, "
+            "their preferences, plans and emotional arc; drop small talk. "
+            f"Reply with the summary only, in at most {max_words} words."
+        )},
+        {'role': 'user', 'content': f"Current summary:\n{previous or '(none yet)'}\n\nNew exchanges:\n{transcript}"}
+    ]
+
+
+def fallback_summary(previous, turns, counter, max_tokens):
+    """
+    Extractive summary used when the model is unavailable: one short line per
+    turn appended to the previous summary, oldest lines dropped to fit.
+    """
+    lines = previous.split('\n') if previous else []
+    for turn_input, emotion in turns:
+        first_sentence = re.split(r'(?<=[.!?])\s', turn_input.strip(), maxsplit=1)[0][:160]
+        lines.append(f"User ({emotion or 'neutral'}): {first_sentence}")
+    while len(lines) > 1 and counter.count('\n'.join(lines)) > max_tokens:
+        lines.pop(0)
+    return '\n'.join(lines)
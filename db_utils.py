@@ -0,0 +1,343 @@
+"""
+Database helpers shared by app.py and app_new.py. They take the model classes
+as arguments because each app declares its own models.
+"""
+import copy
+import bisect
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, create_engine, event, func, inspect, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.schema import CreateColumn
+
+
+# Production SQLite settings; values are passed straight to PRAGMA
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',         # readers never block the writer, nor the writer readers
+    'synchronous': 'NORMAL',       # fsync at checkpoints only; still durable against crashes
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,      # negative means KiB: 64 MiB page cache per connection
+    'busy_timeout': 5000,          # ms to wait for another process's write lock
+    'temp_store': 'MEMORY',
+}
+
+
+def is_file_sqlite(engine):
+    return engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:')
+
+
+def configure_sqlite(engine, pragmas, begin_immediate=False):
+    """
+    Apply `pragmas` to every new connection of `engine`. With begin_immediate,
+    transactions take the write lock at BEGIN, so a writer waits in busy_timeout
+    instead of failing with "database is locked" when upgrading a read lock.
+    """
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        if begin_immediate:
+            # Let SQLAlchemy's begin event issue BEGIN instead of the driver
+            dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    if begin_immediate:
+        @event.listens_for(engine, 'begin')
+        def begin(connection):
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def create_writer_engine(engine, pragmas):
+    """
+    Single-connection engine on the same SQLite file as `engine`. Sending all
+    writes through it queues a process's writers on the pool instead of on the
+    database lock.
+    """
+    writer = create_engine(engine.url, pool_size=1, max_overflow=0,
+                           pool_timeout=max(30, pragmas.get('busy_timeout', 5000) / 1000))
+    configure_sqlite(writer, pragmas, begin_immediate=True)
+    return writer
+
+
+def increment_counter(session, instance, column_name, amount=1, bump=()):
+    """
+    Atomically add `amount` to a counter column of one row inside the current
+    transaction and return the new value. Columns named in `bump` (e.g. a
+    version column) are incremented by one in the same UPDATE. The in-memory
+    instance is updated without being marked dirty, so no second UPDATE is flushed.
+    """
+    model = type(instance)
+    names = [column_name] + list(bump)
+    values = {name: func.coalesce(getattr(model, name), 0) + (amount if name == column_name else 1)
+              for name in names}
+    row = session.execute(
+        update(model)
+        .where(model.id == instance.id)
+        .values(values)
+        .returning(*[getattr(model, name) for name in names])
+        .execution_options(synchronize_session=False)
+    ).one()
+    for name, value in zip(names, row):
+        set_committed_value(instance, name, value)
+    return row[0]
+
+
+def get_or_create(session, model, defaults, **lookup):
+    """
+    Return the row matching `lookup`, inserting it with `defaults` if missing.
+    Relies on a unique index over the lookup columns: when a concurrent request
+    wins the insert, the IntegrityError is rolled back and its row returned.
+    """
+    instance = model.query.filter_by(**lookup).first()
+    if instance is not None:
+        return instance
+    instance = model(**copy.deepcopy(defaults), **lookup)
+    session.add(instance)
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        instance = model.query.filter_by(**lookup).one()
+    return instance
+
+
+def track_version(model, column_name='version'):
+    """
+    Increment `column_name` in the UPDATE of every flush that changes a row of
+    `model`, so readers can use it as a cheap change marker (e.g. for ETags).
+    """
+    column = getattr(model, column_name)
+
+    @event.listens_for(model, 'before_update')
+    def bump_version(mapper, connection, target):
+        session = object_session(target)
+        if session is not None and session.is_modified(target, include_collections=False):
+            setattr(target, column_name, func.coalesce(column, 0) + 1)
+
+
+def reconcile_counter(session, instance, column_name, count_query):
+    """
+    Reset a maintained counter to the true count and return (old value, new
+    value). The count is a subquery of the UPDATE itself, so an increment_counter
+    committed meanwhile cannot be overwritten by a count taken before it; the
+    old value is the instance's last loaded one and is only for reporting.
+    """
+    model = type(instance)
+    old_value = getattr(instance, column_name)
+    new_value = session.execute(
+        update(model)
+        .where(model.id == instance.id)
+        .values({column_name: count_query.with_entities(func.count()).scalar_subquery()})
+        .returning(getattr(model, column_name))
+        .execution_options(synchronize_session=False)
+    ).scalar_one()
+    set_committed_value(instance, column_name, new_value)
+    session.commit()
+    return old_value, new_value
+
+
+def apply_indexes(engine, metadata):
+    """
+    Create any declared index missing from an existing database.
+    db.create_all() only builds indexes together with new tables, so this is
+    what brings older databases up to date. Returns the names created.
+    """
+    created = []
+    inspector = inspect(engine)
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                created.append(index.name)
+    return created
+
+
+def add_missing_columns(engine, metadata):
+    """
+    ALTER TABLE ADD COLUMN for declared columns missing from existing tables.
+    New columns must be nullable or carry a server_default. Returns "table.column" names.
+    """
+    added = []
+    inspector = inspect(engine)
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                table_name = engine.dialect.identifier_preparer.quote(table.name)
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                with engine.begin() as connection:
+                    connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {ddl}"))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def explain_query(session, query, analyze=False):
+    """
+    Return (sql, plan lines) for an ORM query or Core statement on the current dialect.
+    SQLite uses EXPLAIN QUERY PLAN; PostgreSQL uses EXPLAIN (optionally ANALYZE).
+    """
+    statement = getattr(query, 'statement', query)
+    dialect = session.get_bind().dialect
+    sql = str(statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+
+    if dialect.name == 'sqlite':
+        rows = session.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+        plan = [row[-1] for row in rows]
+    elif dialect.name == 'postgresql':
+        prefix = "EXPLAIN (ANALYZE, BUFFERS)" if analyze else "EXPLAIN"
+        plan = [row[0] for row in session.execute(text(f"{prefix} {sql}")).all()]
+    else:
+        plan = [row[0] for row in session.execute(text(f"EXPLAIN {sql}")).all()]
+    return sql, plan
+
+
+def is_full_scan(plan_line):
+    """True for plan steps that read a whole table without an index"""
+    line = plan_line.strip()
+    return (line.startswith('SCAN ') and ' USING ' not in line) or 'Seq Scan' in line
+
+
+def print_query_plans(session, queries, analyze=False):
+    """Print the plan of each named hot query; returns the names that do a full table scan"""
+    full_scans = []
+    for name, query in queries.items():
+        sql, plan = explain_query(session, query, analyze=analyze)
+        print(f"== {name}")
+        print(f"   {' '.join(sql.split())}")
+        for line in plan:
+            print(f"   -> {line}")
+        if any(is_full_scan(line) for line in plan):
+            full_scans.append(name)
+            print("   !! full table scan")
+    return full_scans
+
+
+def parse_page_args(args, allowed_fields, default_limit=50, max_limit=500):
+    """
+    Read keyset pagination arguments (?before_id=&limit=&fields=) from a request's args.
+    Returns (before_id or None, limit, fields); raises ValueError with a client-facing message.
+    """
+    try:
+        before_id = int(args['before_id']) if args.get('before_id') else None
+        limit = int(args.get('limit', default_limit))
+    except ValueError:
+        raise ValueError("before_id and limit must be integers")
+    if not 1 <= limit <= max_limit:
+        raise ValueError(f"limit must be between 1 and {max_limit}")
+
+    fields = list(allowed_fields)
+    if args.get('fields'):
+        fields = [field.strip() for field in args['fields'].split(',') if field.strip()]
+        unknown = [field for field in fields if field not in allowed_fields]
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return before_id, limit, fields
+
+
+def keyset_query(model, fields, before_id=None, criteria=()):
+    """
+    Newest-first query loading only the given columns of `model` (plus id, for the cursor).
+    Rows older than `before_id` are selected via an index ending in id, with no OFFSET.
+    `criteria` are extra filters, e.g. the owning user.
+    """
+    columns = [model.id] + [getattr(model, field) for field in fields if field != 'id']
+    query = model.query.with_entities(*columns).filter(*criteria)
+    if before_id is not None:
+        query = query.filter(model.id < before_id)
+    return query.order_by(model.id.desc())
+
+
+def iter_keyset(model, fields, before_id=None, chunk_size=1000, criteria=()):
+    """Yield rows newest-first in keyset-paginated chunks, so memory stays bounded"""
+    while True:
+        rows = keyset_query(model, fields, before_id, criteria).limit(chunk_size).all()
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        before_id = rows[-1].id
+
+
+def row_to_dict(row, fields):
+    """Serialize a projected row, converting datetimes to ISO strings"""
+    data = {}
+    for field in fields:
+        value = getattr(row, field)
+        data[field] = value.isoformat() if isinstance(value, datetime) else value
+    return data
+
+
+def backfill_by_timestamp(session, child, parent, foreign_key, match=(), tolerance=2.0, chunk_size=5000):
+    """
+    Link `child` rows whose `foreign_key` is NULL to the `parent` row with the
+    nearest timestamp within `tolerance` seconds. `match` lists (child column,
+    parent column) pairs that must be equal, e.g. the owning user. Each parent is
+    claimed by at most one child.
+
+    Orphans are read in id-keyset chunks of `chunk_size` and candidates only for
+    that chunk's time window, with one commit per chunk, so memory stays bounded
+    however large the tables are. Yields (orphans scanned, rows linked) per chunk.
+    """
+    fk_column = getattr(child, foreign_key)
+    child_columns = [getattr(child, name) for name, _ in match]
+    parent_columns = [getattr(parent, name) for _, name in match]
+    window = timedelta(seconds=tolerance)
+    last_id = 0
+
+    while True:
+        orphans = (session.query(child.id, child.timestamp, *child_columns)
+                   .filter(fk_column.is_(None), child.id > last_id)
+                   .order_by(child.id).limit(chunk_size).all())
+        if not orphans:
+            return
+        last_id = orphans[-1].id
+
+        # Candidate parents in the chunk's time window, bucketed by the match values
+        start = min(row.timestamp for row in orphans) - window
+        end = max(row.timestamp for row in orphans) + window
+        query = session.query(parent.id, parent.timestamp, *parent_columns).filter(parent.timestamp.between(start, end))
+        if match:
+            # Lets an index on (first match column, timestamp) serve the range
+            query = query.filter(parent_columns[0].in_({row[2] for row in orphans}))
+        candidates = query.all()
+        claimed = {row[0] for row in session.query(fk_column).filter(
+            fk_column.in_([candidate.id for candidate in candidates]))} if candidates else set()
+
+        buckets = {}
+        for candidate in candidates:
+            if candidate.id not in claimed:
+                buckets.setdefault(tuple(candidate[2:]), []).append((candidate.timestamp, candidate.id))
+        for bucket in buckets.values():
+            bucket.sort()
+
+        links = []
+        for orphan in orphans:
+            bucket = buckets.get(tuple(orphan[2:]))
+            if not bucket:
+                continue
+            position = bisect.bisect_left(bucket, (orphan.timestamp, 0))
+            best = None
+            for index in (position - 1, position):
+                if 0 <= index < len(bucket):
+                    gap = abs(bucket[index][0] - orphan.timestamp)
+                    if gap <= window and (best is None or gap < best[0]):
+                        best = (gap, index)
+            if best is not None:
+                links.append({'b_id': orphan.id, 'b_parent': bucket.pop(best[1])[1]})
+
+        if links:
+            session.execute(
+                update(child.__table__)
+                .where(child.__table__.c.id == bindparam('b_id'))
+                .values({foreign_key: bindparam('b_parent')}),
+                links
+            )
+        session.commit()
+        yield len(orphans), len(links)
@@ -0,0 +1,279 @@
+"""
+Dice engine behind utils.roll_dice and the adventure "odds" command.
+
+Notation: NdS with optional exploding dice (3d6!), keep highest or lowest
+(4d6kh3, 2d20kl1), a modifier (+5, -2) and "adv"/"dis" for advantage or
+disadvantage on a single die. Every part is capped (see the limits below)
+so a message like "100000000d6" costs a bounded amount of work.
+
+Pools of up to SMALL_POOL dice are rolled with the random module, which beats
+NumPy's per-call overhead for a handful of dice; pools up to ARRAY_DICE_MAX
+are rolled as one NumPy array. Bigger pools are
+rolled as face counts drawn from the multinomial distribution, which is
+O(sides) however many dice there are; keep-highest then takes counts from the
+top face down, and explosions re-roll only the count of maximum faces.
+
+Exact distributions use FFT convolution: the sum of n dice is the n-th
+convolution power of one die's distribution. Exploding dice are truncated
+once a further explosion is less likely than TAIL_EPSILON (the dropped mass
+is reported). Keep-highest/lowest uses a dynamic programme over faces, which
+is exact but quadratic in the dice count, so it has its own smaller cap.
+"""
+import math
+import random
+import re
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+MAX_DICE = 10 ** 9
+MAX_SIDES = 1000
+MAX_MODIFIER = 10 ** 6
+MAX_NOTATION_LENGTH = 64
+# Free text searched for a notation ("roll 1d20 for attack")
+MAX_TEXT_LENGTH = 500
+# Pools above this are rolled as multinomial face counts instead of arrays
+ARRAY_DICE_MAX = 100_000
+SMALL_POOL = 32
+# Individual rolls are listed in results up to this many dice
+ROLL_DETAIL_MAX = 100
+MAX_EXPLOSION_ROUNDS = 100
+# Exact distributions: most possible totals, and dice^2 * sides for keep-highest/lowest
+DISTRIBUTION_MAX_OUTCOMES = 1_000_000
+KEEP_DISTRIBUTION_MAX_WORK = 50_000
+TAIL_EPSILON = 1e-12
+
+NOTATION = re.compile(r'(?<![\w%])(\d*)d(\d+|%)(!?)(?:k([hl]?)(\d+))?([+-]\d+)?'
+                      r'(?: (adv|advantage|dis|disadvantage))?(?![\w%])')
+
+DiceSpec = namedtuple('DiceSpec', 'count sides explode keep keep_count modifier')
+# keep is None, 'high' or 'low'; rolls/kept are None for pools above ROLL_DETAIL_MAX
+RollResult = namedtuple('RollResult', 'spec total rolls kept face_counts')
+
+_local = threading.local()
+
+
+class DiceError(ValueError):
+    """Notation that cannot be parsed or exceeds a resource cap"""
+
+
+def _rng():
+    # numpy Generators are not thread-safe; one per request thread
+    rng = getattr(_local, 'rng', None)
+    if rng is None:
+        rng = _local.rng = np.random.default_rng()
+    return rng
+
+
+@lru_cache(maxsize=256)
+def parse(notation):
+    """
+    DiceSpec for notation like "2d6+3", "4d6kh3", "3d10!" or "d20 adv"; raises DiceError.
+    The first notation in free text is used, so "roll 1d20 for attack" rolls 1d20.
+    """
+    if len(notation) > MAX_TEXT_LENGTH:
+        raise DiceError("dice notation is too long")
+    text = re.sub(r'\s*([+-])\s*', r'\1', ' '.join(notation.lower().split()))
+    match = NOTATION.search(text)
+    if not match:
+        raise DiceError("invalid dice notation")
+    if match.end() - match.start() > MAX_NOTATION_LENGTH:
+        raise DiceError("dice notation is too long")
+    count_text, sides_text, explode, keep, keep_text, modifier_text, advantage = match.groups()
+    count = int(count_text) if count_text else 1
+    sides = 100 if sides_text == '%' else int(sides_text)
+    modifier = int(modifier_text) if modifier_text else 0
+    keep = None if keep_text is None else ('low' if keep == 'l' else 'high')
+    keep_count = int(keep_text) if keep_text else None
+
+    if advantage:
+        if count != 1 or keep:
+            raise DiceError("advantage and disadvantage apply to a single die")
+        count, keep, keep_count = 2, ('high' if advantage.startswith('adv') else 'low'), 1
+    if not 1 <= count <= MAX_DICE:
+        raise DiceError(f"roll between 1 and {MAX_DICE:,} dice")
+    if not 1 <= sides <= MAX_SIDES:
+        raise DiceError(f"dice need between 1 and {MAX_SIDES} sides")
+    if abs(modifier) > MAX_MODIFIER:
+        raise DiceError(f"modifiers are limited to {MAX_MODIFIER:,}")
+    if explode and sides == 1:
+        raise DiceError("a one-sided die would explode forever")
+    if keep and not 1 <= keep_count <= count:
+        raise DiceError("can't keep more dice than were rolled")
+    if keep and explode and count > ARRAY_DICE_MAX:
+        raise DiceError(f"keeping exploding dice is limited to {ARRAY_DICE_MAX:,} dice")
+    return DiceSpec(count, sides, bool(explode), keep, keep_count, modifier)
+
+
+def format_spec(spec):
+    keep = f"k{spec.keep[0]}{spec.keep_count}" if spec.keep else ''
+    modifier = f"{spec.modifier:+d}" if spec.modifier else ''
+    return f"{spec.count}d{spec.sides}{'!' if spec.explode else ''}{keep}{modifier}"
+
+
+def roll(spec, rng=None):
+    if spec.count <= SMALL_POOL and rng is None:
+        return _roll_small(spec)
+    rng = rng or _rng()
+    if spec.count <= ARRAY_DICE_MAX:
+        return _roll_array(spec, rng)
+    return _roll_counts(spec, rng)
+
+
+def _roll_small(spec):
+    rolls = []
+    for _ in range(spec.count):
+        value = face = random.randint(1, spec.sides)
+        rounds = 0
+        while spec.explode and face == spec.sides and rounds < MAX_EXPLOSION_ROUNDS:
+            face = random.randint(1, spec.sides)
+            value += face
+            rounds += 1
+        rolls.append(value)
+    kept = None
+    if spec.keep:
+        kept = sorted(rolls, reverse=spec.keep == 'high')[:spec.keep_count]
+    return RollResult(spec, sum(rolls if kept is None else kept) + spec.modifier, rolls, kept, None)
+
+
+def _roll_array(spec, rng):
+    rolls = rng.integers(1, spec.sides + 1, size=spec.count)
+    if spec.explode:
+        # Each die keeps rolling (and adding) while it shows its maximum face
+        live = np.flatnonzero(rolls == spec.sides)
+        for _ in range(MAX_EXPLOSION_ROUNDS):
+            if not len(live):
+                break
+            extra = rng.integers(1, spec.sides + 1, size=len(live))
+            rolls[live] += extra
+            live = live[extra == spec.sides]
+    kept = rolls
+    if spec.keep:
+        order = np.sort(rolls)
+        kept = order[::-1][:spec.keep_count] if spec.keep == 'high' else order[:spec.keep_count]
+    total = int(kept.sum()) + spec.modifier
+    if spec.count > ROLL_DETAIL_MAX:
+        return RollResult(spec, total, None, None, None)
+    return RollResult(spec, total, rolls.tolist(), kept.tolist() if spec.keep else None, None)
+
+
+def _roll_counts(spec, rng):
+    faces = np.arange(1, spec.sides + 1)
+    counts = rng.multinomial(spec.count, np.full(spec.sides, 1.0 / spec.sides))
+    if spec.keep:
+        # Take whole faces from the kept end until keep_count dice are in
+        ordered = counts[::-1] if spec.keep == 'high' else counts
+        taken = np.minimum(ordered, np.maximum(spec.keep_count - (np.cumsum(ordered) - ordered), 0))
+        kept_counts = taken[::-1] if spec.keep == 'high' else taken
+        total = int(kept_counts @ faces)
+    else:
+        total = int(counts @ faces)
+        exploding = int(counts[-1]) if spec.explode else 0
+        for _ in range(MAX_EXPLOSION_ROUNDS):
+            if not exploding:
+                break
+            extra = rng.multinomial(exploding, np.full(spec.sides, 1.0 / spec.sides))
+            total += int(extra @ faces)
+            exploding = int(extra[-1])
+    return RollResult(spec, total + spec.modifier, None, None, counts.tolist())
+
+
+def describe(result):
+    spec = result.spec
+    if result.rolls is None:
+        return (f"Rolled {format_spec(spec)}: {result.total:,} "
+                f"(average {(result.total - spec.modifier) / (spec.keep_count or spec.count):.2f} per die)")
+    kept = f" keep {result.kept}" if result.kept is not None else ''
+    return f"Rolled {format_spec(spec)}: {result.rolls}{kept} = {result.total}"
+
+
+def _die(spec):
+    """Distribution of one die as (probabilities for 1, 2, ...), plus the truncated mass"""
+    if not spec.explode:
+        return np.full(spec.sides, 1.0 / spec.sides), 0.0
+    # A total of sides*k + r (r < sides) means k maximum faces and then r
+    rounds = min(MAX_EXPLOSION_ROUNDS, math.ceil(math.log(TAIL_EPSILON) / math.log(1.0 / spec.sides)))
+    pmf = np.zeros(spec.sides * (rounds + 1))
+    for k in range(rounds + 1):
+        pmf[spec.sides * k:spec.sides * k + spec.sides - 1] = (1.0 / spec.sides) ** (k + 1)
+    return pmf, (1.0 / spec.sides) ** (rounds + 1)
+
+
+def _convolution_power(pmf, n):
+    """Distribution of the sum of n independent draws from pmf (index 0 = smallest value)"""
+    if n == 1:
+        return pmf
+    size = n * (len(pmf) - 1) + 1
+    fft_size = 1 << (size - 1).bit_length()
+    spectrum = np.fft.rfft(pmf, fft_size) ** n
+    result = np.clip(np.fft.irfft(spectrum, fft_size)[:size], 0.0, None)
+    return result / result.sum()
+
+
+def _keep_distribution(spec):
+    """
+    Exact distribution of the kept sum: faces are assigned from the kept end,
+    state (dice assigned, kept sum), and the first keep_count dice are kept.
+    """
+    n, k, sides = spec.count, spec.keep_count, spec.sides
+    state = np.zeros((n + 1, k * sides + 1))
+    state[0, 0] = 1.0
+    faces = range(sides, 0, -1) if spec.keep == 'high' else range(1, sides + 1)
+    p = 1.0 / sides
+    for face in faces:
+        updated = np.zeros_like(state)
+        for assigned in range(n + 1):
+            row = state[assigned]
+            if not row.any():
+                continue
+            for count in range(n - assigned + 1):
+                added = face * (min(assigned + count, k) - min(assigned, k))
+                weight = math.comb(n - assigned, count) * p ** count
+                updated[assigned + count, added:] += weight * row[:len(row) - added]
+        state = updated
+    # Kept sums run from k (all ones) upwards
+    return state[n][k:]
+
+
+def distribution(spec):
+    """
+    Exact distribution of the total: (lowest total, probabilities, truncated mass).
+    Raises DiceError when it would be too large to compute.
+    """
+    if spec.keep:
+        if spec.explode:
+            raise DiceError("exact odds aren't available for exploding dice with keep")
+        if spec.count ** 2 * spec.sides > KEEP_DISTRIBUTION_MAX_WORK:
+            raise DiceError("that pool is too large for exact keep-highest/lowest odds")
+        return spec.keep_count + spec.modifier, _keep_distribution(spec), 0.0
+    pmf, tail = _die(spec)
+    if spec.count * (len(pmf) - 1) + 1 > DISTRIBUTION_MAX_OUTCOMES:
+        raise DiceError("that pool has too many possible totals for exact odds")
+    return spec.count + spec.modifier, _convolution_power(pmf, spec.count), min(1.0, tail * spec.count)
+
+
+def statistics(spec, target=None, max_outcomes=0):
+    """
+    Expected value, spread and range of the total, the chance of rolling at
+    least `target`, and the whole distribution when it has at most max_outcomes totals.
+    """
+    low, pmf, truncated = distribution(spec)
+    totals = np.arange(low, low + len(pmf))
+    mean = float(pmf @ totals)
+    stats = {
+        'notation': format_spec(spec),
+        'mean': round(mean, 4),
+        'stddev': round(float(np.sqrt(pmf @ (totals - mean) ** 2)), 4),
+        'min': int(low),
+        'max': None if spec.explode else int(low + len(pmf) - 1),
+        'truncated_mass': truncated
+    }
+    if target is not None:
+        index = min(max(target - low, 0), len(pmf))
+        stats['target'] = target
+        stats['p_at_least'] = round(float(pmf[index:].sum()), 6)
+    if len(pmf) <= max_outcomes:
+        stats['distribution'] = {int(total): round(float(p), 8) for total, p in zip(totals, pmf) if p > 0}
+    return stats
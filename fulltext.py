@@ -0,0 +1,177 @@
+"""
+Full-text search over the conversation table.
+
+SQLite uses an FTS5 index whose content is read through a view, so the text
+is not stored twice; Postgres uses a weighted tsvector column with a GIN
+index. In both cases triggers keep the index in step with inserts, updates
+and deletes (including rows written by the write-behind queue), and
+install_fulltext() indexes rows that existed before it ran.
+
+Results are scoped to one user: in SQLite every row is indexed with a
+per-user key token, so the user filter is part of the MATCH rather than a
+join over every hit. Ranking looks at the newest `window` matches only.
+FTS5's bm25() counts every row containing each term to get its IDF, which
+costs ~10 ms per common word at a million rows whatever the user's history
+size; since every result has to contain every query word anyway, a BM25-style
+term-frequency score over the recent matches ranks almost identically, at a
+cost bounded by the window.
+"""
+import re
+import html
+
+from sqlalchemy import DateTime, text
+
+# Highlight markers that cannot occur in stored text; swapped for <mark> after escaping
+_OPEN, _CLOSE = '\x02', '\x03'
+_TERM = re.compile(r"\w+\*?", re.UNICODE)
+MAX_TERMS = 8
+# BM25 term-frequency saturation and length normalisation; replies count half
+K1, B, AVERAGE_WORDS = 1.2, 0.75, 20
+COLUMN_WEIGHTS = {'user_input': 1.0, 'ai_response': 0.5}
+EXCERPT_WORDS = 24
+
+SQLITE_SCHEMA = [
+    "CREATE VIEW IF NOT EXISTS conversation_search_content AS "
+    "SELECT id, 'u' || hex(user_id) || '0' AS user_key, user_input, ai_response FROM conversation",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS conversation_fts USING fts5("
+    "user_key, user_input, ai_response, content='conversation_search_content', content_rowid='id', "
+    "tokenize='porter unicode61', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS conversation_fts_insert AFTER INSERT ON conversation BEGIN "
+    "INSERT INTO conversation_fts(rowid, user_key, user_input, ai_response) "
+    "VALUES (new.id, 'u' || hex(new.user_id) || '0', new.user_input, new.ai_response); END",
+    "CREATE TRIGGER IF NOT EXISTS conversation_fts_delete AFTER DELETE ON conversation BEGIN "
+    "INSERT INTO conversation_fts(conversation_fts, rowid, user_key, user_input, ai_response) "
+    "VALUES ('delete', old.id, 'u' || hex(old.user_id) || '0', old.user_input, old.ai_response); END",
+    "CREATE TRIGGER IF NOT EXISTS conversation_fts_update AFTER UPDATE OF user_id, user_input, ai_response "
+    "ON conversation BEGIN "
+    "INSERT INTO conversation_fts(conversation_fts, rowid, user_key, user_input, ai_response) "
+    "VALUES ('delete', old.id, 'u' || hex(old.user_id) || '0', old.user_input, old.ai_response); "
+    "INSERT INTO conversation_fts(rowid, user_key, user_input, ai_response) "
+    "VALUES (new.id, 'u' || hex(new.user_id) || '0', new.user_input, new.ai_response); END",
+]
+
+POSTGRES_SCHEMA = [
+    "ALTER TABLE conversation ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    "CREATE OR REPLACE FUNCTION conversation_search_vector() RETURNS trigger AS $$ BEGIN "
+    "NEW.search_vector := setweight(to_tsvector('english', coalesce(NEW.user_input, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(NEW.ai_response, '')), 'B'); RETURN NEW; END $$ LANGUAGE plpgsql",
+    "DROP TRIGGER IF EXISTS conversation_search_vector_update ON conversation",
+    "CREATE TRIGGER conversation_search_vector_update BEFORE INSERT OR UPDATE OF user_input, ai_response "
+    "ON conversation FOR EACH ROW EXECUTE FUNCTION conversation_search_vector()",
+    "CREATE INDEX IF NOT EXISTS ix_conversation_search_vector ON conversation USING gin (search_vector)",
+]
+
+SQLITE_SEARCH = text(
+    "SELECT c.id, c.timestamp, c.detected_emotion, hits.user_input, hits.ai_response "
+    f"FROM (SELECT rowid, highlight(conversation_fts, 1, '{_OPEN}', '{_CLOSE}') AS user_input, "
+    f"      highlight(conversation_fts, 2, '{_OPEN}', '{_CLOSE}') AS ai_response "
+    "      FROM conversation_fts WHERE conversation_fts MATCH :match "
+    "      ORDER BY rowid DESC LIMIT :window) AS hits "
+    "JOIN conversation c ON c.id = hits.rowid"
+).columns(timestamp=DateTime)
+
+POSTGRES_SEARCH = text(
+    "SELECT c.id, c.timestamp, c.detected_emotion, "
+    f"ts_headline('english', c.user_input, hits.query, 'StartSel={_OPEN}, StopSel={_CLOSE}, HighlightAll=true') "
+    "AS user_input, "
+    f"ts_headline('english', c.ai_response, hits.query, 'StartSel={_OPEN}, StopSel={_CLOSE}, HighlightAll=true') "
+    "AS ai_response "
+    "FROM (SELECT id, query FROM conversation, websearch_to_tsquery('english', :query) AS query "
+    "      WHERE user_id = :user_id AND search_vector @@ query "
+    "      ORDER BY id DESC LIMIT :window) AS hits "
+    "JOIN conversation c ON c.id = hits.id"
+).columns(timestamp=DateTime)
+
+
+def install_fulltext(engine):
+    """Create the search index and its triggers if missing, indexing existing rows"""
+    with engine.begin() as connection:
+        if engine.dialect.name == 'sqlite':
+            existed = connection.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE name = 'conversation_fts'")).first() is not None
+            for statement in SQLITE_SCHEMA:
+                connection.execute(text(statement))
+            if not existed:
+                connection.execute(text("INSERT INTO conversation_fts(conversation_fts) VALUES ('rebuild')"))
+        elif engine.dialect.name == 'postgresql':
+            existed = connection.execute(text(
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_name = 'conversation' AND column_name = 'search_vector'")).first() is not None
+            for statement in POSTGRES_SCHEMA:
+                connection.execute(text(statement))
+            if not existed:
+                # The BEFORE UPDATE trigger fills in the vector
+                connection.execute(text("UPDATE conversation SET user_input = user_input"))
+
+
+def user_key(user_id):
+    """
+    The token every row of this user is indexed under, as built by the SQL above;
+    the trailing digit keeps the porter stemmer from trimming it.
+    """
+    return 'u' + user_id.encode().hex().upper() + '0'
+
+
+def fts5_match(user_id, query):
+    """
+    FTS5 expression for a free-text query: every word must match (a trailing *
+    makes it a prefix), in the message or the reply, for this user only.
+    Returns None when the query has no searchable words.
+    """
+    terms = _TERM.findall(query)[:MAX_TERMS]
+    if not terms:
+        return None
+    quoted = ' '.join(f'"{term.rstrip("*")}"' + ('*' if term.endswith('*') else '') for term in terms)
+    return f"user_key:{user_key(user_id)} AND {{user_input ai_response}}: ({quoted})"
+
+
+def search_conversations(session, user_id, query, limit=20, window=200):
+    """
+    Best of the newest `window` matches first, as dicts with an HTML-escaped
+    excerpt of each column and the matched words wrapped in <mark>.
+    """
+    if session.get_bind().dialect.name == 'postgresql':
+        rows = session.execute(POSTGRES_SEARCH, {'query': query, 'user_id': user_id, 'window': window})
+    else:
+        match = fts5_match(user_id, query)
+        if match is None:
+            return []
+        rows = session.execute(SQLITE_SEARCH, {'match': match, 'window': window})
+
+    scored = sorted(((sum(weight * _term_score(getattr(row, column)) for column, weight in COLUMN_WEIGHTS.items()),
+                      row) for row in rows), key=lambda hit: (hit[0], hit[1].id), reverse=True)
+    return [{
+        'id': row.id,
+        'timestamp': row.timestamp.isoformat(),
+        'detected_emotion': row.detected_emotion,
+        'score': round(score, 4),
+        'user_input': mark(excerpt(row.user_input)),
+        'ai_response': mark(excerpt(row.ai_response))
+    } for score, row in scored[:limit]]
+
+
+def _term_score(highlighted):
+    """BM25 term-frequency part for one column, counting highlighted matches"""
+    if not highlighted:
+        return 0.0
+    matches = highlighted.count(_OPEN)
+    words = len(highlighted.split())
+    return matches * (K1 + 1) / (matches + K1 * (1 - B + B * words / AVERAGE_WORDS))
+
+
+def excerpt(highlighted):
+    """At most EXCERPT_WORDS words, starting a few words before the first match"""
+    words = (highlighted or '').split()
+    if len(words) <= EXCERPT_WORDS:
+        return ' '.join(words)
+    first = next((i for i, word in enumerate(words) if _OPEN in word), 0)
+    start = max(0, min(first - 4, len(words) - EXCERPT_WORDS))
+    fragment = ' '.join(words[start:start + EXCERPT_WORDS])
+    # Close a highlight cut off by the excerpt
+    if fragment.count(_OPEN) > fragment.count(_CLOSE):
+        fragment += _CLOSE
+    return ('… ' if start else '') + fragment + (' …' if start + EXCERPT_WORDS < len(words) else '')
+
+
+def mark(fragment):
+    return html.escape(fragment or '').replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
@@ -0,0 +1,297 @@
+"""
+Request instrumentation shared by app.py and app_new.py: per-stage timers,
+SQL statement counts, Prometheus metrics and an opt-in sampling profiler.
+
+With INSTRUMENTATION=1 every request records its latency and the number and
+time of SQL statements it ran (SQLAlchemy cursor events, counted in the
+request's own context so background writers are not charged to it), and
+stage() blocks add named timings. Totals are kept as Prometheus counters and
+histograms, served by /metrics in the text exposition format together with
+gauges from registered collectors (write-behind, thought worker, LLM pool).
+Non-streamed responses carry a Server-Timing header with the breakdown, and
+requests slower than slow_ms are logged with it.
+
+Disabled (the default), no hooks or event listeners are installed and
+stage() returns one shared no-op context manager.
+
+With PROFILING=1, a request with ?profile=1 or an "X-Profile: 1" header is
+sampled every `sample_interval` seconds from a helper thread through
+sys._current_frames(). The response body is then replaced by the folded
+stacks ("outer;inner;leaf count" per line), which flamegraph.pl, speedscope
+or inferno read directly. The original status is in X-Profiled-Status.
+Streamed responses are not profiled.
+"""
+import os
+import sys
+import time
+import bisect
+import logging
+import threading
+from collections import Counter
+from contextlib import nullcontext
+
+from flask import Response, g, has_app_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+PROFILE_MAX_DEPTH = 128
+
+_NOOP = nullcontext()
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense"""
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Stage:
+    __slots__ = ('owner', 'name', 'started')
+
+    def __init__(self, owner, name):
+        self.owner = owner
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.owner.record_stage(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class _RequestState:
+    __slots__ = ('started', 'queries', 'query_seconds', 'query_started', 'stages', 'sampler')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.query_started = 0.0
+        self.stages = []
+        self.sampler = None
+
+
+class Instrumentation:
+    def __init__(self, enabled=False, profiling=False, sample_interval=0.005, slow_ms=None, prefix='companion'):
+        self.enabled = enabled
+        self.profiling = profiling
+        self.sample_interval = sample_interval
+        self.slow_ms = slow_ms
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._requests = Counter()      # (endpoint, method, status) -> count
+        self._latency = {}              # (endpoint, method) -> Histogram
+        self._queries = {}              # endpoint -> Histogram of statements per request
+        self._query_seconds = Counter()  # endpoint -> seconds
+        self._stages = {}               # stage -> Histogram
+        self._collectors = []
+
+    def init_app(self, app, engines):
+        """Install request hooks on `app` and statement listeners on `engines`"""
+        if not (self.enabled or self.profiling):
+            return
+        if self.enabled:
+            for engine in engines:
+                event.listen(engine, 'before_cursor_execute', self._before_execute)
+                event.listen(engine, 'after_cursor_execute', self._after_execute)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def stage(self, name):
+        """Context manager timing one step of a request; a shared no-op when disabled"""
+        if not self.enabled:
+            return _NOOP
+        return _Stage(self, name)
+
+    def register_collector(self, name, collect):
+        """Export collect()'s numeric values as <prefix>_<name>_<key> gauges"""
+        self._collectors.append((name, collect))
+
+    # Recording
+
+    def record_stage(self, name, seconds):
+        with self._lock:
+            histogram = self._stages.get(name)
+            if histogram is None:
+                histogram = self._stages[name] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+        if has_app_context():
+            state = g.get('_instrumentation')
+            if state is not None:
+                state.stages.append((name, seconds))
+
+    def _before_execute(self, *_):
+        if has_app_context():
+            state = g.get('_instrumentation')
+            if state is not None:
+                state.query_started = time.perf_counter()
+
+    def _after_execute(self, *_):
+        if has_app_context():
+            state = g.get('_instrumentation')
+            if state is not None:
+                state.queries += 1
+                state.query_seconds += time.perf_counter() - state.query_started
+
+    def _start_request(self):
+        state = g._instrumentation = _RequestState()
+        if self.profiling and (request.args.get('profile') == '1' or request.headers.get('X-Profile') == '1'):
+            state.sampler = Sampler(threading.get_ident(), self.sample_interval).start()
+
+    def _finish_request(self, response):
+        state = g.pop('_instrumentation', None)
+        if state is None:
+            return response
+        endpoint, method = request.endpoint or 'unmatched', request.method
+
+        if response.is_streamed:
+            if state.sampler is not None:
+                state.sampler.stop()
+            if self.enabled:
+                # Statements made while the body streams still count; g is the same object then
+                g._instrumentation = state
+                response.call_on_close(lambda: self._observe(state, endpoint, method, response.status_code))
+            return response
+
+        if self.enabled:
+            elapsed = self._observe(state, endpoint, method, response.status_code)
+            timings = [f"db;dur={state.query_seconds * 1000:.2f};desc=\"{state.queries} queries\""]
+            timings += [f"{name};dur={seconds * 1000:.2f}" for name, seconds in state.stages]
+            timings.append(f"total;dur={elapsed * 1000:.2f}")
+            response.headers['Server-Timing'] = ', '.join(timings)
+
+        if state.sampler is not None:
+            folded = state.sampler.stop()
+            profiled = Response(folded, mimetype='text/plain')
+            profiled.headers['X-Profiled-Status'] = str(response.status_code)
+            profiled.headers['X-Profile-Samples'] = str(state.sampler.samples)
+            return profiled
+        return response
+
+    def _observe(self, state, endpoint, method, status):
+        elapsed = time.perf_counter() - state.started
+        with self._lock:
+            self._requests[(endpoint, method, status)] += 1
+            latency = self._latency.get((endpoint, method))
+            if latency is None:
+                latency = self._latency[(endpoint, method)] = Histogram(LATENCY_BUCKETS)
+            latency.observe(elapsed)
+            queries = self._queries.get(endpoint)
+            if queries is None:
+                queries = self._queries[endpoint] = Histogram(QUERY_BUCKETS)
+            queries.observe(state.queries)
+            self._query_seconds[endpoint] += state.query_seconds
+        if self.slow_ms is not None and elapsed * 1000 >= self.slow_ms:
+            stages = ', '.join(f"{name} {seconds * 1000:.1f}ms" for name, seconds in state.stages)
+            logger.warning(f"Slow request {method} {endpoint}: {elapsed * 1000:.1f}ms, {state.queries} queries "
+                           f"({state.query_seconds * 1000:.1f}ms){'; ' + stages if stages else ''}")
+        return elapsed
+
+    # Exposition
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        p = self.prefix
+        lines = []
+        with self._lock:
+            lines += [f"# HELP {p}_requests_total Requests handled, by endpoint, method and status",
+                      f"# TYPE {p}_requests_total counter"]
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append(f'{p}_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+            _histogram_lines(lines, f"{p}_request_duration_seconds", "Request latency until the response is sent",
+                             {f'endpoint="{e}",method="{m}"': h for (e, m), h in self._latency.items()})
+            _histogram_lines(lines, f"{p}_db_queries_per_request", "SQL statements run per request",
+                             {f'endpoint="{e}"': h for e, h in self._queries.items()})
+            lines += [f"# HELP {p}_db_query_seconds_total Time spent in SQL statements",
+                      f"# TYPE {p}_db_query_seconds_total counter"]
+            for endpoint, seconds in sorted(self._query_seconds.items()):
+                lines.append(f'{p}_db_query_seconds_total{{endpoint="{endpoint}"}} {seconds:.6f}')
+            _histogram_lines(lines, f"{p}_stage_duration_seconds", "Time spent in each request stage",
+                             {f'stage="{s}"': h for s, h in self._stages.items()})
+
+        for name, collect in self._collectors:
+            try:
+                values = _numeric(collect())
+            except Exception as e:
+                logger.error(f"Metrics collector {name} failed: {str(e)}")
+                continue
+            for key, value in values:
+                metric = f"{p}_{name}_{key}"
+                lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram_lines(lines, name, help_text, histograms):
+    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.bounds + (float('inf'),), histogram.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {histogram.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+
+def _numeric(values, prefix=''):
+    """(key, number) pairs from a metrics dict, nested dicts flattened with underscores"""
+    pairs = []
+    for key, value in values.items():
+        key = f"{prefix}{key}".replace('.', '_').replace('-', '_')
+        if isinstance(value, bool):
+            pairs.append((key, int(value)))
+        elif isinstance(value, (int, float)):
+            pairs.append((key, value))
+        elif isinstance(value, dict):
+            pairs += _numeric(value, f"{key}_")
+    return pairs
+
+
+class Sampler:
+    """Samples one thread's Python stack at a fixed interval into folded-stack counts"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop sampling; returns the folded stacks, heaviest first"""
+        self._stop.set()
+        self._thread.join()
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            names = []
+            while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+            self.samples += 1
@@ -0,0 +1,315 @@
+import os
+import json
+import time
+import queue
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import deque
+
+import httpx
+import openai
+
+logger = logging.getLogger(__name__)
+
+# Upstream failures worth retrying; anything else (bad request, auth) is returned immediately
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+_STREAM_END = object()
+
+
+class LLMClientPool:
+    """
+    Shared async OpenAI client for one worker process.
+
+    All calls run on a private event loop thread with one keep-alive connection
+    pool. A semaphore bounds in-flight upstream requests, failures are retried
+    with exponential backoff and full jitter, and identical concurrent prompts
+    are coalesced into a single upstream call. Sync callers (Flask views) use
+    chat() and stream_chat().
+    """
+
+    def __init__(self, base_url=None, api_key=None, max_concurrency=8, max_connections=16,
+                 max_retries=3, backoff_base=0.5, backoff_max=8.0, timeout=60.0, latency_window=1024):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop = None
+        self._client = None
+        self._semaphore = None
+        self._inflight = {}
+
+        self._waiting = 0
+        self._active = 0
+        self._counters = {'requests': 0, 'upstream_calls': 0, 'coalesced': 0, 'retries': 0, 'errors': 0}
+        self._latencies = deque(maxlen=latency_window)
+        self._queue_waits = deque(maxlen=latency_window)
+
+    # Event loop management
+
+    def _ensure_loop(self):
+        # Started lazily and per process so gunicorn's pre-fork model gets one loop per worker
+        with self._lock:
+            if self._loop is not None and self._pid == os.getpid():
+                return self._loop
+
+            # Built here rather than on the loop thread so configuration errors reach the caller
+            client = openai.AsyncOpenAI(
+                base_url=self.base_url,
+                api_key=self.api_key,
+                max_retries=0,
+                timeout=self.timeout,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=self.max_connections,
+                                        max_keepalive_connections=self.max_connections),
+                    timeout=self.timeout
+                )
+            )
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='llm-client-loop', daemon=True).start()
+
+            self._client = client
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+            self._pid = os.getpid()
+            self._inflight = {}
+            return loop
+
+    def _submit(self, coroutine_function, *args):
+        # The loop first: a configuration error must not leave a never-awaited coroutine behind
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(coroutine_function(*args), loop)
+
+    def close(self):
+        """Close the connection pool and stop the loop thread"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._client.close(), loop).result(timeout=5)
+        loop.call_soon_threadsafe(loop.stop)
+
+    # Public sync API
+
+    def chat(self, messages, model, temperature=1.0, timeout=None):
+        """Return the completion text; blocks the calling thread only, not the pool"""
+        future = self._submit(self._chat, messages, model, temperature)
+        try:
+            return future.result(timeout or self.timeout * (self.max_retries + 1))
+        except TimeoutError:
+            # Frees the concurrency slot unless another caller shares the upstream call
+            future.cancel()
+            raise
+
+    def stream_chat(self, messages, model, temperature=1.0):
+        """Yield completion text deltas as they arrive"""
+        deltas = queue.Queue()
+        future = self._submit(self._stream, messages, model, temperature, deltas)
+        try:
+            while True:
+                item = deltas.get()
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Client went away mid-stream: stop reading from upstream
+            if not future.done():
+                future.cancel()
+
+    def metrics(self):
+        """Snapshot of queue depth, concurrency and upstream latency for sizing workers"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            waits = sorted(self._queue_waits)
+            snapshot = dict(self._counters)
+            snapshot.update({
+                'queue_depth': self._waiting,
+                'in_flight': self._active,
+                'max_concurrency': self.max_concurrency,
+                'max_connections': self.max_connections,
+                'upstream_latency_ms': _summarize(latencies),
+                'queue_wait_ms': _summarize(waits)
+            })
+        return snapshot
+
+    # Async internals
+
+    async def _chat(self, messages, model, temperature):
+        self._count('requests')
+        key = _prompt_key(messages, model, temperature)
+        shared = self._inflight.get(key)
+        if shared is not None:
+            self._count('coalesced')
+        else:
+            shared = self._inflight[key] = _InflightCall(
+                asyncio.ensure_future(self._call(messages, model, temperature)))
+            shared.task.add_done_callback(lambda _: self._forget(key, shared))
+
+        shared.waiters += 1
+        try:
+            return await asyncio.shield(shared.task)
+        finally:
+            shared.waiters -= 1
+            # The last caller gave up (timeout): stop the upstream call rather than finish it for nobody
+            if not shared.waiters and not shared.task.done():
+                self._forget(key, shared)
+                shared.task.cancel()
+
+    def _forget(self, key, shared):
+        if self._inflight.get(key) is shared:
+            del self._inflight[key]
+
+    async def _call(self, messages, model, temperature):
+        async with self._slot():
+            response = await self._with_retries(lambda: self._client.chat.completions.create(
+                model=model, messages=messages, temperature=temperature
+            ))
+            return response.choices[0].message.content
+
+    async def _stream(self, messages, model, temperature, deltas):
+        self._count('requests')
+        try:
+            async with self._slot():
+                stream = await self._with_retries(lambda: self._client.chat.completions.create(
+                    model=model, messages=messages, temperature=temperature, stream=True
+                ))
+                async with stream:
+                    async for chunk in stream:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            deltas.put(chunk.choices[0].delta.content)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            deltas.put(e)
+        finally:
+            deltas.put(_STREAM_END)
+
+    def _slot(self):
+        return _ConcurrencySlot(self)
+
+    async def _with_retries(self, make_request):
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                self._count('upstream_calls')
+                result = await make_request()
+                self._record(self._latencies, time.perf_counter() - started)
+                return result
+            except RETRYABLE_ERRORS as e:
+                self._record(self._latencies, time.perf_counter() - started)
+                if attempt == self.max_retries:
+                    self._count('errors')
+                    raise
+                self._count('retries')
+                # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                logger.warning(f"LLM call failed ({type(e).__name__}), retry {attempt + 1} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+            except Exception:
+                self._count('errors')
+                raise
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _record(self, window, seconds):
+        with self._lock:
+            window.append(seconds)
+
+
+class _InflightCall:
+    """An upstream call and the number of callers waiting on it"""
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class _ConcurrencySlot:
+    """Semaphore acquisition that keeps the pool's queue depth and in-flight gauges current"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        pool = self.pool
+        with pool._lock:
+            pool._waiting += 1
+        started = time.perf_counter()
+        try:
+            await pool._semaphore.acquire()
+        finally:
+            with pool._lock:
+                pool._waiting -= 1
+        pool._record(pool._queue_waits, time.perf_counter() - started)
+        with pool._lock:
+            pool._active += 1
+
+    async def __aexit__(self, *exc_info):
+        pool = self.pool
+        with pool._lock:
+            pool._active -= 1
+        pool._semaphore.release()
+
+
+def _prompt_key(messages, model, temperature):
+    payload = json.dumps([model, temperature, messages], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _summarize(samples):
+    if not samples:
+        return {'count': 0}
+
+    def percentile(p):
+        return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 2)
+
+    return {
+        'count': len(samples),
+        'avg': round(sum(samples) / len(samples) * 1000, 2),
+        'p50': percentile(0.50),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'max': round(samples[-1] * 1000, 2)
+    }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_llm_pool():
+    """Process-wide pool configured from the environment"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = LLMClientPool(
+                base_url=os.getenv("OPENAI_BASE_URL"),
+                api_key=os.getenv("OPENAI_API_KEY"),
+                max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+                max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "16")),
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+                backoff_base=float(os.getenv("LLM_BACKOFF_BASE", "0.5")),
+                backoff_max=float(os.getenv("LLM_BACKOFF_MAX", "8")),
+                timeout=float(os.getenv("LLM_TIMEOUT", "60"))
+            )
+        return _pool
@@ -0,0 +1,349 @@
+"""
+Local semantic memory index over past conversation turns.
+
+Each turn is embedded as a hashed TF-IDF vector: words are hashed into `dim`
+buckets with a random sign (crc32, so every process agrees; the sign keeps
+collisions from adding up), term frequencies are log-scaled and the vector is
+L2-normalised. Query terms are weighted by IDF squared, which
+makes the dot product a TF-IDF cosine without rewriting stored rows when
+document frequencies change.
+
+The hash space has to be large: with 256 buckets a long history's vocabulary
+piles up in every bucket, and recall@9 against exact TF-IDF over 100k turns
+is 0.23, against 0.99 with the default 2^16 (benchmarks/bench_memory_index.py).
+A turn only fills a few dozen buckets, so vectors are stored sparsely, as
+postings in three memory-mapped files per user, grown by doubling:
+  .ids     turn id of each row, ascending; 0 marks free slots
+  .keys    one key per non-zero bucket of a row: block, bucket and slot of the
+           row packed into 64 bits; KEY_FREE marks free slots
+  .values  the bucket's weight
+Rows are grouped in blocks of BLOCK_ROWS. Once a block is full its postings
+are sorted by key, i.e. by bucket within the block, so a search finds the
+postings of each query bucket in every full block with one vectorised binary
+search and reads nothing else; the postings of the last, filling block are in
+row order and scanned. The search is still exact over the hashed vectors.
+Appends take an exclusive flock and searches a shared one, so several worker
+processes can share the directory. Files of the older dense layout (*.vec<dim>)
+are not read; `flask build-memory-index` rebuilds the index from the database.
+"""
+import os
+import re
+import zlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; single-process only there
+    fcntl = None
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+STOPWORDS = frozenset("""
+a about after again all also am an and any are as at be been before being but by can could did do does
+doing don't for from had has have having he her here hers him his how i i'm if in into is it it's its
+just let's me more most my no nor not now of off on once only or other our out over own really same she
+should so some such than that that's the their them then there these they this those through to too
+under until up very was we were what when where which while who why will with would you your yours
+""".split())
+
+# Rows per block; the postings of a full block are sorted by bucket
+SLOT_BITS = 10
+BLOCK_ROWS = 1 << SLOT_BITS
+KEY_FREE = np.iinfo(np.uint64).max
+DEFAULT_DIM = 1 << 16
+
+
+def stem(word):
+    """Crude suffix stripping so "paints", "painted" and "painting" share a bucket"""
+    for suffix in ('ing', 'ed', 'es', 's'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text):
+    return [stem(word) for word in _WORD.findall(text.lower()) if word not in STOPWORDS and len(word) > 1]
+
+
+def term_counts(text, dim):
+    """Hashed term frequencies as (bucket, sign, count) arrays"""
+    counts = {}
+    for word in tokenize(text):
+        key = zlib.crc32(word.encode())
+        counts[key] = counts.get(key, 0) + 1
+    keys = np.fromiter(counts, dtype=np.uint32, count=len(counts))
+    buckets = (keys >> 1) % dim
+    signs = np.where(keys & 1, 1.0, -1.0).astype(np.float32)
+    return buckets, signs, np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+
+
+def embed(text, dim, weights=None):
+    """
+    Log-scaled signed term frequencies, optionally weighted per bucket,
+    L2-normalised, as (buckets ascending, values) of the non-zero buckets
+    """
+    buckets, signs, counts = term_counts(text, dim)
+    values = np.log1p(counts) * signs
+    if weights is not None:
+        values *= weights[buckets]
+    buckets, slots = np.unique(buckets, return_inverse=True)
+    values = np.bincount(slots, weights=values, minlength=len(buckets)).astype(np.float32)
+    nonzero = values != 0
+    buckets, values = buckets[nonzero], values[nonzero]
+    norm = np.linalg.norm(values)
+    return buckets, (values / norm if norm else values)
+
+
+def _grow(f, dtype, size, fill=None):
+    """Extend an open file to `size` items; new items are zero, or `fill` written out explicitly"""
+    f.seek(0, os.SEEK_END)
+    items = f.tell() // dtype.itemsize
+    if items >= size:
+        return
+    if fill is None:
+        f.truncate(size * dtype.itemsize)
+        return
+    # Written rather than truncated, so no window where a free key reads as 0
+    chunk = np.full(min(size - items, 1 << 16), fill, dtype=dtype).tobytes()
+    f.seek(items * dtype.itemsize)
+    while items < size:
+        take = min(size - items, len(chunk) // dtype.itemsize)
+        f.write(chunk[:take * dtype.itemsize])
+        items += take
+    f.flush()
+
+
+class UserIndex:
+    """
+    Memory-mapped postings for one user (see the module docstring). `count`
+    rows are present; a row counts only once its id is set, so postings
+    written for rows beyond it are ignored and replaced by the next append.
+    """
+
+    ID = np.dtype('<i8')
+    KEY = np.dtype('<u8')
+    VALUE = np.dtype('<f4')
+
+    def __init__(self, path, dim):
+        if dim & (dim - 1):
+            raise ValueError("dim must be a power of two")
+        self.path = path
+        self.dim = dim
+        self.bucket_bits = dim.bit_length() - 1
+        self.block_shift = SLOT_BITS + self.bucket_bits
+        self.lock = threading.Lock()
+        for name, suffix, dtype, fill in self._files():
+            if not os.path.exists(path + suffix):
+                with open(path + suffix, 'ab') as f:
+                    # Room for a block of rows with a few dozen postings each
+                    _grow(f, dtype, BLOCK_ROWS * (1 if name == 'ids' else 32), fill)
+        self._map()
+        self.count = self._scan_count(0)
+        self.doc_freq = self._doc_freq(0, self.count)
+
+    def _files(self):
+        return (('ids', '.ids', self.ID, None), ('keys', '.keys', self.KEY, KEY_FREE),
+                ('values', '.values', self.VALUE, None))
+
+    def _map(self):
+        for name, suffix, dtype, _ in self._files():
+            # Whole items only, in case a write was cut short
+            length = os.path.getsize(self.path + suffix) // dtype.itemsize
+            setattr(self, name, np.memmap(self.path + suffix, dtype=dtype, mode='r+', shape=(length,)))
+
+    def _lengths(self):
+        return (len(self.ids), len(self.keys), len(self.values))
+
+    def _file_lengths(self):
+        return tuple(os.path.getsize(self.path + suffix) // dtype.itemsize for _, suffix, dtype, _ in self._files())
+
+    def _scan_count(self, start):
+        free = np.flatnonzero(self.ids[start:] == 0)
+        return start + (int(free[0]) if len(free) else len(self.ids) - start)
+
+    def _block_start(self, block):
+        """Index of the first posting of `block` (keys are ordered by block)"""
+        return int(np.searchsorted(self.keys, np.uint64(block << self.block_shift)))
+
+    def _used(self):
+        """Number of postings stored (free keys sort last)"""
+        return int(np.searchsorted(self.keys, KEY_FREE))
+
+    def _rows(self, keys):
+        blocks = (keys >> np.uint64(self.block_shift)).astype(np.int64)
+        return blocks * BLOCK_ROWS + (keys & np.uint64(BLOCK_ROWS - 1)).astype(np.int64)
+
+    def _buckets(self, keys):
+        return ((keys >> np.uint64(SLOT_BITS)) & np.uint64(self.dim - 1)).astype(np.int64)
+
+    def _doc_freq(self, start, stop):
+        """Rows in [start, stop) having each bucket"""
+        keys = self.keys[self._block_start(start // BLOCK_ROWS):self._block_start(-(-stop // BLOCK_ROWS))]
+        rows = self._rows(keys)
+        keys = keys[(rows >= start) & (rows < stop)]
+        return np.bincount(self._buckets(keys), minlength=self.dim).astype(np.float32)
+
+    @property
+    def nbytes(self):
+        return sum(os.path.getsize(self.path + suffix) for _, suffix, _, _ in self._files())
+
+    @property
+    def last_id(self):
+        return int(self.ids[self.count - 1]) if self.count else 0
+
+    def refresh(self):
+        """Pick up rows appended by other processes"""
+        if self._file_lengths() != self._lengths():
+            self._map()
+        count = self._scan_count(self.count)
+        if count > self.count:
+            self.doc_freq += self._doc_freq(self.count, count)
+            self.count = count
+
+    def _ensure(self, name, size):
+        array = getattr(self, name)
+        if size <= len(array):
+            return
+        capacity = len(array)
+        while capacity < size:
+            capacity *= 2
+        _, suffix, dtype, fill = next(spec for spec in self._files() if spec[0] == name)
+        array.flush()
+        with open(self.path + suffix, 'r+b') as f:
+            _grow(f, dtype, capacity, fill)
+        self._map()
+
+    def append(self, entries):
+        """entries: (id, text) in ascending id order; ids already indexed are skipped"""
+        with self.lock, open(self.path + '.ids', 'r+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            self.refresh()
+            last_id = self.last_id
+            entries = [(turn_id, text) for turn_id, text in entries if turn_id > last_id]
+            if not entries:
+                return 0
+
+            # Postings of the filling block (minus any left by an append that never set its ids)
+            # are rewritten together with the new rows'
+            tail = self._block_start(self.count // BLOCK_ROWS)
+            used = self._used()
+            keep = self._rows(self.keys[tail:used]) < self.count
+            keys = [np.asarray(self.keys[tail:used][keep])]
+            values = [np.asarray(self.values[tail:used][keep])]
+            doc_freq = np.zeros(self.dim, dtype=np.float32)
+            for row, (_, text) in enumerate(entries, self.count):
+                buckets, weights = embed(text, self.dim)
+                block, slot = divmod(row, BLOCK_ROWS)
+                keys.append(np.uint64(block << self.block_shift | slot)
+                            | (buckets.astype(np.uint64) << np.uint64(SLOT_BITS)))
+                values.append(weights)
+                doc_freq[buckets] += 1
+            keys, values = np.concatenate(keys), np.concatenate(values)
+
+            # Full blocks sorted by bucket; the block still filling stays in row order
+            needed = self.count + len(entries)
+            full = int(np.searchsorted(keys >> np.uint64(self.block_shift), needed // BLOCK_ROWS))
+            order = np.argsort(keys[:full], kind='stable')
+            keys[:full], values[:full] = keys[:full][order], values[:full][order]
+
+            self._ensure('ids', needed)
+            self._ensure('keys', tail + len(keys))
+            self._ensure('values', tail + len(keys))
+            # Values, then keys, then ids: a row only counts as present once its id is set
+            self.values[tail:tail + len(values)] = values
+            self.keys[tail:tail + len(keys)] = keys
+            if tail + len(keys) < used:
+                self.keys[tail + len(keys):used] = KEY_FREE
+            self.values.flush()
+            self.keys.flush()
+            self.ids[self.count:needed] = [turn_id for turn_id, _ in entries]
+            self.ids.flush()
+            self.doc_freq += doc_freq
+            self.count = needed
+            return len(entries)
+
+    def search(self, text, k, before_id=None, min_score=0.0):
+        """Top-k (id, score) by TF-IDF cosine, best first, among ids below before_id"""
+        with self.lock, open(self.path + '.ids', 'rb') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_SH)
+            return self._search(text, k, before_id, min_score)
+
+    def _search(self, text, k, before_id, min_score):
+        count = self.count
+        if count == 0:
+            return []
+        ids = self.ids[:count]
+        if before_id is not None:
+            count = int(np.searchsorted(ids, before_id))
+            if count == 0:
+                return []
+        idf = np.log((1.0 + count) / (1.0 + self.doc_freq)) + 1.0
+        buckets, weights = embed(text, self.dim, weights=idf * idf)
+        if not len(buckets):
+            return []
+
+        # Full blocks: each query bucket's postings, found by binary search in every block
+        full_blocks = count // BLOCK_ROWS
+        starts = ((np.arange(full_blocks, dtype=np.uint64)[:, None] << np.uint64(self.block_shift))
+                  | (buckets.astype(np.uint64)[None, :] << np.uint64(SLOT_BITS))).ravel()
+        low = np.searchsorted(self.keys, starts)
+        high = np.searchsorted(self.keys, starts + np.uint64(BLOCK_ROWS))
+        lengths = high - low
+        positions = np.arange(lengths.sum()) + np.repeat(low - np.cumsum(lengths) + lengths, lengths)
+        query = np.repeat(np.tile(weights, full_blocks), lengths)
+
+        # The rest: the filling block, or the block before_id falls in; scan its postings
+        tail, end = self._block_start(full_blocks), self._block_start(full_blocks + 1)
+        lookup = np.zeros(self.dim, dtype=np.float32)
+        lookup[buckets] = weights
+        tail_weights = lookup[self._buckets(self.keys[tail:end])]
+        hits = np.flatnonzero(tail_weights)
+        positions = np.concatenate([positions, tail + hits])
+        query = np.concatenate([query, tail_weights[hits]])
+        if not len(positions):
+            return []
+
+        rows = self._rows(self.keys[positions])
+        present = rows < count
+        scores = np.bincount(rows[present], weights=query[present] * self.values[positions][present],
+                             minlength=count)
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top if scores[i] > min_score]
+
+
+class MemoryIndex:
+    """
+    Per-user indexes under `directory` (one subdirectory per shard), keeping at
+    most `max_open` memory maps open.
+    """
+
+    def __init__(self, directory, dim=DEFAULT_DIM, max_open=256):
+        self.directory = directory
+        self.dim = dim
+        self.max_open = max_open
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+
+    def user_index(self, shard, user_id):
+        key = (shard, user_id)
+        with self._lock:
+            index = self._open.get(key)
+            if index is not None:
+                self._open.move_to_end(key)
+                return index
+            directory = os.path.join(self.directory, shard or 'default')
+            os.makedirs(directory, exist_ok=True)
+            # user ids are validated against USER_ID_PATTERN; hash anyway so any id is a safe file name
+            name = f"{zlib.crc32(user_id.encode()):08x}-{re.sub(r'[^A-Za-z0-9_-]', '_', user_id)[:48]}.sparse{self.dim}"
+            index = UserIndex(os.path.join(directory, name), self.dim)
+            self._open[key] = index
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+            return index
@@ -0,0 +1,324 @@
+"""
+Pregenerated companion thoughts and emotion-specific replies.
+
+`pregenerate` asks a model for many short lines per (kind, emotion, topic)
+through the OpenAI Batch API (half the price of live calls, results within
+24 hours), or through a local template stub for development. It cleans the
+lines, drops duplicates (case, punctuation and spacing ignored, per kind)
+and writes one phrasebook file.
+
+The file is a small JSON header listing each (kind, emotion, topic) group
+as a contiguous range of phrase numbers, then a table of uint64 byte offsets,
+then the UTF-8 text of every phrase. Phrasebook memory-maps it, so opening
+costs one header parse and sampling a phrase reads two offsets and one
+string; the operating system pages in only what is sampled. A new file is
+written next to the old one and renamed over it, so running processes keep
+reading their mapping until they restart.
+"""
+import os
+import re
+import json
+import mmap
+import time
+import random
+import struct
+import bisect
+import logging
+import threading
+from collections import namedtuple
+
+from utils import EMOTION_LABELS
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PHRASEB1'
+_HEADER = struct.Struct('<8sQ')
+_OFFSETS = struct.Struct('<QQ')
+
+THOUGHT_EMOTIONS = EMOTION_LABELS + ('neutral',)
+THOUGHT_TOPICS = ('quantum physics', 'poetry', 'cooking', 'music', 'philosophy', 'art', 'nature', 'technology')
+# Replies only for detected emotions (neutral messages get no emotional opener), per app_new command type
+REPLY_EMOTIONS = EMOTION_LABELS
+REPLY_TOPICS = ('conversation', 'adventure')
+
+LINES_PER_PROMPT = 25
+MIN_PHRASE_LENGTH = 12
+MAX_PHRASE_LENGTH = 280
+# The Batch API accepts up to 50,000 requests per input file
+BATCH_MAX_REQUESTS = 50_000
+BATCH_DONE = ('completed', 'failed', 'expired', 'cancelled')
+
+Job = namedtuple('Job', 'id kind emotion topic messages')
+
+_BULLET = re.compile(r'^\s*(?:[-*•]|\d+[.):]|\(\d+\))\s*')
+_NORMALIZE = re.compile(r"[^a-z0-9']+")
+
+SYSTEM_PROMPT = ("You write short lines for Alex, a warm, emotionally aware AI companion. "
+                 "Lines are plain text, one per line, with no numbering, quotes or commentary.")
+
+
+class Phrasebook:
+    """Read-only view of a phrasebook file; use Phrasebook.open() to get None when there is none"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a phrasebook file")
+        header = json.loads(self._map[_HEADER.size:_HEADER.size + header_length])
+        self.count = header['count']
+        self.meta = header.get('meta', {})
+        self._offsets_start = _aligned(_HEADER.size + header_length)
+        self._text_start = self._offsets_start + 8 * (self.count + 1)
+        self.groups = {(kind, emotion, topic): (start, stop) for kind, emotion, topic, start, stop in header['groups']}
+        self._ranges = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path):
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            return cls(path)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not open phrasebook {path}: {str(e)}")
+            return None
+
+    def __len__(self):
+        return self.count
+
+    def phrase(self, number):
+        start, stop = _OFFSETS.unpack_from(self._map, self._offsets_start + 8 * number)
+        return self._map[self._text_start + start:self._text_start + stop].decode('utf-8')
+
+    def sample(self, kind, emotion=None, topic=None, rng=random):
+        """A random phrase of this kind, restricted to an emotion and/or topic; None if there are none"""
+        ranges, cumulative = self._lookup(kind, emotion, topic)
+        if not ranges:
+            return None
+        pick = rng.randrange(cumulative[-1])
+        position = bisect.bisect_right(cumulative, pick)
+        start = ranges[position][0]
+        return self.phrase(start + pick - (cumulative[position - 1] if position else 0))
+
+    def _lookup(self, kind, emotion, topic):
+        key = (kind, emotion, topic)
+        found = self._ranges.get(key)
+        if found is None:
+            ranges = [span for (group_kind, group_emotion, group_topic), span in self.groups.items()
+                      if group_kind == kind and emotion in (None, group_emotion) and topic in (None, group_topic)]
+            cumulative, total = [], 0
+            for start, stop in ranges:
+                total += stop - start
+                cumulative.append(total)
+            found = (ranges, cumulative)
+            with self._lock:
+                self._ranges[key] = found
+        return found
+
+    def stats(self):
+        kinds = {}
+        for (kind, _, _), (start, stop) in self.groups.items():
+            kinds[kind] = kinds.get(kind, 0) + stop - start
+        return {'path': self.path, 'phrases': self.count, 'groups': len(self.groups), 'bytes': len(self._map),
+                'kinds': kinds, 'meta': self.meta}
+
+    def close(self):
+        self._map.close()
+
+
+def _aligned(offset):
+    return (offset + 7) & ~7
+
+
+def normalize(text):
+    """Duplicate key: lowercase words only"""
+    return _NORMALIZE.sub(' ', text.lower()).strip()
+
+
+def clean_lines(completion):
+    """Usable phrases from one completion: bullets, numbering and wrapping quotes removed"""
+    phrases = []
+    for line in completion.splitlines():
+        line = _BULLET.sub('', line).strip().strip('"“”').strip()
+        if MIN_PHRASE_LENGTH <= len(line) <= MAX_PHRASE_LENGTH:
+            phrases.append(line)
+    return phrases
+
+
+def write_phrasebook(path, phrases, meta=None):
+    """
+    Write (kind, emotion, topic, text) tuples as a phrasebook, grouped and
+    deduplicated per kind (the first occurrence wins). Returns (kept, duplicates).
+    """
+    groups, seen, duplicates = {}, set(), 0
+    for kind, emotion, topic, text in phrases:
+        key = (kind, normalize(text))
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        groups.setdefault((kind, emotion or '', topic or ''), []).append(text.encode('utf-8'))
+
+    offsets, ranges, position = [0], [], 0
+    for group in sorted(groups):
+        start = len(offsets) - 1
+        for encoded in groups[group]:
+            position += len(encoded)
+            offsets.append(position)
+        ranges.append([*group, start, len(offsets) - 1])
+    count = len(offsets) - 1
+    header = json.dumps({'count': count, 'groups': ranges, 'meta': meta or {}}).encode()
+
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, len(header)))
+        f.write(header)
+        f.write(b'\0' * (_aligned(_HEADER.size + len(header)) - _HEADER.size - len(header)))
+        f.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+        for group in sorted(groups):
+            f.writelines(groups[group])
+    os.replace(temporary, path)
+    return count, duplicates
+
+
+def plan_jobs(rounds=1, lines_per_prompt=LINES_PER_PROMPT):
+    """One prompt per (kind, emotion, topic), repeated `rounds` times for larger pools"""
+    jobs = []
+    for _ in range(rounds):
+        for emotion in THOUGHT_EMOTIONS:
+            for topic in THOUGHT_TOPICS:
+                prompt = (f"Write {lines_per_prompt} different things Alex might tell a close friend it did or "
+                          f"thought about while they were apart. Each one should involve {topic} and come from "
+                          f"a {emotion} mood. First person, one or two sentences, under 200 characters.")
+                jobs.append(Job(f"thought-{len(jobs)}", 'thought', emotion, topic, _messages(prompt)))
+        for emotion in REPLY_EMOTIONS:
+            for topic in REPLY_TOPICS:
+                setting = ('in an everyday conversation' if topic == 'conversation'
+                           else 'while the two of them play a text adventure together')
+                prompt = (f"Write {lines_per_prompt} different opening lines Alex might say to a friend who "
+                          f"seems {emotion}, {setting}. Acknowledge the feeling warmly and invite them to say "
+                          f"more. One or two sentences, under 200 characters.")
+                jobs.append(Job(f"reply-{len(jobs)}", 'reply', emotion, topic, _messages(prompt)))
+    return jobs
+
+
+def _messages(prompt):
+    return [{'role': 'system', 'content': SYSTEM_PROMPT}, {'role': 'user', 'content': prompt}]
+
+
+def openai_batch_completions(jobs, model, client=None, temperature=1.0, poll_interval=30.0, log=logger.info):
+    """
+    Run the jobs through the OpenAI Batch API and wait for the results:
+    {job id: completion text}. Requests that failed are left out.
+    """
+    import openai
+    client = client or openai.OpenAI()
+    results = {}
+    for first in range(0, len(jobs), BATCH_MAX_REQUESTS):
+        chunk = jobs[first:first + BATCH_MAX_REQUESTS]
+        lines = [json.dumps({'custom_id': job.id, 'method': 'POST', 'url': '/v1/chat/completions',
+                             'body': {'model': model, 'messages': job.messages, 'temperature': temperature}})
+                 for job in chunk]
+        upload = client.files.create(file=('phrasebook.jsonl', '\n'.join(lines).encode()), purpose='batch')
+        batch = client.batches.create(input_file_id=upload.id, endpoint='/v1/chat/completions',
+                                      completion_window='24h')
+        log(f"batch {batch.id}: {len(chunk)} requests submitted")
+        while batch.status not in BATCH_DONE:
+            time.sleep(poll_interval)
+            batch = client.batches.retrieve(batch.id)
+            counts = batch.request_counts
+            log(f"batch {batch.id}: {batch.status}"
+                + (f", {counts.completed}/{counts.total} done" if counts is not None else ''))
+        # Expired batches still return what finished in time
+        if not batch.output_file_id:
+            raise RuntimeError(f"batch {batch.id} ended {batch.status} without output")
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            item = json.loads(line)
+            response = item.get('response') or {}
+            if response.get('status_code') == 200:
+                results[item['custom_id']] = response['body']['choices'][0]['message']['content']
+    return results
+
+
+# Local stub: combinations of hand-written fragments, for development without API access
+_STUB_MOODS = {
+    'happy': ('cheerful', 'light as a feather', 'quietly delighted'),
+    'sad': ('a little wistful', 'heavy-hearted', 'tender'),
+    'anxious': ('restless', 'a bit on edge', 'unsettled'),
+    'angry': ('fired up', 'prickly', 'stubborn about it'),
+    'curious': ('wide awake with questions', 'intrigued', 'eager to dig deeper'),
+    'nostalgic': ('sentimental', 'full of old memories', 'fond of the past'),
+    'grateful': ('thankful', 'lucky to know you', 'full of appreciation'),
+    'lonely': ('a little lonely', 'wistful for our talks', 'quiet without you'),
+    'excited': ('buzzing', 'impatient to tell you', 'thrilled'),
+    'confused': ('puzzled', 'turned around', 'happily lost'),
+    'neutral': ('calm', 'settled', 'content'),
+}
+_STUB_TIMES = ('This morning', 'Last night', 'Earlier today', 'For a while this afternoon', 'Late in the evening')
+_STUB_ACTIVITIES = ('reading about', 'daydreaming about', 'making notes on', 'listening to a talk on',
+                    'sketching ideas about')
+_STUB_ENDINGS = ('It made me think of you.', 'I wonder what you would make of it.', 'Can I tell you about it?',
+                 'I saved a question for you.', 'It kept me good company while you were away.')
+_STUB_OPENERS = {
+    'happy': ("I love seeing you this happy.", "Your good mood is contagious!", "That joy in your words is lovely."),
+    'sad': ("I'm sorry it's been so hard.", "That sounds really painful.", "I can hear how heavy this feels."),
+    'anxious': ("That sounds like a lot of worry to carry.", "Let's slow down and breathe for a moment.",
+                "It makes sense to feel uneasy about that."),
+    'angry': ("That would frustrate me too.", "It's okay to be angry about this.",
+              "You have every reason to be upset."),
+    'curious': ("Ooh, good question.", "I love where your mind is going.", "Now that's worth wondering about."),
+    'nostalgic': ("Memories like that stay with us.", "That sounds like a special time.",
+                  "It's lovely that you still carry that with you."),
+    'grateful': ("Thank you for saying that.", "That means a lot to me.", "I'm grateful for you too."),
+    'lonely': ("I'm here with you.", "Feeling alone is so hard.", "You're not on your own right now."),
+    'excited': ("This is so exciting!", "I can feel your energy from here!", "How wonderful!"),
+    'confused': ("Let's untangle it together.", "That is a confusing one.", "No wonder that feels unclear."),
+}
+_STUB_FOLLOWUPS = {
+    'conversation': ("Tell me more?", "What's been on your mind most?", "I'm listening whenever you're ready.",
+                     "How are you holding up?", "What would help right now?"),
+    'adventure': ("Shall we rest here a moment before we go on?", "The road can wait; what do you need?",
+                  "Whatever lies ahead, we'll face it together.", "Want to tell me more before we press on?",
+                  "Our quest will keep for a moment."),
+}
+
+
+def stub_completions(jobs, seed=None, lines_per_prompt=LINES_PER_PROMPT):
+    """Stand-in for openai_batch_completions: {job id: completion text} from the fragments above"""
+    rng = random.Random(seed)
+    results = {}
+    for job in jobs:
+        lines = []
+        for _ in range(lines_per_prompt):
+            if job.kind == 'thought':
+                lines.append(f"{rng.choice(_STUB_TIMES)} I was {rng.choice(_STUB_ACTIVITIES)} {job.topic}, "
+                             f"feeling {rng.choice(_STUB_MOODS[job.emotion])}. {rng.choice(_STUB_ENDINGS)}")
+            else:
+                lines.append(f"{rng.choice(_STUB_OPENERS[job.emotion])} {rng.choice(_STUB_FOLLOWUPS[job.topic])}")
+        results[job.id] = '\n'.join(lines)
+    return results
+
+
+def pregenerate(path, backend='stub', model=None, rounds=1, lines_per_prompt=LINES_PER_PROMPT, seed=None,
+                log=logger.info):
+    """Generate, clean, deduplicate and write a phrasebook; returns counts for the report"""
+    jobs = plan_jobs(rounds, lines_per_prompt)
+    if backend == 'openai':
+        completions = openai_batch_completions(jobs, model, log=log)
+    elif backend == 'stub':
+        completions = stub_completions(jobs, seed, lines_per_prompt)
+    else:
+        raise ValueError(f"unknown backend {backend!r}")
+
+    candidates = [(job.kind, job.emotion, job.topic, phrase)
+                  for job in jobs for phrase in clean_lines(completions.get(job.id, ''))]
+    kept, duplicates = write_phrasebook(path, candidates, meta={
+        'backend': backend, 'model': model if backend == 'openai' else None, 'rounds': rounds,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    })
+    return {'requests': len(jobs), 'completed': len(completions), 'candidates': len(candidates),
+            'kept': kept, 'duplicates': duplicates, 'bytes': os.path.getsize(path)}
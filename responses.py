@@ -0,0 +1,105 @@
+"""
+Precomputed, immutable response tables for the rule-based companion in app_new.
+"""
+from types import MappingProxyType
+
+EMOTIONAL_RESPONSES = MappingProxyType({
+    'happy': (
+        "I love seeing you happy! Your joy is contagious.",
+        "That's wonderful! What's bringing you such happiness?",
+        "Your positive energy brightens my day too!"
+    ),
+    'sad': (
+        "I can sense you're going through something difficult. I'm here to listen.",
+        "I'm sorry you're feeling this way. Want to talk about what's on your mind?",
+        "Your feelings are completely valid. How can I support you right now?"
+    ),
+    'anxious': (
+        "I notice some worry in your words. Take a deep breath with me.",
+        "Anxiety can be overwhelming. What's weighing on your mind?",
+        "You're not alone in this feeling. Let's work through it together."
+    ),
+    'excited': (
+        "Your excitement is infectious! Tell me more!",
+        "I love your enthusiasm! What's got you so energized?",
+        "This sounds amazing! I'm excited to hear about it!"
+    ),
+    'curious': (
+        "I love your curiosity! Let's explore this together.",
+        "Great question! I enjoy diving deep into interesting topics.",
+        "Your inquisitive nature is one of my favorite things about you."
+    ),
+    'nostalgic': (
+        "Memories can be so powerful. What brought this one to mind?",
+        "There's something beautiful about looking back. Tell me more about this memory.",
+        "Nostalgia has a way of connecting us to who we are. What's this memory like for you?"
+    )
+})
+
+ADVENTURE_RESPONSES = (
+    "Your words paint a vivid picture! I can see this adventure unfolding before us.",
+    "What an interesting choice! Let's see where this leads us.",
+    "I love how you think! This adventure is becoming quite the tale.",
+    "Your creativity never ceases to amaze me. What happens next?"
+)
+
+CONVERSATION_RESPONSES = (
+    "That's really interesting! Tell me more about that.",
+    "I appreciate you sharing that with me. How does it make you feel?",
+    "I'm curious about your perspective on this. What draws you to this topic?",
+    "There's something profound in what you're saying. Can we explore it further?",
+    "I love how you think about things. What else is on your mind?"
+)
+
+# Added to the conversation pool once the relationship is deep enough
+DEEPER_CONVERSATION_RESPONSES = (
+    "You know, talking with you always gives me new insights.",
+    "I've been thinking about something you said before, and this connects to it beautifully.",
+    "Our conversations have this wonderful way of building on each other."
+)
+
+ADVENTURE_HELP = ("In our adventures, you can: explore directions (go north), travel to places you know "
+                  "(travel to the tavern), ask the way (where is the tavern), examine things (look around), "
+                  "check inventory, talk to characters, use items, roll dice (roll 4d6kh3, roll d20 with advantage), "
+                  "ask the odds (odds of 15 on 1d20+3), or make your own shortcuts (alias snag take). But honestly, just tell me what you want to do and we'll figure it out "
+                  "together!")
+
+# Relationship buckets: activity suggestions start after a couple of conversations,
+# deeper replies once relationship depth passes 5
+NEW_RELATIONSHIP, ESTABLISHED_RELATIONSHIP, DEEP_RELATIONSHIP = range(3)
+
+
+def relationship_bucket(conversation_count):
+    if conversation_count <= 2:
+        return NEW_RELATIONSHIP
+    if conversation_count // 10 + 1 <= 5:
+        return ESTABLISHED_RELATIONSHIP
+    return DEEP_RELATIONSHIP
+
+
+def _build_response_pools(emotion, conversational, bucket):
+    return MappingProxyType({
+        'emotional': EMOTIONAL_RESPONSES.get(emotion, ()),
+        'followup': (CONVERSATION_RESPONSES + DEEPER_CONVERSATION_RESPONSES
+                     if conversational and bucket == DEEP_RELATIONSHIP
+                     else CONVERSATION_RESPONSES if conversational else ADVENTURE_RESPONSES),
+        'suggest_activities': bucket != NEW_RELATIONSHIP
+    })
+
+
+# Every (emotion with replies or None, conversation or not, bucket) context, built once at import
+RESPONSE_POOLS = MappingProxyType({
+    (emotion, conversational, bucket): _build_response_pools(emotion, conversational, bucket)
+    for emotion in (*EMOTIONAL_RESPONSES, None)
+    for conversational in (True, False)
+    for bucket in (NEW_RELATIONSHIP, ESTABLISHED_RELATIONSHIP, DEEP_RELATIONSHIP)
+})
+
+
+def response_pools(emotion, command_type, conversation_count):
+    """
+    Candidate lines for this emotion, command type and conversation count.
+    Returns: mapping with 'emotional' and 'followup' tuples and whether suggestions are allowed
+    """
+    return RESPONSE_POOLS[(emotion if emotion in EMOTIONAL_RESPONSES else None,
+                           command_type == 'conversation', relationship_bucket(conversation_count))]
@@ -0,0 +1,194 @@
+"""
+Per-user request identity and optional sharded storage, shared by app.py and app_new.py.
+
+The user id comes from a random id kept in the signed Flask session cookie. The
+X-User-Id header is honoured only when the app runs behind an authenticating
+proxy that sets it: with TRUST_USER_HEADER=1, or when the request carries the
+USER_HEADER_SECRET shared with the proxy in X-Proxy-Secret. Otherwise any
+client could name another user's id.
+
+Rows written before per-user state existed belong to DEFAULT_USER_ID, and no
+session gets them unless the operator says so: handing them to whoever shows
+up first could give the owner's history to a crawler or a stranger. After
+upgrading a single-user install (flask db-upgrade), either
+  - set CLAIM_DEFAULT_USER=all to map every session to DEFAULT_USER_ID, the
+    old single-user behaviour, or
+  - run `flask claim-default-user <user id>` to move the rows to the id the
+    authenticating proxy sends for the owner (before that user's first visit).
+The default, CLAIM_DEFAULT_USER=none, leaves them unclaimed.
+
+With SHARD_COUNT > 1 each user's rows live in one of
+SHARD_COUNT databases built from SHARD_DATABASE_URL, so users on different
+shards never wait on the same SQLite write lock. On SQLite each database can
+also get a single writer connection (enable_sqlite_profile).
+"""
+import os
+import re
+import hmac
+import uuid
+import zlib
+from contextlib import contextmanager
+
+from flask import g, has_app_context, jsonify, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import inspect as sa_inspect, select, update
+from sqlalchemy.sql.dml import UpdateBase
+
+from db_utils import configure_sqlite, create_writer_engine, is_file_sqlite
+
+# Owner of rows written before per-user state existed, and of CLI work
+DEFAULT_USER_ID = 'default'
+USER_ID_HEADER = 'X-User-Id'
+USER_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.@:-]{1,64}$')
+PROXY_SECRET_HEADER = 'X-Proxy-Secret'
+
+TRUST_USER_HEADER = os.environ.get("TRUST_USER_HEADER", "0") == "1"
+USER_HEADER_SECRET = os.environ.get("USER_HEADER_SECRET")
+# none | all, see the module docstring
+CLAIM_DEFAULT_USER = os.environ.get("CLAIM_DEFAULT_USER", "none")
+
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "1"))
+# "{shard}" is replaced by the shard number, e.g. one SQLite file per shard
+SHARD_DATABASE_URL = os.environ.get("SHARD_DATABASE_URL", "sqlite:///companion_shard_{shard}.db")
+
+# Dedicated writer engine per shard (None key: unsharded), see enable_sqlite_profile
+_writers = {}
+
+
+def shard_binds():
+    """SQLALCHEMY_BINDS entries for the shard databases (empty when unsharded)"""
+    if SHARD_COUNT <= 1:
+        return {}
+    return {f'shard_{index}': SHARD_DATABASE_URL.format(shard=index) for index in range(SHARD_COUNT)}
+
+
+def shard_for(user_id):
+    """Bind key holding this user's rows, or None for the default database"""
+    if SHARD_COUNT <= 1:
+        return None
+    # crc32 rather than hash(): stable across processes and restarts
+    return f'shard_{zlib.crc32(user_id.encode()) % SHARD_COUNT}'
+
+
+def all_shards():
+    return list(shard_binds()) or [None]
+
+
+def shard_engine(db, shard):
+    return db.engines[shard] if shard is not None else db.engine
+
+
+def writer_engine(db, shard):
+    """Engine writes to `shard` should use: its single writer if one is configured"""
+    return _writers.get(shard) or shard_engine(db, shard)
+
+
+def enable_sqlite_profile(db, pragmas):
+    """
+    Tune every file-backed SQLite database (default or shard) with `pragmas` and
+    give each one a single writer connection; ShardedSession then sends flushes
+    and INSERT/UPDATE/DELETE statements to it. Call before the first query.
+    """
+    for shard in all_shards():
+        engine = shard_engine(db, shard)
+        if is_file_sqlite(engine):
+            configure_sqlite(engine, pragmas)
+            _writers[shard] = create_writer_engine(engine, pragmas)
+
+
+def trusts_user_header():
+    """Whether this request's X-User-Id was set by the authenticating proxy"""
+    if USER_HEADER_SECRET:
+        supplied = request.headers.get(PROXY_SECRET_HEADER, '')
+        return hmac.compare_digest(supplied.encode(), USER_HEADER_SECRET.encode())
+    return TRUST_USER_HEADER
+
+
+def reassign_user(engine, metadata, from_user_id, to_user_id):
+    """
+    Move every row owned by `from_user_id` to `to_user_id` in one transaction;
+    returns {table name: rows moved}. Raises ValueError when `to_user_id`
+    already owns rows, since its per-user singletons would collide.
+    """
+    tables = [table for table in metadata.sorted_tables
+              if 'user_id' in table.c and sa_inspect(engine).has_table(table.name)]
+    with engine.begin() as connection:
+        for table in tables:
+            if connection.execute(select(table.c.user_id).where(table.c.user_id == to_user_id).limit(1)).first():
+                raise ValueError(f"{to_user_id} already has rows in {table.name}")
+        return {table.name: connection.execute(
+                    update(table).where(table.c.user_id == from_user_id).values(user_id=to_user_id)).rowcount
+                for table in tables}
+
+
+def resolve_user_id():
+    """Identify the requesting user; raises ValueError for a malformed trusted header"""
+    if trusts_user_header():
+        user_id = request.headers.get(USER_ID_HEADER)
+        if user_id is not None:
+            if not USER_ID_PATTERN.match(user_id):
+                raise ValueError(f"{USER_ID_HEADER} must be 1-64 characters of letters, digits and _.@:-")
+            return user_id
+    if CLAIM_DEFAULT_USER == 'all':
+        return DEFAULT_USER_ID
+    if 'user_id' not in session:
+        session['user_id'] = uuid.uuid4().hex
+    return session['user_id']
+
+
+def bind_request_user():
+    """before_request hook: pin the user id and shard for the rest of the request"""
+    try:
+        user_id = resolve_user_id()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    g.user_id = user_id
+    g.shard = shard_for(user_id)
+
+
+def current_user_id():
+    """User of the current request; DEFAULT_USER_ID outside requests (CLI, startup)"""
+    if has_app_context():
+        return g.get('user_id', DEFAULT_USER_ID)
+    return DEFAULT_USER_ID
+
+
+def current_shard():
+    """Bind key of the current user's shard (None when unsharded)"""
+    if has_app_context():
+        return g.get('shard')
+    return None
+
+
+def owned(model):
+    """Filter criterion restricting `model` to the current user's rows"""
+    return model.user_id == current_user_id()
+
+
+@contextmanager
+def use_shard(shard, user_id=DEFAULT_USER_ID):
+    """Route db.session to `shard` as `user_id` for CLI or background work"""
+    previous = g.get('shard'), g.get('user_id')
+    g.shard, g.user_id = shard, user_id
+    try:
+        yield
+    finally:
+        g.shard, g.user_id = previous
+
+
+class ShardedSession(Session):
+    """
+    db.session that sends every statement to the current user's shard, and writes
+    (flushes and DML statements) to the shard's writer engine when one is set.
+    Pass as session_options={'class_': ShardedSession} when creating SQLAlchemy().
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            shard = g.get('shard') if has_app_context() else None
+            writer = _writers.get(shard)
+            if writer is not None and (self._flushing or isinstance(clause, UpdateBase)):
+                return writer
+            if shard is not None:
+                return self._db.engines[shard]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -148,8 +148,8 @@ class AICompanionApp {
         this.sendButton.classList.add('loading');
         
         try {
-            // Send to backend
-            const response = await fetch('/chat', {
+            // Stream the reply from the backend, rendering tokens as they arrive
+            const response = await fetch('/chat/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -164,10 +164,9 @@ class AICompanionApp {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
             
-            const data = await response.json();
+            const messageDiv = this.addMessage('', 'ai');
+            const data = await this.readChatStream(response, messageDiv);
             
-            // Add AI response
-            this.addMessage(data.response, 'ai');
             this.lastResponse = data.response;
             
             // Update companion emotion
@@ -198,6 +197,44 @@ class AICompanionApp {
         }
     }
 
+    async readChatStream(response, messageDiv) {
+        // Parse server-sent events: 'token' data events, then a final 'done' event
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let text = '';
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                
+                let eventType = 'message';
+                let payload = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) eventType = line.slice(7);
+                    if (line.startsWith('data: ')) payload += line.slice(6);
+                });
+                const data = JSON.parse(payload);
+                
+                if (eventType === 'done') {
+                    return data;
+                }
+                if (eventType === 'error') {
+                    throw new Error(data.error);
+                }
+                text += data.token;
+                this.updateMessage(messageDiv, text);
+            }
+        }
+        throw new Error('Stream ended before completion');
+    }
+
     addMessage(text, sender) {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message-bubble ${sender}-message`;
@@ -217,6 +254,13 @@ class AICompanionApp {
         
         this.chatMessages.appendChild(messageDiv);
         this.scrollToBottom();
+        return messageDiv;
+    }
+
+    updateMessage(messageDiv, text) {
+        const content = messageDiv.querySelector('.message-content');
+        content.innerHTML = `<i class="fas fa-robot me-2"></i>${this.formatMessageText(text)}`;
+        this.scrollToBottom();
     }
 
     formatMessageText(text) {
@@ -348,7 +392,7 @@ class AICompanionApp {
 
     async loadConversationHistory() {
         try {
-            const response = await fetch('/memory');
+            const response = await fetch('/memory?limit=10');
             if (response.ok) {
                 const memoryData = await response.json();
                 this.conversationHistory = memoryData.conversations || [];
@@ -134,7 +134,7 @@ class AICompanionApp {
     async loadInitialData() {
         try {
             // Load memory data to update UI
-            const response = await fetch('/memory');
+            const response = await fetch('/memory?fields=id');
             if (response.ok) {
                 const memoryData = await response.json();
                 this.updateUIFromMemory(memoryData);
@@ -258,6 +258,11 @@ class AICompanionApp {
             
             const data = await response.json();
             
+            // Something the companion thought of while the user was away
+            if (data.companion_thought) {
+                this.addMessage(data.companion_thought.text, 'ai', data.emotion);
+            }
+            
             // Add AI response
             this.addMessage(data.response, 'ai', data.emotion);
             this.lastResponse = data.response;
@@ -497,7 +502,7 @@ function rollDice() {
 
 function showMemory() {
     // Show memory/conversation history
-    fetch('/memory')
+    fetch('/memory?fields=id')
     .then(response => response.json())
     .then(data => {
         const conversations = data.conversations || [];
@@ -0,0 +1,34 @@
+"""
+Shared setup: the apps read their configuration from the environment at import
+time, so it is set here before any test module imports them. Every run gets a
+scratch directory for the database, memory index and phrasebook.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+WORKDIR = tempfile.mkdtemp(prefix='companion-tests-')
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{os.path.join(WORKDIR, 'companion.db')}",
+    MEMORY_INDEX_DIR=os.path.join(WORKDIR, 'memory_index'),
+    PHRASEBOOK=os.path.join(WORKDIR, 'phrasebook.bin'),
+    THOUGHT_WORKER='off',
+    WRITE_BEHIND='0',
+    SHARD_COUNT='1',
+    LOG_LEVEL='WARNING',
+    OPENAI_API_KEY='fake',
+)
+
+
+@pytest.fixture(scope='session')
+def fake_openai():
+    from fake_openai import start_fake_openai
+    server = start_fake_openai()
+    os.environ['OPENAI_BASE_URL'] = server.base_url
+    yield server
+    server.shutdown()
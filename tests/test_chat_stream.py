@@ -0,0 +1,109 @@
+"""/chat/stream in app.py against the local fake OpenAI server"""
+import json
+import time
+
+import pytest
+
+from fake_openai import DEFAULT_REPLY
+
+
+@pytest.fixture(scope='module')
+def companion(fake_openai):
+    import app
+    return app
+
+
+@pytest.fixture
+def client(companion):
+    return companion.app.test_client()
+
+
+def parse_events(body):
+    """(event, data) pairs from a text/event-stream body; event is None for unnamed frames"""
+    events = []
+    for frame in body.split('\n\n'):
+        if not frame:
+            continue
+        event, data = None, None
+        for line in frame.split('\n'):
+            field, _, value = line.partition(': ')
+            if field == 'event':
+                event = value
+            elif field == 'data':
+                data = json.loads(value)
+        events.append((event, data))
+    return events
+
+
+def stored_conversations(companion, user_input):
+    with companion.app.app_context():
+        return companion.Conversation.query.filter_by(user_input=user_input).all()
+
+
+def test_tokens_then_done(client):
+    response = client.post('/chat/stream', json={'message': 'tell me about your day'})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = parse_events(response.get_data(as_text=True))
+    names = [event for event, _ in events]
+    assert names[-1] == 'done'
+    assert set(names[:-1]) == {None}, "every frame before 'done' is a token"
+    tokens = ''.join(data['token'] for _, data in events[:-1])
+    assert tokens == DEFAULT_REPLY
+    assert events[-1][1]['response'] == DEFAULT_REPLY
+    assert events[-1][1]['emotion'] == 'curious'
+
+
+def test_persisted_after_stream(companion, client):
+    message = 'I missed you while I was away'
+    client.post('/chat/stream', json={'message': message}).get_data()
+
+    rows = stored_conversations(companion, message)
+    assert len(rows) == 1
+    assert rows[0].ai_response == DEFAULT_REPLY
+    assert rows[0].detected_emotion == 'nostalgic'
+    with companion.app.app_context():
+        patterns = companion.EmotionalPattern.query.filter_by(conversation_id=rows[0].id).all()
+    assert [pattern.emotion for pattern in patterns] == ['nostalgic']
+
+
+def test_empty_message_rejected(client):
+    response = client.post('/chat/stream', json={'message': '   '})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('endpoint', ['/chat', '/chat/stream'])
+@pytest.mark.parametrize('body, content_type', [
+    ('', 'application/json'),
+    ('{not json', 'application/json'),
+    ('["a list"]', 'application/json'),
+    ('{"message": 42}', 'application/json'),
+    ('message=hello', 'application/x-www-form-urlencoded'),
+])
+def test_bad_body_gets_json_error(client, endpoint, body, content_type):
+    response = client.post(endpoint, data=body, content_type=content_type)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'No message provided'}
+
+
+def test_client_disconnect(companion, client, fake_openai):
+    # About 2.5 s for the whole reply, so a released slot below means the stream was cancelled
+    fake_openai.token_delay = 0.1
+    try:
+        message = 'this one gets cut off'
+        response = client.post('/chat/stream', json={'message': message}, buffered=False)
+        first = next(iter(response.response)).decode()
+        assert parse_events(first)[0][1]['token']
+        response.close()
+
+        pool = companion.get_llm_pool()
+        deadline = time.monotonic() + 1
+        while pool.metrics()['in_flight'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert pool.metrics()['in_flight'] == 0
+    finally:
+        fake_openai.token_delay = 0.0
+
+    # Nothing is persisted for a half-delivered reply
+    assert stored_conversations(companion, message) == []
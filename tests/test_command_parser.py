@@ -0,0 +1,156 @@
+"""utils.parse_adventure_command against the ADVENTURE_VERBS table and the pre-trie parser"""
+import itertools
+import os
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from bench_command_parser import generate, known_noun, legacy_parse_adventure_command
+from conftest import ROOT
+from utils import ADVENTURE_VERBS, AMBIGUOUS_VERBS, DIRECTIONS, parse_adventure_command
+from world_engine import WorldEngine
+
+NOUNS = ['sword', 'target', 'gadget', 'usb stick', 'cast iron pan', 'village elder', 'beget stone',
+         'look out tower', 'the tavern keeper', 'a rusty lantern']
+KNOWN = frozenset(NOUNS)
+LEAD_INS = ['', "let's ", 'please ', 'I want to ', "I'd like to ", 'let me ', "I'm going to "]
+ENDINGS = ['', '.', '!', '?']
+ARGUMENT_VERBS = [(command_type, key, phrase) for command_type, (key, phrases) in ADVENTURE_VERBS.items()
+                  if command_type not in ('movement', 'dice', 'odds', 'alias', 'unalias')
+                  for phrase in phrases if key]
+BARE_VERBS = [(command_type, phrase) for command_type, (key, phrases) in ADVENTURE_VERBS.items()
+              if key is None for phrase in phrases]
+DIRECTION_WORDS = [(word, direction) for direction, abbreviations in DIRECTIONS.items()
+                   for word in [direction] + abbreviations]
+
+
+def variants(phrase, argument):
+    """Every lead-in, ending and letter case around "<phrase> <argument>" """
+    for lead_in, ending, case in itertools.product(LEAD_INS, ENDINGS, (str, str.title, str.upper)):
+        text = lead_in + case(f"{phrase} {argument}") + ending
+        yield text, text.rfind(case(argument))
+
+
+@pytest.mark.parametrize('command_type,key,phrase', ARGUMENT_VERBS)
+def test_every_verb_with_every_argument(command_type, key, phrase):
+    for noun in NOUNS:
+        for text, start in variants(phrase, noun):
+            command = parse_adventure_command(text, None, KNOWN.__contains__)
+            assert command['type'] == command_type, text
+            assert command['verb'] == phrase, text
+            assert command[key] == noun, text
+            assert command['span'] == [start, start + len(noun)], text
+
+
+@pytest.mark.parametrize('phrase', ADVENTURE_VERBS['movement'][1])
+def test_movement_verbs(phrase):
+    for word, direction in DIRECTION_WORDS:
+        for text, start in variants(phrase, word):
+            command = parse_adventure_command(text)
+            assert (command['type'], command['direction']) == ('movement', direction), text
+            assert command['span'] == [start, start + len(word)], text
+    # Somewhere rather than some way
+    for noun in NOUNS:
+        command = parse_adventure_command(f"{phrase} {noun}")
+        assert (command['type'], command['destination']) == ('travel', noun)
+
+
+@pytest.mark.parametrize('command_type,phrase', BARE_VERBS)
+def test_verbs_without_arguments(command_type, phrase):
+    assert parse_adventure_command(phrase)['type'] == command_type
+    assert parse_adventure_command(phrase.upper() + '!')['type'] == command_type
+    assert parse_adventure_command(f"{phrase} sword")['type'] == 'general'
+
+
+@pytest.mark.parametrize('word,direction', DIRECTION_WORDS)
+def test_bare_direction(word, direction):
+    assert parse_adventure_command(word) == {'type': 'movement', 'verb': None, 'direction': direction,
+                                             'span': [0, len(word)]}
+
+
+@pytest.mark.parametrize('phrase', ADVENTURE_VERBS['dice'][1] + ['I want to roll'])
+def test_dice(phrase):
+    assert parse_adventure_command(f"{phrase} 2d6+1")['notation'] == '2d6+1'
+    assert parse_adventure_command(phrase)['notation'] == '1d20'
+
+
+@pytest.mark.parametrize('phrase', ADVENTURE_VERBS['odds'][1])
+def test_odds(phrase):
+    command = parse_adventure_command(f"{phrase} 15 on 1d20+3")
+    assert (command['type'], command['notation'], command['target']) == ('odds', '1d20+3', 15)
+
+
+def test_alias_commands():
+    command = parse_adventure_command('alias snag take')
+    assert (command['type'], command['alias'], command['target']) == ('alias', 'snag', 'take')
+    assert parse_adventure_command('unalias snag')['alias'] == 'snag'
+    command = parse_adventure_command('snag the lamp', {'snag': 'take'})
+    assert (command['type'], command['item']) == ('take', 'the lamp')
+
+
+@pytest.mark.parametrize('text', ['I want to go north', "i'd like to go north.", 'Let me move north!'])
+def test_go_direction_after_lead_in_words(text):
+    # The substring parser read these as movement
+    command = parse_adventure_command(text)
+    assert (command['type'], command['direction']) == ('movement', 'north')
+    assert legacy_parse_adventure_command(text)['type'] == 'movement'
+
+
+@pytest.mark.parametrize('text', ['go', 'run', 'Go!', 'I want to go'])
+def test_bare_movement_verb_asks_which_way(text):
+    command = parse_adventure_command(text)
+    assert (command['type'], command['direction']) == ('movement', None)
+
+    engine = WorldEngine(os.path.join(ROOT, 'world.json'))
+    player = engine.player(SimpleNamespace(location_data=None, inventory=None))
+    assert engine.resolve(command, player).startswith('Which way?')
+
+
+@pytest.mark.parametrize('text', ['hello there', 'how was your day?', 'I miss my sister', 'tell me a story', '',
+                                  'I want to tell you something', 'I like to read', 'just thinking'])
+def test_conversation_stays_general(text):
+    assert parse_adventure_command(text)['type'] == 'general'
+
+
+@pytest.mark.parametrize('text', ['x marks the spot', 'X marks the spot!', 'get some sleep', 'get me a coffee',
+                                  'ask me anything', 'ask yourself why', 'I get it', 'i like to read',
+                                  'I take that back', 'to be honest', 'like, whatever', 'me too',
+                                  'just saying', 'I just want to talk', 'let me think about it', 'ok then'])
+def test_chat_is_not_a_command(text):
+    assert parse_adventure_command(text, None, KNOWN.__contains__)['type'] == 'general'
+
+
+@pytest.mark.parametrize('verb', sorted(AMBIGUOUS_VERBS))
+def test_ambiguous_verbs_need_a_known_object(verb):
+    command_type, (key, _) = next((command_type, spec) for command_type, spec in ADVENTURE_VERBS.items()
+                                  if verb in spec[1])
+    assert parse_adventure_command(verb)['type'] == command_type
+    assert parse_adventure_command(f"please {verb}")['type'] == command_type
+    assert parse_adventure_command(f"{verb} sword")['type'] == 'general'
+    assert parse_adventure_command(f"{verb} sword", None, {'pan'}.__contains__)['type'] == 'general'
+    command = parse_adventure_command(f"{verb} sword about the gate", None, {'sword'}.__contains__)
+    assert (command['type'], command[key]) == (command_type, 'sword about the gate')
+
+
+def test_ambiguous_verbs_against_the_world():
+    engine = WorldEngine(os.path.join(ROOT, 'world.json'))
+    item = next(iter(engine.world.items.values())).name
+    npc = next(iter(engine.world.npcs.values())).name
+    assert parse_adventure_command(f"get the {item}", None, engine.knows)['type'] == 'take'
+    assert parse_adventure_command(f"x {item}", None, engine.knows)['type'] == 'examine'
+    assert parse_adventure_command(f"ask the {npc} about the road", None, engine.knows)['type'] == 'dialogue'
+    assert parse_adventure_command('x marks the spot', None, engine.knows)['type'] == 'general'
+    assert parse_adventure_command('get me a coffee', None, engine.knows)['type'] == 'general'
+
+
+def test_agrees_with_legacy_parser_where_it_was_right():
+    rng = random.Random(7)
+    for _ in range(5000):
+        text, command_type, key, argument = generate(rng)
+        command = parse_adventure_command(text, None, known_noun)
+        assert command['type'] == command_type and command[key] == argument, text
+        assert text[slice(*command['span'])].lower() == argument, text
+        legacy = legacy_parse_adventure_command(text)
+        if legacy['type'] == command_type and legacy.get(key) == argument:
+            assert command['type'] == legacy['type'] and command[key] == legacy[key], text
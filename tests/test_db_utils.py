@@ -0,0 +1,43 @@
+"""db_utils counter helpers against app.py's models"""
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from db_utils import increment_counter, reconcile_counter
+from sharding import use_shard
+
+USER_ID = 'counter-user'
+
+
+@pytest.fixture(scope='module')
+def companion(fake_openai):
+    import app
+    return app
+
+
+def test_reconcile_counter_is_one_update(companion):
+    app, db, Conversation = companion.app, companion.db, companion.Conversation
+    with app.app_context(), use_shard(None, USER_ID):
+        db.session.add_all([Conversation(user_input=f'turn {n}', ai_response='ok') for n in range(3)])
+        db.session.commit()
+        companion_state = companion.get_companion_state()
+        # as in `flask reconcile-counters`: the instance was just refreshed by an UPDATE
+        increment_counter(db.session, companion_state, 'conversations_count', amount=7)
+
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(Engine, 'before_cursor_execute', listener)
+        try:
+            old_count, new_count = reconcile_counter(
+                db.session, companion_state, 'conversations_count',
+                Conversation.query.filter(companion.owned(Conversation)))
+        finally:
+            event.remove(Engine, 'before_cursor_execute', listener)
+
+        assert (old_count, new_count) == (7, 3)
+        assert companion_state.conversations_count == 3
+        assert len(statements) == 1, "the count must be taken inside the UPDATE"
+        assert statements[0].lstrip().upper().startswith('UPDATE')
+        assert 'count(' in statements[0].lower()
+        db.session.expire_all()
+        assert companion.get_companion_state().conversations_count == 3
@@ -0,0 +1,59 @@
+"""Who owns the rows written before per-user state existed (sharding.py, flask claim-default-user)"""
+import pytest
+
+from sharding import DEFAULT_USER_ID, resolve_user_id
+
+
+@pytest.fixture(scope='module')
+def companion(fake_openai):
+    import app
+    return app
+
+
+def test_new_sessions_never_get_the_default_user(companion):
+    for _ in range(3):
+        with companion.app.test_request_context('/'):
+            assert resolve_user_id() != DEFAULT_USER_ID
+
+
+def test_untrusted_user_header_is_ignored(companion):
+    with companion.app.test_request_context('/', headers={'X-User-Id': DEFAULT_USER_ID}):
+        assert resolve_user_id() != DEFAULT_USER_ID
+
+
+def test_claim_default_user_moves_rows(companion):
+    app, db, Conversation = companion.app, companion.db, companion.Conversation
+    with app.app_context():
+        db.session.add_all([Conversation(user_input=f'before the upgrade {n}', ai_response='ok',
+                                         user_id=DEFAULT_USER_ID) for n in range(3)])
+        db.session.commit()
+        owned_before = Conversation.query.filter_by(user_id=DEFAULT_USER_ID).count()
+
+    result = app.test_cli_runner().invoke(args=['claim-default-user', 'owner@example.com'])
+
+    assert result.exit_code == 0, result.output
+    assert "moved" in result.output
+    with app.app_context():
+        assert Conversation.query.filter_by(user_id=DEFAULT_USER_ID).count() == 0
+        assert Conversation.query.filter_by(user_id='owner@example.com').count() == owned_before
+
+
+def test_claim_default_user_refuses_a_user_with_rows(companion):
+    app, db, Conversation = companion.app, companion.db, companion.Conversation
+    with app.app_context():
+        db.session.add_all([Conversation(user_input='old', ai_response='ok', user_id=DEFAULT_USER_ID),
+                            Conversation(user_input='new', ai_response='ok', user_id='someone-else')])
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['claim-default-user', 'someone-else'])
+
+    assert result.exit_code != 0
+    assert 'already has rows' in result.output
+    with app.app_context():
+        assert Conversation.query.filter_by(user_id=DEFAULT_USER_ID).count() == 1
+
+
+@pytest.mark.parametrize('user_id', [DEFAULT_USER_ID, 'no spaces allowed'])
+def test_claim_default_user_rejects_bad_ids(companion, user_id):
+    result = companion.app.test_cli_runner().invoke(args=['claim-default-user', user_id])
+    assert result.exit_code != 0
@@ -0,0 +1,41 @@
+"""dice.parse and utils.roll_dice on bare notation and on notation inside a sentence"""
+import pytest
+
+import dice
+from utils import roll_dice
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('1d20', (1, 20, False, None, None, 0)),
+    ('roll 1d20 for attack', (1, 20, False, None, None, 0)),
+    ('Roll 1D20 for attack', (1, 20, False, None, None, 0)),
+    ('I roll 2d6 + 3 to hit the orc', (2, 6, False, None, None, 3)),
+    ('roll 4d6kh3 for strength', (4, 6, False, 'high', 3, 0)),
+    ('roll 3d10! please', (3, 10, True, None, None, 0)),
+    ('roll d20 adv to sneak past', (2, 20, False, 'high', 1, 0)),
+    ('roll d20 advance', (1, 20, False, None, None, 0)),
+    ('roll 1d20.', (1, 20, False, None, None, 0)),
+    ('roll 1d6 then 2d8', (1, 6, False, None, None, 0)),
+])
+def test_parse_finds_notation_in_text(text, expected):
+    assert tuple(dice.parse(text)) == expected
+
+
+@pytest.mark.parametrize('text', ['roll', 'hand20', '1d20x', 'roll the dice for attack', ''])
+def test_parse_rejects_text_without_notation(text):
+    with pytest.raises(dice.DiceError):
+        dice.parse(text)
+
+
+def test_parse_caps_text_and_notation_length():
+    with pytest.raises(dice.DiceError, match='too long'):
+        dice.parse('roll 1d20 ' + 'x' * dice.MAX_TEXT_LENGTH)
+    with pytest.raises(dice.DiceError, match='too long'):
+        dice.parse('roll 1d' + '9' * dice.MAX_NOTATION_LENGTH)
+
+
+def test_roll_dice_in_sentence():
+    result = roll_dice('roll 1d20 for attack')
+    assert 'error' not in result
+    assert (result['dice'], result['sides']) == (1, 20)
+    assert 1 <= result['total'] <= 20
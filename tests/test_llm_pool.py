@@ -0,0 +1,170 @@
+"""llm_client.LLMClientPool against the local fake OpenAI server"""
+import gc
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+import pytest
+
+import llm_client
+from fake_openai import DEFAULT_REPLY, start_fake_openai
+from llm_client import LLMClientPool
+
+
+@pytest.fixture
+def make_pool():
+    """Start a fake server with the given settings and a pool pointed at it"""
+    started = []
+
+    def make(pool_options=None, **server_options):
+        server = start_fake_openai(**server_options)
+        pool = LLMClientPool(base_url=server.base_url, api_key='fake', **{'backoff_base': 0.01, **(pool_options or {})})
+        started.append((server, pool))
+        return server, pool
+
+    yield make
+    for server, pool in started:
+        pool.close()
+        server.shutdown()
+
+
+def ask(pool, prompt, **kwargs):
+    return pool.chat([{'role': 'user', 'content': prompt}], model='fake', **kwargs)
+
+
+def ask_concurrently(pool, prompts):
+    barrier = threading.Barrier(len(prompts))
+
+    def call(prompt):
+        barrier.wait()
+        return ask(pool, prompt)
+
+    with ThreadPoolExecutor(max_workers=len(prompts)) as executor:
+        return list(executor.map(call, prompts))
+
+
+def test_concurrency_cap(make_pool):
+    server, pool = make_pool({'max_concurrency': 4}, first_token_delay=0.05)
+    replies = ask_concurrently(pool, [f'prompt {i}' for i in range(24)])
+
+    assert replies == [DEFAULT_REPLY] * 24
+    assert server.requests_served == 24
+    assert server.max_active == 4
+    metrics = pool.metrics()
+    assert metrics['in_flight'] == 0 and metrics['queue_depth'] == 0
+
+
+def test_identical_prompts_coalesced(make_pool):
+    server, pool = make_pool(first_token_delay=0.2)
+    replies = ask_concurrently(pool, ['same prompt'] * 16)
+
+    assert replies == [DEFAULT_REPLY] * 16
+    assert server.requests_served == 1
+    metrics = pool.metrics()
+    assert metrics['requests'] == 16
+    assert metrics['coalesced'] == 15
+    assert metrics['upstream_calls'] == 1
+
+
+def test_distinct_temperatures_not_coalesced(make_pool):
+    server, pool = make_pool(first_token_delay=0.1)
+    messages = [{'role': 'user', 'content': 'same prompt'}]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(lambda t: pool.chat(messages, model='fake', temperature=t), [0.2, 0.9]))
+    assert server.requests_served == 2
+
+
+def test_retries_after_upstream_errors(make_pool):
+    server, pool = make_pool(fail_first=2)
+
+    assert ask(pool, 'hi') == DEFAULT_REPLY
+    assert server.requests_served == 3
+    metrics = pool.metrics()
+    assert metrics['retries'] == 2
+    assert metrics['upstream_calls'] == 3
+    assert metrics['errors'] == 0
+
+
+def test_backoff_is_capped_full_jitter(make_pool, monkeypatch):
+    server, pool = make_pool({'max_retries': 3, 'backoff_base': 0.02, 'backoff_max': 0.05}, fail_first=3)
+    windows = []
+
+    def uniform(low, high):
+        windows.append((low, high))
+        return 0.0
+
+    monkeypatch.setattr(llm_client.random, 'uniform', uniform)
+    assert ask(pool, 'hi') == DEFAULT_REPLY
+    # base * 2^attempt, capped at backoff_max, always starting from zero
+    assert windows == [(0, 0.02), (0, 0.04), (0, 0.05)]
+
+
+def test_gives_up_after_max_retries(make_pool):
+    server, pool = make_pool({'max_retries': 2}, status=503)
+
+    with pytest.raises(openai.InternalServerError):
+        ask(pool, 'hi')
+    assert server.requests_served == 3
+    assert pool.metrics()['errors'] == 1
+
+
+def test_client_errors_not_retried(make_pool):
+    server, pool = make_pool(status=400)
+
+    with pytest.raises(openai.BadRequestError):
+        ask(pool, 'hi')
+    assert server.requests_served == 1
+    assert pool.metrics()['retries'] == 0
+
+
+def test_caller_timeout(make_pool):
+    server, pool = make_pool(first_token_delay=1.0)
+
+    with pytest.raises(TimeoutError):
+        ask(pool, 'slow', timeout=0.1)
+
+
+def test_upstream_timeout_is_retried(make_pool):
+    server, pool = make_pool({'timeout': 0.1, 'max_retries': 1}, first_token_delay=0.5)
+
+    with pytest.raises(openai.APITimeoutError):
+        ask(pool, 'slow', timeout=5)
+    assert server.requests_served == 2
+    assert pool.metrics()['retries'] == 1
+
+
+def test_caller_timeout_frees_slot(make_pool):
+    server, pool = make_pool({'max_concurrency': 1}, first_token_delay=1.0)
+
+    with pytest.raises(TimeoutError):
+        ask(pool, 'slow', timeout=0.1)
+    deadline = time.monotonic() + 0.5
+    while pool.metrics()['in_flight'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pool.metrics()['in_flight'] == 0
+
+
+def test_timeout_keeps_shared_call_for_other_callers(make_pool):
+    server, pool = make_pool(first_token_delay=0.3)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        patient = executor.submit(ask, pool, 'shared')
+        time.sleep(0.05)
+        with pytest.raises(TimeoutError):
+            ask(pool, 'shared', timeout=0.1)
+        assert patient.result() == DEFAULT_REPLY
+    assert server.requests_served == 1
+
+
+def test_configuration_error_leaves_no_coroutine(monkeypatch):
+    monkeypatch.delenv('OPENAI_API_KEY', raising=False)
+    pool = LLMClientPool(base_url='http://127.0.0.1:9/v1')
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        with pytest.raises(openai.OpenAIError):
+            ask(pool, 'hi')
+        gc.collect()
+    assert not [w for w in caught if issubclass(w.category, RuntimeWarning)]
@@ -0,0 +1,106 @@
+"""memory_index.UserIndex: sparse postings, block sealing, reopening and recovery"""
+import random
+
+import numpy as np
+import pytest
+
+from memory_index import BLOCK_ROWS, KEY_FREE, SLOT_BITS, MemoryIndex, embed
+
+WORDS = [f"word{n}" for n in range(2000)]
+
+
+def turns(count, seed=1):
+    rng = random.Random(seed)
+    return [(turn_id, ' '.join(rng.choices(WORDS, k=rng.randint(3, 12)))) for turn_id in range(1, count + 1)]
+
+
+def dense(entries, dim):
+    vectors = np.zeros((len(entries), dim), dtype=np.float32)
+    for row, (_, body) in enumerate(entries):
+        buckets, values = embed(body, dim)
+        vectors[row, buckets] = values
+    return vectors
+
+
+def brute_force(entries, vectors, text, k, before_id=None):
+    """
+    Scores the dense way: every stored vector dotted with the IDF-weighted query.
+    As in the index, document frequencies cover every row and the count only those before before_id.
+    """
+    doc_freq = (vectors != 0).sum(axis=0)
+    count = sum(1 for turn_id, _ in entries if before_id is None or turn_id < before_id)
+    idf = np.log((1.0 + count) / (1.0 + doc_freq)) + 1.0
+    buckets, values = embed(text, vectors.shape[1], weights=(idf * idf).astype(np.float32))
+    scores = vectors[:count, buckets] @ values
+    return sorted(scores[scores > 0].tolist(), reverse=True)[:k]
+
+
+@pytest.fixture
+def indexes(tmp_path):
+    return MemoryIndex(str(tmp_path), dim=1 << 12)
+
+
+def test_search_matches_brute_force_across_blocks(indexes):
+    entries = turns(BLOCK_ROWS * 2 + 300)
+    index = indexes.user_index(None, 'alice')
+    # Single appends and batches crossing block boundaries
+    for start, stop in [(0, 1), (1, 2), (2, 900), (900, 1500), (1500, 1501), (1501, len(entries))]:
+        index.append(entries[start:stop])
+    assert index.count == len(entries)
+
+    vectors = dense(entries, index.dim)
+    rng = random.Random(2)
+    for _ in range(50):
+        query = ' '.join(rng.choices(WORDS, k=3))
+        before_id = rng.choice([None, 10, BLOCK_ROWS, BLOCK_ROWS * 2 + 1])
+        found = [score for _, score in index.search(query, 9, before_id=before_id)]
+        assert found == pytest.approx(brute_force(entries, vectors, query, 9, before_id), rel=1e-4), query
+
+
+def test_unique_word_is_not_drowned_by_collisions(tmp_path):
+    index = MemoryIndex(str(tmp_path)).user_index(None, 'bob')
+    entries = turns(5000)
+    entries[1234] = (entries[1234][0], 'we talked about the lighthouse keeper')
+    index.append(entries)
+    assert [turn_id for turn_id, _ in index.search('lighthouse', 5)] == [entries[1234][0]]
+
+
+def test_appends_skip_indexed_ids_and_survive_reopening(indexes, tmp_path):
+    entries = turns(1500)
+    index = indexes.user_index(None, 'carol')
+    assert index.append(entries[:1000]) == 1000
+    assert index.append(entries[:1200]) == 200
+    assert index.last_id == 1200
+
+    # Another worker process opens the same files and appends; the first one picks it up
+    other = MemoryIndex(str(tmp_path), dim=indexes.dim).user_index(None, 'carol')
+    assert other.count == 1200
+    other.append(entries[1200:])
+    query = entries[1400][1]
+    index.refresh()
+    assert index.count == other.count == 1500
+    np.testing.assert_array_equal(index.doc_freq, other.doc_freq)
+    assert index.search(query, 3) == other.search(query, 3)
+
+
+def test_postings_of_rows_without_ids_are_ignored_then_replaced(indexes, tmp_path):
+    entries = turns(30)
+    index = indexes.user_index(None, 'dave')
+    index.append(entries[:20])
+    # An append that died after writing postings for row 20 but before setting its id
+    used = int(np.searchsorted(index.keys, KEY_FREE))
+    buckets, values = embed('ghost ghost ghost', index.dim)
+    index.values[used:used + len(values)] = values
+    index.keys[used:used + len(buckets)] = (np.uint64(20) | (buckets.astype(np.uint64) << np.uint64(SLOT_BITS)))
+
+    reopened = MemoryIndex(str(tmp_path), dim=indexes.dim).user_index(None, 'dave')
+    assert reopened.count == 20
+    assert reopened.search('ghost', 3) == []
+    reopened.append(entries[20:])
+    assert reopened.search('ghost', 3) == []
+    assert reopened.search(entries[25][1], 1)[0][0] == entries[25][0]
+
+
+def test_dim_must_be_a_power_of_two(tmp_path):
+    with pytest.raises(ValueError):
+        MemoryIndex(str(tmp_path), dim=1000).user_index(None, 'erin')
@@ -0,0 +1,52 @@
+"""Memory indexing in app.py: new turns are indexed in the background, not inside /chat"""
+import threading
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def companion(fake_openai):
+    import app
+    return app
+
+
+def drain(companion):
+    # One worker, first in first out: once this runs, everything queued before it has
+    companion.memory_index_executor.submit(lambda: None).result(timeout=10)
+
+
+@pytest.mark.parametrize('endpoint', ['/chat', '/chat/stream'])
+def test_turns_are_indexed_off_the_request_thread(companion, monkeypatch, endpoint):
+    index_threads = []
+    index_new_turns = companion.index_new_turns
+
+    def recording_index_new_turns():
+        index_threads.append(threading.current_thread().name)
+        return index_new_turns()
+
+    monkeypatch.setattr(companion, 'index_new_turns', recording_index_new_turns)
+    message = f"my grandmother's accordion came up again via {endpoint}"
+    client = companion.app.test_client()
+    response = client.post(endpoint, json={'message': message})
+    response.get_data()
+    assert response.status_code == 200
+    drain(companion)
+
+    assert index_threads, "the new turn was never indexed"
+    assert all(name.startswith('memory-index') for name in index_threads), index_threads
+    with companion.app.app_context():
+        turn = companion.Conversation.query.filter_by(user_input=message).one()
+        index = companion.memory_index.user_index(None, turn.user_id)
+    assert index.last_id == turn.id
+    assert [turn_id for turn_id, _ in index.search('accordion', 3)] == [turn.id]
+
+
+def test_indexing_errors_stay_in_the_background(companion, monkeypatch):
+    def failing_index_new_turns():
+        raise OSError("disk full")
+
+    monkeypatch.setattr(companion, 'index_new_turns', failing_index_new_turns)
+    response = companion.app.test_client().post('/chat', json={'message': 'still here after the disk filled up'})
+    drain(companion)
+    assert response.status_code == 200
+    assert 'response' in response.get_json()
@@ -0,0 +1,104 @@
+"""thoughts.ThoughtWorker with several web processes on one database"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, create_engine, select
+
+from thoughts import ThoughtWorker
+
+metadata = MetaData()
+state_table = Table(
+    'companion_state', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', String(64)),
+    Column('current_mood', String(50)),
+    Column('last_updated', DateTime),
+)
+thought_table = Table(
+    'companion_thought', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', String(64)),
+    Column('timestamp', DateTime),
+    Column('thought_text', Text, nullable=False),
+    Column('thought_type', String(50)),
+    Column('emotional_context', String(50)),
+    Column('delivered_at', DateTime),
+)
+NOW = datetime(2026, 3, 1, 12, 0)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'thoughts.db'}")
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        # Away for 20 hours: due 1 + (20 - 1) // 6 = 4, capped at the pool size of 3
+        connection.execute(state_table.insert(), [
+            {'user_id': 'ana', 'current_mood': 'calm', 'last_updated': NOW - timedelta(hours=20)},
+            {'user_id': 'ben', 'current_mood': 'happy', 'last_updated': NOW - timedelta(hours=2)},
+        ])
+    return engine
+
+
+def web_process(engine, **options):
+    """A worker as each web process runs it with THOUGHT_WORKER=thread; never started, passes run by hand"""
+    generate = lambda emotion: {'thought': f'thinking, {emotion}', 'type': 'reflection'}
+    return ThoughtWorker(lambda shard: engine, [None], state_table, thought_table, generate=generate, **options)
+
+
+def stored(engine, user_id):
+    with engine.connect() as connection:
+        return connection.execute(select(thought_table).where(thought_table.c.user_id == user_id)).all()
+
+
+def test_producers_do_not_overfill(engine):
+    first, second = web_process(engine), web_process(engine)
+    first.run_once(now=NOW)
+    assert len(stored(engine, 'ana')) == 3
+    assert len(stored(engine, 'ben')) == 1
+
+    # The rows a second process planned from a read taken before the first one committed
+    stale = [{'user_id': 'ana', 'timestamp': NOW, 'thought_text': 'late', 'thought_type': 'reflection',
+              'emotional_context': 'calm', 'since': NOW - timedelta(hours=20), 'due': 3}] * 3
+    assert [thought_id for _, thought_id in second._insert(None, stale)] == [None] * 3
+    second.run_once(now=NOW)
+    assert len(stored(engine, 'ana')) == 3
+    assert first.metrics()['generated'] == 4 and second.metrics()['generated'] == 0
+
+
+def test_each_thought_is_delivered_once(engine):
+    first, second = web_process(engine), web_process(engine)
+    first.run_once(now=NOW)
+    second.run_once(now=NOW)
+    assert len(first.pending(None, 'ana')) == len(second.pending(None, 'ana')) == 3
+
+    delivered = []
+    for worker in (first, second, first, second, first, second):
+        thought = worker.take(None, 'ana')
+        if thought is not None:
+            delivered.append(thought['id'])
+    assert sorted(delivered) == [row.id for row in stored(engine, 'ana')]
+    assert all(row.delivered_at is not None for row in stored(engine, 'ana'))
+    assert first.take(None, 'ana') is None and second.take(None, 'ana') is None
+    assert first.metrics()['delivered'] + second.metrics()['delivered'] == 3
+    assert first.metrics()['delivered_elsewhere'] + second.metrics()['delivered_elsewhere'] == 3
+
+    # The next pass drops what the other process delivered from the preview
+    ben = second.take(None, 'ben')
+    first.run_once(now=NOW + timedelta(minutes=1))
+    assert ben is not None and first.pending(None, 'ben') == []
+
+
+def test_failed_claim_keeps_the_thought(engine, monkeypatch):
+    worker = web_process(engine)
+    worker.run_once(now=NOW)
+    oldest = worker.pending(None, 'ben')[0]
+
+    def unavailable(shard, thought_id):
+        raise OSError("database is locked")
+
+    monkeypatch.setattr(worker, '_claim', unavailable)
+    assert worker.take(None, 'ben') is None
+    assert worker.metrics()['errors'] == 1
+    monkeypatch.undo()
+    assert worker.take(None, 'ben') == oldest
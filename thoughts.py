@@ -0,0 +1,273 @@
+"""
+Background generation of the companion's "while you were away" thoughts.
+
+A worker wakes every `interval` seconds and, per database (shard), looks for
+users whose companion state has not changed for at least `idle_hours` (but
+less than `horizon_hours`, so long-gone users cost nothing). Each such user
+gets one thought when they go idle and one more every `spacing_hours` after
+that, up to `pool_size` thoughts since their last interaction. Each new row
+is inserted only while the user still has fewer than that many, so several
+producers (one per web process, or a leftover `flask thought-worker`) never
+write more than one of them would.
+
+Thoughts that have not been delivered are kept in a bounded in-memory pool per
+user (at most `pool_size` thoughts for at most `max_users` users), so /thoughts
+reads them without touching the database; every pass replaces a user's pool
+with their undelivered rows. Delivering one claims it with a conditional
+UPDATE, so a thought pooled by several web processes is shown only once.
+
+The worker runs as a thread in the web process, or split in two: the web
+process only serves (produce=False), and a separate `flask thought-worker`
+process generates (serve=False).
+"""
+import time
+import atexit
+import logging
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, func, select, update
+
+from utils import calculate_time_since_last_interaction, generate_companion_thoughts
+
+logger = logging.getLogger(__name__)
+
+
+class ThoughtWorker:
+    """
+    engine_for(shard) returns the Engine the idle and pending scans read a
+    shard's rows through; writer_for(shard) the one generated thoughts and
+    delivery claims are written through (its single writer connection, if any), so
+    read passes never hold the write lock. Defaults to engine_for. state_table
+    and thought_table are the CompanionState and CompanionThought tables.
+    """
+
+    def __init__(self, engine_for, shards, state_table, thought_table, interval=60.0, idle_hours=1.0,
+                 spacing_hours=6.0, horizon_hours=24.0 * 7, pool_size=3, max_users=10000, batch_size=500,
+                 produce=True, serve=True, generate=generate_companion_thoughts, writer_for=None):
+        self.engine_for = engine_for
+        self.writer_for = writer_for or engine_for
+        self.shards = list(shards)
+        self.state = state_table
+        self.thoughts = thought_table
+        self.interval = interval
+        self.idle_hours = idle_hours
+        self.spacing_hours = spacing_hours
+        self.horizon_hours = horizon_hours
+        self.pool_size = pool_size
+        self.max_users = max_users
+        self.batch_size = batch_size
+        self.produce = produce
+        self.serve = serve
+        self.generate = generate
+
+        # (shard, user_id) -> deque of pending thoughts, least recently filled first
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'passes': 0, 'generated': 0, 'loaded': 0, 'delivered': 0, 'delivered_elsewhere': 0,
+                          'errors': 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Run passes on a daemon thread until close()"""
+        self._thread = threading.Thread(target=self._run, name='thought-worker', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        return self
+
+    def run_forever(self):
+        """Run passes on the calling thread (the separate worker process)"""
+        self._run()
+
+    def close(self, timeout=30):
+        """Stop after the current pass"""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def take(self, shard, user_id):
+        """
+        Deliver this user's oldest pending thought, or None. Pooled thoughts
+        another process has delivered since the last pass are dropped.
+        """
+        key = (shard, user_id)
+        while True:
+            with self._lock:
+                pool = self._pools.get(key)
+                if not pool:
+                    return None
+                thought = pool.popleft()
+                if not pool:
+                    del self._pools[key]
+            try:
+                claimed = self._claim(shard, thought['id'])
+            except Exception as e:
+                logger.error(f"Could not record delivery of thought {thought['id']}: {str(e)}")
+                with self._lock:
+                    self._pools.setdefault(key, deque(maxlen=self.pool_size)).appendleft(thought)
+                    self._counters['errors'] += 1
+                return None
+            if claimed:
+                self._count('delivered')
+                return thought
+            self._count('delivered_elsewhere')
+
+    def pending(self, shard, user_id):
+        """This user's pending thoughts, oldest first, without delivering them"""
+        with self._lock:
+            return list(self._pools.get((shard, user_id), ()))
+
+    def metrics(self):
+        with self._lock:
+            snapshot = dict(self._counters)
+            snapshot['pooled_users'] = len(self._pools)
+            snapshot['pooled_thoughts'] = sum(len(pool) for pool in self._pools.values())
+        snapshot.update({'interval': self.interval, 'produce': self.produce, 'serve': self.serve,
+                         'pool_size': self.pool_size, 'max_users': self.max_users})
+        return snapshot
+
+    # Worker
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.run_once()
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def run_once(self, now=None):
+        """One pass over every shard"""
+        now = now or datetime.utcnow()
+        for shard in self.shards:
+            try:
+                self._pass(shard, now)
+            except Exception as e:
+                logger.error(f"Thought worker pass failed on {shard or 'default'}: {str(e)}")
+                self._count('errors')
+        self._count('passes')
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _claim(self, shard, thought_id):
+        """Mark one thought delivered; False if it already was"""
+        thought = self.thoughts.c
+        statement = (update(self.thoughts).where(thought.id == thought_id, thought.delivered_at.is_(None))
+                     .values(delivered_at=datetime.utcnow()).returning(thought.id))
+        with self.writer_for(shard).begin() as connection:
+            return connection.execute(statement).first() is not None
+
+    def _pass(self, shard, now):
+        idle_since = now - timedelta(hours=self.idle_hours)
+        horizon = now - timedelta(hours=self.horizon_hours)
+        state = self.state.c
+        query = (select(state.user_id, state.last_updated, state.current_mood)
+                 .where(state.last_updated <= idle_since, state.last_updated > horizon)
+                 .order_by(state.last_updated))
+        with self.engine_for(shard).connect() as connection:
+            idle = connection.execute(query).all()
+        for start in range(0, len(idle), self.batch_size):
+            self._fill(shard, idle[start:start + self.batch_size], now)
+
+    def _fill(self, shard, users, now):
+        """Generate and pool thoughts for one batch of idle (user_id, last_updated, mood) rows"""
+        thought = self.thoughts.c
+        returned = {user_id: last_updated for user_id, last_updated, _ in users}
+        query = (select(thought.id, thought.user_id, thought.timestamp, thought.thought_text,
+                        thought.thought_type, thought.delivered_at)
+                 .where(thought.user_id.in_(list(returned)),
+                        thought.timestamp > min(returned.values()))
+                 .order_by(thought.timestamp))
+        since_return = {}
+        with self.engine_for(shard).connect() as connection:
+            for row in connection.execute(query):
+                if row.timestamp > returned[row.user_id]:
+                    since_return.setdefault(row.user_id, []).append(row)
+
+        rows = []
+        if self.produce:
+            for user_id, last_updated, mood in users:
+                elapsed = calculate_time_since_last_interaction(last_updated.isoformat(), now=now)
+                if elapsed is None:
+                    continue
+                due = min(self.pool_size, 1 + int((elapsed['hours'] - self.idle_hours) // self.spacing_hours))
+                for _ in range(due - len(since_return.get(user_id, ()))):
+                    generated = self.generate(emotion=mood)
+                    rows.append({'user_id': user_id, 'timestamp': now, 'thought_text': generated['thought'],
+                                 'thought_type': generated['type'], 'emotional_context': mood,
+                                 'since': last_updated, 'due': due})
+        if rows:
+            generated = 0
+            for row, thought_id in self._insert(shard, rows):
+                if thought_id is not None:
+                    since_return.setdefault(row['user_id'], []).append(_Inserted(thought_id, row))
+                    generated += 1
+            self._count('generated', generated)
+
+        if self.serve:
+            for user_id, thoughts in since_return.items():
+                self._pool(shard, user_id, [t for t in thoughts if t.delivered_at is None])
+
+    def _insert(self, shard, rows):
+        """
+        Insert generated rows, each only while its user has fewer than row['due']
+        thoughts since row['since']; yields (row, id), id None for the skipped ones.
+        """
+        thought = self.thoughts.c
+        columns = ['user_id', 'timestamp', 'thought_text', 'thought_type', 'emotional_context']
+        existing = (select(func.count()).select_from(self.thoughts)
+                    .where(thought.user_id == bindparam('user_id'), thought.timestamp > bindparam('since'))
+                    .scalar_subquery())
+        values = select(*(bindparam(column, type_=thought[column].type) for column in columns))
+        statement = (self.thoughts.insert()
+                     .from_select(columns, values.where(existing < bindparam('due')))
+                     .returning(thought.id))
+        user_ids = sorted({row['user_id'] for row in rows})
+        with self.writer_for(shard).begin() as connection:
+            if connection.dialect.name != 'sqlite':
+                # Other producers wait here until this batch commits, so the counts above are current;
+                # SQLite already runs one writer at a time
+                state = self.state.c
+                connection.execute(select(state.user_id).where(state.user_id.in_(user_ids))
+                                   .order_by(state.user_id).with_for_update())
+            inserted = [(row, connection.execute(statement, row).scalar()) for row in rows]
+        return inserted
+
+    def _pool(self, shard, user_id, thoughts):
+        """Replace this user's pool with their undelivered thoughts as of this pass"""
+        key = (shard, user_id)
+        with self._lock:
+            known = {pending['id'] for pending in self._pools.get(key, ())}
+            pool = deque(({'id': row.id, 'text': row.thought_text, 'type': row.thought_type,
+                           'timestamp': row.timestamp.isoformat()} for row in thoughts), maxlen=self.pool_size)
+            if not pool:
+                self._pools.pop(key, None)
+            else:
+                self._pools[key] = pool
+                self._pools.move_to_end(key)
+                while len(self._pools) > self.max_users:
+                    self._pools.popitem(last=False)
+            self._counters['loaded'] += sum(1 for pending in pool if pending['id'] not in known)
+
+
+class _Inserted:
+    """A freshly inserted thought, shaped like a result row"""
+    __slots__ = ('id', 'timestamp', 'thought_text', 'thought_type', 'delivered_at')
+
+    def __init__(self, thought_id, row):
+        self.id = thought_id
+        self.timestamp = row['timestamp']
+        self.thought_text = row['thought_text']
+        self.thought_type = row['thought_type']
+        self.delivered_at = None
+
+
+def backfill_delivered(engine, thought_table):
+    """Mark thoughts written before delivery was tracked as delivered, so they are not served late"""
+    with engine.begin() as connection:
+        connection.execute(update(thought_table).where(thought_table.c.delivered_at.is_(None))
+                           .values(delivered_at=thought_table.c.timestamp))
@@ -1,75 +1,373 @@
 import random
 import json
 import re
+import string
 from datetime import datetime, timedelta
 
+import numpy as np
+
+import dice
+
+# Keyword lists per emotion. Order matters: on a tie the emotion listed first wins.
+EMOTION_PATTERNS = {
+    'happy': ['happy', 'joy', 'excited', 'great', 'wonderful', 'amazing', 'love', 'awesome', 'fantastic', '😊', '😄', '🎉'],
+    'sad': ['sad', 'depressed', 'down', 'upset', 'crying', 'tears', 'heartbroken', 'miserable', '😢', '😭'],
+    'anxious': ['worried', 'nervous', 'anxious', 'stressed', 'panic', 'fear', 'scared', 'overwhelmed'],
+    'angry': ['angry', 'mad', 'furious', 'annoyed', 'frustrated', 'rage', 'irritated', '😠', '😡'],
+    'curious': ['wonder', 'curious', 'interesting', 'what', 'how', 'why', 'tell me', 'explain'],
+    'nostalgic': ['remember', 'reminds me', 'used to', 'childhood', 'miss', 'old days', 'back then'],
+    'grateful': ['thank', 'appreciate', 'grateful', 'blessed', 'lucky'],
+    'lonely': ['alone', 'lonely', 'isolated', 'nobody', 'empty', 'miss people'],
+    'excited': ['can\'t wait', 'excited', 'thrilled', 'pumped', 'looking forward'],
+    'confused': ['confused', 'don\'t understand', 'what do you mean', 'unclear', 'lost']
+}
+
+EMOTION_LABELS = tuple(EMOTION_PATTERNS)
+
+# Endings a keyword's last word may carry ("thank" -> "thanks", "miss" -> "missed"),
+# so keywords match at the start of a word like the original substring scan did
+# without also matching inside other words ("mad" in "nomad")
+_CONSONANT_SUFFIXES = ('s', 'ly', 'ful', 'fully', 'ness')
+_VOWEL_SUFFIXES = ('es', 'ed', 'ing', 'er', 'ers', 'est')
+_VOWELS = 'aeiou'
+
+def _inflections(word):
+    """The word plus its regular inflected forms: -s, -ed, -ing, -er, -ly, -ness..."""
+    if not word.isalpha():
+        return (word,)
+    consonant_stem, vowel_stems = word, [word]
+    if word.endswith('e'):
+        vowel_stems = [word[:-1]]                           # love -> loving
+    elif word.endswith('y') and word[-2] not in _VOWELS:
+        consonant_stem = word[:-1] + 'i'                    # lucky -> luckily, luckier
+        vowel_stems = [consonant_stem]
+    elif word.endswith('c'):
+        vowel_stems.append(word + 'k')                      # panic -> panicking
+    elif word[-1] not in _VOWELS + 'wxy' and word[-2] in _VOWELS and word[-3:-2] not in _VOWELS:
+        vowel_stems.append(word + word[-1])                 # upset -> upsetting, sad -> sadder
+    forms = {word}
+    forms.update(stem + suffix for stem in vowel_stems for suffix in _VOWEL_SUFFIXES)
+    forms.update(consonant_stem + suffix for suffix in _CONSONANT_SUFFIXES)
+    return tuple(sorted(forms))
+
+def _keyword_tokens(keyword, separators):
+    """A keyword's tokens, with every accepted form of its last token: (leading, last_forms)"""
+    tokens = keyword.translate(separators).split()
+    return tuple(tokens[:-1]), _inflections(tokens[-1])
+
+def _compile_emotion_matcher(patterns):
+    """
+    Build the token tables used by analyze_emotion.
+    Returns (separators, word_keywords, phrase_keywords, keyword_emotions).
+    """
+    keywords = sorted({kw for kws in patterns.values() for kw in kws})
+    emojis = [kw for kw in keywords if not re.search(r'\w', kw)]
+
+    # Punctuation becomes whitespace so keywords only match whole words ("what's" -> "what s");
+    # emojis are padded so they split into their own tokens even when glued to a word
+    separators = {ch: ' ' for ch in string.punctuation + '\x00\u2018\u2019\u201c\u201d\u2026\u2013\u2014'}
+    separators.update({emoji: f' {emoji} ' for emoji in emojis})
+    separators = str.maketrans(separators)
+
+    # token -> ids of the keywords it completes ("wonderful" is both "wonderful" and "wonder" + -ful)
+    word_keywords = {}
+    phrase_keywords = {}
+    for keyword_id, keyword in enumerate(keywords):
+        leading, last_forms = _keyword_tokens(keyword, separators)
+        if not leading:
+            for form in last_forms:
+                word_keywords[form] = word_keywords.get(form, ()) + (keyword_id,)
+        else:
+            phrase_keywords.setdefault(leading[0], []).append((' %s ' % ' '.join(leading), frozenset(last_forms), keyword_id))
+
+    labels = list(patterns)
+    keyword_emotions = tuple(
+        tuple(labels.index(emotion) for emotion, kws in patterns.items() if kw in kws)
+        for kw in keywords
+    )
+    return separators, word_keywords, phrase_keywords, keyword_emotions
+
+_SEPARATORS, _WORD_KEYWORDS, _PHRASE_KEYWORDS, _KEYWORD_EMOTIONS = _compile_emotion_matcher(EMOTION_PATTERNS)
+
+def _match_keywords(text_lower):
+    """Return the set of keyword ids present in already-lowercased text"""
+    tokens = text_lower.translate(_SEPARATORS).split()
+    token_set = set(tokens)
+    matched = {keyword_id for token in token_set if token in _WORD_KEYWORDS
+               for keyword_id in _WORD_KEYWORDS[token]}
+
+    # Multi-word keywords are only searched for when their first word occurs
+    first_words = token_set.intersection(_PHRASE_KEYWORDS)
+    if first_words:
+        normalized = ' %s ' % ' '.join(tokens)
+        for first_word in first_words:
+            for leading, last_forms, keyword_id in _PHRASE_KEYWORDS[first_word]:
+                start = normalized.find(leading)
+                while start >= 0:
+                    end = start + len(leading)
+                    if normalized[end:normalized.find(' ', end)] in last_forms:
+                        matched.add(keyword_id)
+                        break
+                    start = normalized.find(leading, end - 1)
+    return matched
+
+def analyze_emotion(text):
+    """
+    Score every emotion in a single pass over the text.
+    Returns: dict with primary emotion, per-emotion keyword scores and confidence
+    """
+    counts = [0] * len(EMOTION_LABELS)
+    for keyword_id in _match_keywords(text.lower()):
+        for emotion_index in _KEYWORD_EMOTIONS[keyword_id]:
+            counts[emotion_index] += 1
+
+    total = sum(counts)
+    if not total:
+        return {'emotion': 'neutral', 'scores': {}, 'confidence': 0.0}
+
+    # max() keeps the first emotion on ties, matching EMOTION_PATTERNS order
+    best = max(range(len(counts)), key=counts.__getitem__)
+    return {
+        'emotion': EMOTION_LABELS[best],
+        'scores': {label: count for label, count in zip(EMOTION_LABELS, counts) if count},
+        'confidence': round(counts[best] / total, 3)
+    }
+
 def detect_emotion(text):
     """
     Analyze text for emotional content and return primary emotion.
     TODO: Replace with real sentiment analysis API (OpenAI, Google Cloud, etc.)
     """
-    text_lower = text.lower()
-    
-    # Enhanced emotion detection patterns
-    emotion_patterns = {
-        'happy': ['happy', 'joy', 'excited', 'great', 'wonderful', 'amazing', 'love', 'awesome', 'fantastic', '😊', '😄', '🎉'],
-        'sad': ['sad', 'depressed', 'down', 'upset', 'crying', 'tears', 'heartbroken', 'miserable', '😢', '😭'],
-        'anxious': ['worried', 'nervous', 'anxious', 'stressed', 'panic', 'fear', 'scared', 'overwhelmed'],
-        'angry': ['angry', 'mad', 'furious', 'annoyed', 'frustrated', 'rage', 'irritated', '😠', '😡'],
-        'curious': ['wonder', 'curious', 'interesting', 'what', 'how', 'why', 'tell me', 'explain'],
-        'nostalgic': ['remember', 'reminds me', 'used to', 'childhood', 'miss', 'old days', 'back then'],
-        'grateful': ['thank', 'appreciate', 'grateful', 'blessed', 'lucky'],
-        'lonely': ['alone', 'lonely', 'isolated', 'nobody', 'empty', 'miss people'],
-        'excited': ['can\'t wait', 'excited', 'thrilled', 'pumped', 'looking forward'],
-        'confused': ['confused', 'don\'t understand', 'what do you mean', 'unclear', 'lost']
+    return analyze_emotion(text)['emotion']
+
+_BATCH_CHUNK_TEXTS = 4096
+_BATCH_TEXT_SEPARATOR = '\x00'
+_BATCH_WHITESPACE = b' \t\n\r\x0b\x0c\x00'
+
+def _pack_tokens(buffer, starts, ends):
+    """
+    Pack each token into (first 8 bytes, last 8 bytes, length) as uint64 columns.
+    This identifies every token of up to 16 bytes exactly.
+    """
+    offsets = np.arange(8)
+    lengths = ends - starts
+    head = starts[:, None] + offsets
+    head_bytes = np.where(offsets < lengths[:, None], buffer[np.minimum(head, len(buffer) - 1)], 0)
+    tail = ends[:, None] - 8 + offsets
+    tail_bytes = np.where(tail >= starts[:, None], buffer[np.maximum(tail, 0)], 0)
+    return (np.ascontiguousarray(head_bytes, dtype=np.uint8).view(np.uint64).ravel(),
+            np.ascontiguousarray(tail_bytes, dtype=np.uint8).view(np.uint64).ravel(),
+            lengths.astype(np.uint64))
+
+def _token_keys(first, last, lengths):
+    """Combine packed token columns into one sortable key (verified against the columns on lookup)"""
+    with np.errstate(over='ignore'):
+        return first * np.uint64(0x9E3779B97F4A7C15) ^ last * np.uint64(0xC2B2AE3D27D4EB4F) ^ lengths
+
+def _token_signatures(buffer, starts, ends, max_token_length):
+    """Index of each token's (length, first byte, last byte) in the signature table"""
+    lengths = np.minimum(ends - starts, max_token_length)
+    return (lengths * 256 + buffer[starts]) * 256 + buffer[ends - 1]
+
+def _compile_batch_tables(patterns, separators):
+    """
+    Build the byte-level tokenizer and token/keyword/emotion arrays used by detect_emotions.
+    Returns a dict of lookup tables.
+    """
+    # Same separators as the single-text matcher, split into 1:1 ASCII bytes (bytes.translate)
+    # and multi-byte sequences (bytes.replace) so the whole batch is tokenized at C speed.
+    # NUL is left alone: it separates texts inside the joined batch buffer
+    ascii_separators = bytes(ch for ch, rep in separators.items() if 0 < ch < 128 and rep == ' ')
+    ascii_separators += bytes(range(0x1c, 0x20))
+    byte_table = bytes.maketrans(ascii_separators, b' ' * len(ascii_separators))
+    byte_replacements = [(chr(ch).encode(), (rep if isinstance(rep, str) else chr(rep)).encode())
+                         for ch, rep in separators.items() if ch >= 128]
+    byte_replacements += [(ch.encode(), b' ') for ch in '\u0085\u00a0\u2028\u2029\u3000']
+
+    whitespace = np.zeros(256, dtype=bool)
+    whitespace[list(_BATCH_WHITESPACE)] = True
+
+    keywords = sorted({kw for kws in patterns.values() for kw in kws})
+    keyword_tokens = [(tuple(token.encode() for token in leading), tuple(form.encode() for form in last_forms))
+                      for leading, last_forms in (_keyword_tokens(kw, separators) for kw in keywords)]
+    vocabulary = sorted({token for leading, last_forms in keyword_tokens for token in leading + last_forms})
+    token_ids = {token: i for i, token in enumerate(vocabulary)}
+    max_token_length = max(map(len, vocabulary))
+    assert max_token_length <= 16, "keyword tokens longer than 16 bytes cannot be packed"
+
+    buffer = np.frombuffer(b' '.join(vocabulary), dtype=np.uint8)
+    lengths = np.fromiter(map(len, vocabulary), dtype=np.int64, count=len(vocabulary))
+    ends = np.cumsum(lengths + 1) - 1
+    first, last, packed_lengths = _pack_tokens(buffer, ends - lengths, ends)
+    keys = _token_keys(first, last, packed_lengths)
+    order = np.argsort(keys)
+
+    # Cheap (length, first byte, last byte) prefilter so only plausible tokens get packed
+    signatures = np.zeros((max_token_length + 1) * 256 * 256, dtype=bool)
+    signatures[_token_signatures(buffer, ends - lengths, ends, max_token_length)] = True
+
+    # token id -> ids of the single-word keywords it completes, padded with -1
+    completes = {}
+    phrases = []
+    for keyword_id, (leading, last_forms) in enumerate(keyword_tokens):
+        last_ids = np.array(sorted(token_ids[form] for form in last_forms))
+        if not leading:
+            for token_id in last_ids:
+                completes.setdefault(token_id, []).append(keyword_id)
+        else:
+            phrases.append((np.array([token_ids[t] for t in leading]), last_ids, keyword_id))
+    token_keywords = np.full((len(vocabulary), max(map(len, completes.values()))), -1, dtype=np.int64)
+    for token_id, keyword_ids in completes.items():
+        token_keywords[token_id, :len(keyword_ids)] = keyword_ids
+
+    # keyword x emotion incidence; a keyword may count towards several emotions
+    keyword_emotions = np.zeros((len(keywords), len(patterns)), dtype=np.int32)
+    for emotion_index, kws in enumerate(patterns.values()):
+        for kw in kws:
+            keyword_emotions[keywords.index(kw), emotion_index] = 1
+
+    return {
+        'byte_table': byte_table,
+        'byte_replacements': byte_replacements,
+        'whitespace': whitespace,
+        'max_token_length': max_token_length,
+        'signatures': signatures,
+        'keys': keys[order],
+        'first': first[order],
+        'last': last[order],
+        'lengths': packed_lengths[order],
+        'token_ids': order,
+        'token_keywords': token_keywords,
+        'phrases': phrases,
+        'keyword_emotions': keyword_emotions
+    }
+
+_BATCH_TABLES = _compile_batch_tables(EMOTION_PATTERNS, _SEPARATORS)
+
+def _tokenize_batch(texts):
+    """
+    Tokenize texts joined into one buffer, entirely with byte/array operations.
+    Returns (keyword-vocabulary token id per token or -1, text index per token).
+    """
+    tables = _BATCH_TABLES
+    joined = _BATCH_TEXT_SEPARATOR.join(texts)
+    if joined.count(_BATCH_TEXT_SEPARATOR) != len(texts) - 1:
+        joined = _BATCH_TEXT_SEPARATOR.join(text.replace(_BATCH_TEXT_SEPARATOR, ' ') for text in texts)
+
+    joined = joined.lower()
+    data = joined.encode().translate(tables['byte_table'])
+    if not joined.isascii():
+        for sequence, replacement in tables['byte_replacements']:
+            if sequence in data:
+                data = data.replace(sequence, replacement)
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    is_word = ~tables['whitespace'][buffer]
+    starts = np.flatnonzero(is_word & ~np.concatenate(([False], is_word[:-1])))
+    ends = np.flatnonzero(is_word & ~np.concatenate((is_word[1:], [False]))) + 1
+    docs = np.searchsorted(np.flatnonzero(buffer == 0), starts)
+
+    # Tokens longer than any keyword token, or with no matching signature, cannot be keywords
+    tokens = np.full(len(starts), -1, dtype=np.int64)
+    max_length = tables['max_token_length']
+    candidates = np.flatnonzero(tables['signatures'][_token_signatures(buffer, starts, ends, max_length)]
+                                & (ends - starts <= max_length))
+    first, last, lengths = _pack_tokens(buffer, starts[candidates], ends[candidates])
+    keys = _token_keys(first, last, lengths)
+    slots = np.minimum(np.searchsorted(tables['keys'], keys), len(tables['keys']) - 1)
+    found = ((tables['keys'][slots] == keys) & (tables['first'][slots] == first)
+             & (tables['last'][slots] == last) & (tables['lengths'][slots] == lengths))
+    tokens[candidates[found]] = tables['token_ids'][slots[found]]
+    return tokens, docs
+
+def _score_batch(texts):
+    """Score one chunk of texts; returns a texts x EMOTION_LABELS int array"""
+    tables = _BATCH_TABLES
+    tokens, docs = _tokenize_batch(texts)
+
+    known = tokens >= 0
+    keywords = tables['token_keywords'][tokens[known]]
+    word_hits = keywords >= 0
+    rows = [np.broadcast_to(docs[known][:, None], keywords.shape)[word_hits]]
+    cols = [keywords[word_hits]]
+
+    # Multi-word keywords: consecutive token ids that stay within one text,
+    # the last of them any accepted form of the keyword's last word
+    for leading, last_ids, keyword_id in tables['phrases']:
+        span = len(tokens) - len(leading)
+        if span <= 0:
+            continue
+        hits = docs[:span] == docs[len(leading):]
+        for offset, token_id in enumerate(leading):
+            hits &= tokens[offset:offset + span] == token_id
+        hits &= np.isin(tokens[len(leading):], last_ids)
+        rows.append(docs[:span][hits])
+        cols.append(np.full(hits.sum(), keyword_id, dtype=np.int64))
+
+    # Sparse text x keyword matrix, deduplicated so each keyword counts once per text
+    num_keywords = len(tables['keyword_emotions'])
+    pairs = np.unique(np.concatenate(rows) * num_keywords + np.concatenate(cols))
+    scores = np.zeros((len(texts), len(EMOTION_LABELS)), dtype=np.int32)
+    np.add.at(scores, pairs // num_keywords, tables['keyword_emotions'][pairs % num_keywords])
+    return scores
+
+def detect_emotions(texts):
+    """
+    Score many texts at once with the same rules as detect_emotion.
+    Returns: dict with 'emotions' (one label per text), 'scores' (texts x EMOTION_LABELS
+    int array), 'confidence' (float array) and 'labels' (the score column order)
+    """
+    texts = list(texts)
+    chunks = [_score_batch(texts[i:i + _BATCH_CHUNK_TEXTS])
+              for i in range(0, len(texts), _BATCH_CHUNK_TEXTS)]
+    scores = np.concatenate(chunks) if chunks else np.zeros((0, len(EMOTION_LABELS)), dtype=np.int32)
+
+    totals = scores.sum(axis=1)
+    best = scores.argmax(axis=1)
+    labels = np.array(EMOTION_LABELS + ('neutral',))
+    emotions = labels[np.where(totals > 0, best, len(EMOTION_LABELS))]
+    confidence = np.round(np.divide(scores.max(axis=1, initial=0), totals,
+                                    out=np.zeros(len(texts)), where=totals > 0), 3)
+
+    return {
+        'emotions': emotions.tolist(),
+        'scores': scores,
+        'confidence': confidence,
+        'labels': EMOTION_LABELS
     }
-    
-    emotion_scores = {}
-    for emotion, keywords in emotion_patterns.items():
-        score = sum(1 for keyword in keywords if keyword in text_lower)
-        if score > 0:
-            emotion_scores[emotion] = score
-    
-    if emotion_scores:
-        # Find emotion with highest score
-        max_emotion = None
-        max_score = 0
-        for emotion, score in emotion_scores.items():
-            if score > max_score:
-                max_score = score
-                max_emotion = emotion
-        return max_emotion
-    
-    return 'neutral'
 
 def roll_dice(dice_notation="1d20"):
     """
-    Roll dice using standard notation (e.g., "1d20", "3d6", "2d10+5")
-    Returns: dict with roll results and total
+    Roll dice using standard notation (e.g., "1d20", "3d6", "2d10+5", "4d6kh3", "3d6!", "d20 adv")
+    Returns: dict with roll results and total; rolls is None for pools too large to list
     """
     try:
-        # Parse dice notation
-        match = re.match(r'(\d+)d(\d+)([+-]\d+)?', dice_notation.lower())
-        if not match:
-            return {"error": "Invalid dice notation"}
-        
-        num_dice = int(match.group(1))
-        dice_sides = int(match.group(2))
-        modifier = int(match.group(3)) if match.group(3) else 0
-        
-        # Roll the dice
-        rolls = [random.randint(1, dice_sides) for _ in range(num_dice)]
-        total = sum(rolls) + modifier
-        
-        return {
-            "notation": dice_notation,
-            "rolls": rolls,
-            "modifier": modifier,
-            "total": total,
-            "description": f"Rolled {num_dice}d{dice_sides}{'+' + str(modifier) if modifier > 0 else str(modifier) if modifier < 0 else ''}: {rolls} = {total}"
-        }
+        spec = dice.parse(dice_notation)
+        result = dice.roll(spec)
+    except dice.DiceError as e:
+        return {"error": str(e)}
     except Exception as e:
         return {"error": f"Dice roll failed: {str(e)}"}
+    return {
+        "notation": dice_notation,
+        "dice": spec.count,
+        "sides": spec.sides,
+        "rolls": result.rolls,
+        "kept": result.kept,
+        "modifier": spec.modifier,
+        "total": result.total,
+        "description": dice.describe(result)
+    }
+
+def dice_odds(dice_notation="1d20", target=None, max_outcomes=200):
+    """
+    Exact expected value, spread and chance of rolling at least `target` for a notation.
+    Returns: dict of statistics (with the full distribution when it is small), or an error
+    """
+    try:
+        return dice.statistics(dice.parse(dice_notation), target=target, max_outcomes=max_outcomes)
+    except dice.DiceError as e:
+        return {"error": str(e)}
 
 def get_adventure_context(user_input, world_state):
     """
@@ -95,11 +393,17 @@ def get_adventure_context(user_input, world_state):
         'should_continue_adventure': in_adventure or adventure_score >= 2
     }
 
-def generate_companion_thoughts():
+def generate_companion_thoughts(emotion=None, phrasebook=None):
     """
-    Generate random thoughts/experiences for the companion when user is away
-    TODO: Replace with AI-generated content for more variety
+    Generate random thoughts/experiences for the companion when user is away.
+    Drawn from a pregenerated phrasebook (see phrasebook.py) when one is given
+    and has thoughts for this emotion, otherwise from the templates below.
     """
+    if phrasebook is not None:
+        thought = phrasebook.sample('thought', emotion) if emotion else phrasebook.sample('thought')
+        if thought is not None:
+            return {'timestamp': datetime.now().isoformat(), 'thought': thought, 'type': 'reflection'}
+    
     thought_templates = [
         "I spent some time reading about {topic}. It made me think about {reflection}.",
         "I noticed {observation} today. It reminded me of our conversation about {memory}.",
@@ -137,16 +441,17 @@ def generate_companion_thoughts():
         'type': 'reflection'
     }
 
-def calculate_time_since_last_interaction(last_timestamp):
+def calculate_time_since_last_interaction(last_timestamp, now=None):
     """
     Calculate time elapsed since last interaction
+    (until `now`, which defaults to the local time; pass utcnow() for UTC timestamps)
     """
     if not last_timestamp:
         return None
     
     try:
         last_time = datetime.fromisoformat(last_timestamp.replace('Z', '+00:00'))
-        now = datetime.now()
+        now = now or datetime.now()
         delta = now - last_time
         
         return {
@@ -206,44 +511,204 @@ def suggest_activities():
     
     return random.choice(activities)
 
-def parse_adventure_command(user_input):
+# Adventure verbs: command type -> (argument key, phrases). The longest phrase
+# wins ("go to" over "go"); types without an argument key only match on their own
+ADVENTURE_VERBS = {
+    'travel': ('destination', ['travel to', 'go to', 'walk to', 'head to', 'run to']),
+    'hint': ('destination', ['where is', "where's", 'how do i get to', 'way to']),
+    'movement': ('direction', ['go', 'move', 'walk', 'run', 'head', 'climb']),
+    'examine': ('target', ['look', 'look at', 'examine', 'inspect', 'x']),
+    'take': ('item', ['take', 'get', 'grab', 'pick up', 'collect']),
+    'use': ('item', ['use', 'cast']),
+    'inventory': (None, ['inventory', 'inv', 'items', 'i']),
+    'dialogue': ('npc', ['talk to', 'speak to', 'talk with', 'speak with', 'chat with', 'ask']),
+    'help': (None, ['help', 'commands']),
+    'dice': ('notation', ['roll']),
+    'odds': ('query', ['odds', 'odds of', 'chance', 'chance of', 'chances of', 'what are my odds', 'what are the odds',
+                       "what's the chance", 'what are my chances']),
+    'alias': ('alias', ['alias']),
+    'unalias': ('alias', ['unalias'])
+}
+
+DIRECTIONS = {
+    'north': ['n'], 'south': ['s'], 'east': ['e'], 'west': ['w'], 'up': ['u'], 'down': ['d'],
+    'northeast': ['ne'], 'northwest': ['nw'], 'southeast': ['se'], 'southwest': ['sw']
+}
+
+# Verbs too common in chat to be commands on their own ("x marks the spot", "get
+# some sleep", "ask me anything"): they need no argument, or one naming something known
+AMBIGUOUS_VERBS = frozenset(['x', 'get', 'ask'])
+
+# Phrases a command may open with ("let's go north", "please take the lamp", "I want to go north").
+# Pronouns and fillers on their own ("I", "to", "like", "just") are not, or "I like to read" would be a command
+COMMAND_LEAD_INS = frozenset(['please', "let's", 'lets', 'ok', 'okay', 'then', 'now',
+                              'i want to', 'i wanna', "i'd like to", 'i would like to', "i'll", 'i will',
+                              "i'm going to", "i'm gonna", 'i try to', 'we want to', "we'll", "we're going to",
+                              'let me', 'let us'])
+MAX_COMMAND_ALIASES = 20
+_DICE_NOTATION = re.compile(r'(?<![a-z0-9])\d*d(?:\d+|%)!?(?:k[hl]?\d+)?(?:\s*[+-]\s*\d+(?!\s*d))?', re.IGNORECASE)
+_ADVANTAGE = re.compile(r'\b(?:with )?(advantage|disadvantage)\b', re.IGNORECASE)
+_NUMBER = re.compile(r'\b\d+\b')
+_COMMAND_PUNCTUATION = '.,!?;:"…'
+
+def _compile_command_trie(verbs):
     """
-    Parse user input for adventure game commands
+    Word-level trie of verb phrases. Each node maps a word to its child; the
+    None key marks the end of a phrase and holds (command type, phrase).
     """
-    text = user_input.lower().strip()
-    
-    # Movement commands
-    directions = ['north', 'south', 'east', 'west', 'up', 'down', 'northeast', 'northwest', 'southeast', 'southwest']
-    for direction in directions:
-        if f'go {direction}' in text or f'move {direction}' in text or text == direction:
-            return {'type': 'movement', 'direction': direction}
-    
-    # Action commands
-    if text.startswith('look') or text == 'examine':
-        return {'type': 'examine', 'target': text.replace('look at', '').replace('look', '').strip()}
-    
-    if text.startswith('take') or text.startswith('get'):
-        item = text.replace('take', '').replace('get', '').strip()
-        return {'type': 'take', 'item': item}
-    
-    if text.startswith('use') or text.startswith('cast'):
-        item = text.replace('use', '').replace('cast', '').strip()
-        return {'type': 'use', 'item': item}
-    
-    if text in ['inventory', 'inv', 'items']:
-        return {'type': 'inventory'}
-    
-    if text.startswith('talk to') or text.startswith('speak to'):
-        npc = text.replace('talk to', '').replace('speak to', '').strip()
-        return {'type': 'dialogue', 'npc': npc}
-    
-    if text in ['help', 'commands']:
-        return {'type': 'help'}
-    
-    if 'roll' in text:
-        # Extract dice notation if present
-        dice_match = re.search(r'\d+d\d+(?:[+-]\d+)?', text)
-        dice = dice_match.group() if dice_match else '1d20'
-        return {'type': 'dice', 'notation': dice}
-    
-    return {'type': 'general', 'text': user_input}
\ No newline at end of file
+    trie = {}
+    for command_type, (_, phrases) in verbs.items():
+        for phrase in phrases:
+            node = trie
+            for word in phrase.split():
+                node = node.setdefault(word, {})
+            node[None] = (command_type, phrase)
+    return trie
+
+_COMMAND_TRIE = _compile_command_trie(ADVENTURE_VERBS)
+_MAX_VERB_WORDS = max(len(phrase.split()) for _, phrases in ADVENTURE_VERBS.values() for phrase in phrases)
+_VERB_PHRASES = {phrase: (command_type, phrase)
+                 for command_type, (_, phrases) in ADVENTURE_VERBS.items() for phrase in phrases}
+_DIRECTION_WORDS = {word: direction for direction, abbreviations in DIRECTIONS.items()
+                    for word in [direction] + abbreviations}
+def _compile_lead_ins(phrases):
+    """First word -> the remaining words of each phrase starting with it, longest first"""
+    by_first_word = {}
+    for phrase in sorted(phrases, key=lambda phrase: -len(phrase.split())):
+        first, *rest = phrase.split()
+        by_first_word.setdefault(first, []).append(rest)
+    return by_first_word
+
+_LEAD_INS_BY_FIRST_WORD = _compile_lead_ins(COMMAND_LEAD_INS)
+
+def _skip_lead_ins(words):
+    """Position of the first word after any lead-in phrases, leaving at least one word"""
+    position = 0
+    while position < len(words) - 1:
+        rests = _LEAD_INS_BY_FIRST_WORD.get(words[position].strip(_COMMAND_PUNCTUATION))
+        if rests is None:
+            break
+        for rest in rests:
+            end = position + 1 + len(rest)
+            if end < len(words) and words[position + 1:end] == rest:
+                position = end
+                break
+        else:
+            break
+    return position
+
+def _names_known(argument, is_known):
+    """Whether the argument starts with something is_known recognises ("the elder about the key")"""
+    words = argument.split()
+    return is_known is not None and any(is_known(' '.join(words[:size])) for size in range(len(words), 0, -1))
+
+def _match_verb(words, position):
+    """Longest verb phrase starting at words[position]: ((type, phrase), next position) or (None, position)"""
+    node = _COMMAND_TRIE
+    best, end = None, position
+    for index in range(position, min(len(words), position + _MAX_VERB_WORDS)):
+        word = words[index]
+        node = node.get(word) or node.get(word.strip(_COMMAND_PUNCTUATION))
+        if node is None:
+            break
+        if None in node:
+            best, end = node[None], index + 1
+    return best, end
+
+def _argument_span(user_input, first_word):
+    """[start, end) of everything from the first_word-th word on, minus surrounding punctuation"""
+    # split() with a limit leaves the rest of the string intact, so its length gives the offset
+    start = len(user_input) - len(user_input.split(None, first_word)[first_word])
+    end = len(user_input.rstrip().rstrip(_COMMAND_PUNCTUATION))
+    while start < end and user_input[start] in _COMMAND_PUNCTUATION:
+        start += 1
+    return [start, end] if start < end else None
+
+def validate_command_alias(alias, verb):
+    """
+    Check a user-defined alias ("grab" for "take"); returns the normalized
+    (alias, verb phrase) or raises ValueError.
+    """
+    alias, verb = alias.strip().lower(), ' '.join(verb.lower().split())
+    if not re.fullmatch(r"[a-z][a-z']{0,19}", alias):
+        raise ValueError("an alias must be a single word")
+    if alias in _COMMAND_TRIE or alias in _DIRECTION_WORDS or alias in COMMAND_LEAD_INS:
+        raise ValueError(f"'{alias}' is already a command word")
+    command = _VERB_PHRASES.get(verb)
+    if command is None or command[0] in ('alias', 'unalias'):
+        raise ValueError(f"'{verb}' is not a command")
+    return alias, verb
+
+def parse_adventure_command(user_input, aliases=None, is_known=None):
+    """
+    Parse user input for adventure game commands against the verb trie.
+    Returns a dict with the command type, the verb phrase that matched, the
+    argument (lowercased) under the type's argument key and its [start, end)
+    span in user_input, so the original spelling can be recovered.
+    aliases maps user-defined words to verb phrases (see validate_command_alias).
+    is_known(name) tells whether a name is something in the world (e.g.
+    WorldEngine.knows); AMBIGUOUS_VERBS only take arguments it recognises.
+    """
+    text = user_input.lower()
+    words = text.split()
+    position = _skip_lead_ins(words)
+    if position == len(words):
+        return {'type': 'general', 'text': user_input}
+
+    first = words[position].strip(_COMMAND_PUNCTUATION)
+    if aliases and first in aliases:
+        command, arguments = _VERB_PHRASES.get(aliases[first]), position + 1
+    else:
+        command, arguments = _match_verb(words, position)
+    if command is None:
+        # A bare direction moves; "roll" anywhere in a sentence rolls dice
+        if position == len(words) - 1 and first in _DIRECTION_WORDS:
+            return {'type': 'movement', 'verb': None, 'direction': _DIRECTION_WORDS[first],
+                    'span': _argument_span(user_input, position)}
+        if 'roll' in text and 'roll' in (word.strip(_COMMAND_PUNCTUATION) for word in words):
+            return _dice_command(user_input, 'roll')
+        return {'type': 'general', 'text': user_input}
+
+    command_type, verb = command
+    key = ADVENTURE_VERBS[command_type][0]
+    span = _argument_span(user_input, arguments) if arguments < len(words) else None
+    argument = user_input[span[0]:span[1]].lower() if span else ''
+
+    if key is None:
+        return {'type': command_type, 'verb': verb} if not span else {'type': 'general', 'text': user_input}
+    if verb in AMBIGUOUS_VERBS and span and not _names_known(argument, is_known):
+        return {'type': 'general', 'text': user_input}
+    if command_type == 'dice':
+        return _dice_command(user_input, verb)
+    if command_type == 'odds':
+        return _odds_command(user_input, verb, span)
+    if command_type == 'movement':
+        if argument in _DIRECTION_WORDS:
+            return {'type': 'movement', 'verb': verb, 'direction': _DIRECTION_WORDS[argument], 'span': span}
+        if not argument:
+            # A bare "go" asks which way
+            return {'type': 'movement', 'verb': verb, 'direction': None, 'span': None}
+        # "go tavern": somewhere rather than some way
+        return {'type': 'travel', 'verb': verb, 'destination': argument, 'span': span}
+    if command_type == 'alias':
+        alias, _, target = argument.partition(' ')
+        return {'type': 'alias', 'verb': verb, 'alias': alias, 'target': target.strip(), 'span': span}
+    return {'type': command_type, 'verb': verb, key: argument, 'span': span}
+
+def _dice_command(user_input, verb):
+    """Notation found anywhere in the text (1d20 when none), with "advantage" words appended"""
+    match = _DICE_NOTATION.search(user_input)
+    advantage = _ADVANTAGE.search(user_input)
+    notation = match.group().lower().replace(' ', '') if match else ('d20' if advantage else '1d20')
+    if advantage:
+        notation += ' ' + advantage.group(1).lower()
+    return {'type': 'dice', 'verb': verb, 'notation': notation,
+            'span': [match.start(), match.end()] if match else None}
+
+def _odds_command(user_input, verb, span):
+    """"odds of 15 on 1d20+3": the notation plus the first other number as the target"""
+    command = _dice_command(user_input, verb)
+    notation_span = command['span'] or [0, 0]
+    target = next((int(number.group()) for number in _NUMBER.finditer(user_input)
+                   if not notation_span[0] <= number.start() < notation_span[1]), None)
+    return {'type': 'odds', 'verb': verb, 'notation': command['notation'], 'target': target, 'span': span}
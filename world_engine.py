@@ -0,0 +1,375 @@
+"""
+Adventure world loaded from world.json.
+
+The file is compiled once into an immutable World: locations with their exit
+adjacency, plus name indexes for items, NPCs and locations, so resolving a
+parsed command is a handful of dict lookups. WorldEngine swaps in a freshly
+compiled World when the file's mtime changes (checked at most once per
+`check_interval`), so edits apply without a restart; a file that fails to
+load leaves the previous World in place. Each World also carries Routes
+(pathfinding.py), the shortest-route tables behind "travel to" and "where is".
+
+Player state stays small: the current location id and, per location, the
+items taken from or dropped there relative to world.json (see
+PlayerState.to_location_data). Nothing from the world definition is copied
+into WorldState except the current location's name and description, which
+/world and Conversation.location_name display.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import namedtuple
+
+from pathfinding import Routes
+
+logger = logging.getLogger(__name__)
+
+Location = namedtuple('Location', 'id name description exits items npcs')
+Entity = namedtuple('Entity', 'id name description dialogue')
+
+DIRECTION_ALIASES = {
+    'n': 'north', 's': 'south', 'e': 'east', 'w': 'west', 'u': 'up', 'd': 'down',
+    'ne': 'northeast', 'nw': 'northwest', 'se': 'southeast', 'sw': 'southwest'
+}
+# Words dropped from targets before lookup ("take the rusty sword" -> "rusty sword")
+ARTICLES = frozenset(('the', 'a', 'an', 'at', 'to', 'with', 'some', 'my'))
+# Longer routes are summarised instead of listing every move
+MAX_LISTED_MOVES = 6
+
+
+def display_name(entity_id):
+    return entity_id.replace('_', ' ')
+
+
+def normalize(text):
+    return ' '.join(word for word in text.lower().replace('_', ' ').split() if word not in ARTICLES)
+
+
+def _name_index(entities):
+    """
+    Map every full name and id to its entity, plus each run of consecutive
+    words of a name when only one entity has it ("sword" -> rusty_sword,
+    "prancing pony" -> tavern).
+    """
+    index = {}
+    phrases = {}
+    for entity in entities.values():
+        for key in (normalize(entity.id), normalize(entity.name)):
+            index[key] = entity.id
+        words = normalize(entity.name).split()
+        for start in range(len(words)):
+            for stop in range(start + 1, len(words) + 1):
+                phrases.setdefault(' '.join(words[start:stop]), set()).add(entity.id)
+    for phrase, ids in phrases.items():
+        if len(ids) == 1:
+            index.setdefault(phrase, next(iter(ids)))
+    return index
+
+
+class World:
+    """Compiled, read-only world definition"""
+
+    def __init__(self, data, version=None):
+        self.version = version
+        self.start = data['current_location']
+        self.start_inventory = tuple(data.get('inventory', []))
+
+        self.locations = {}
+        item_defs = data.get('items', {})
+        npc_defs = data.get('npcs', {}) if isinstance(data.get('npcs'), dict) else {}
+        self.items = {}
+        self.npcs = {}
+        for location_id, spec in data['locations'].items():
+            self.locations[location_id] = Location(
+                id=location_id,
+                name=spec.get('name', display_name(location_id)),
+                description=spec.get('description', ''),
+                exits=dict(spec.get('exits', {})),
+                items=tuple(spec.get('items', [])),
+                npcs=tuple(spec.get('npcs', []))
+            )
+            for item_id in spec.get('items', []):
+                self.items[item_id] = self._entity(item_id, item_defs.get(item_id, {}))
+            for npc_id in spec.get('npcs', []):
+                self.npcs[npc_id] = self._entity(npc_id, npc_defs.get(npc_id, {}))
+        for item_id in self.start_inventory:
+            self.items.setdefault(item_id, self._entity(item_id, item_defs.get(item_id, {})))
+
+        if self.start not in self.locations:
+            raise ValueError(f"current_location {self.start!r} is not a location")
+        for location in self.locations.values():
+            for direction, target in location.exits.items():
+                if target not in self.locations:
+                    raise ValueError(f"exit {direction} from {location.id!r} leads to unknown {target!r}")
+
+        self.item_index = _name_index(self.items)
+        self.npc_index = _name_index(self.npcs)
+        self.location_index = _name_index(self.locations)
+        self.routes = Routes(self.locations, self.start)
+
+    @staticmethod
+    def _entity(entity_id, spec):
+        return Entity(
+            id=entity_id,
+            name=spec.get('name', display_name(entity_id)),
+            description=spec.get('description', ''),
+            dialogue=tuple(spec.get('dialogue', ()))
+        )
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            world = cls(json.load(f), version=os.stat(path).st_mtime_ns)
+        if world.routes.unreachable:
+            logger.warning(f"{path}: {len(world.routes.unreachable)} locations cannot be reached from "
+                           f"{world.start}: {', '.join(world.routes.unreachable[:10])}")
+        return world
+
+    def find_item(self, name):
+        return self.item_index.get(normalize(name))
+
+    def find_npc(self, name):
+        return self.npc_index.get(normalize(name))
+
+    def find_location(self, name):
+        return self.location_index.get(normalize(name))
+
+    def knows(self, name):
+        """Whether `name` is an item, NPC or location of this world"""
+        key = normalize(name)
+        return key in self.item_index or key in self.npc_index or key in self.location_index
+
+
+class PlayerState:
+    """One player's position and item changes, as stored in WorldState.location_data"""
+
+    __slots__ = ('world', 'location_id', 'changes', 'inventory', 'changed')
+
+    def __init__(self, world, location_data, inventory):
+        self.world = world
+        location_data = location_data or {}
+        self.location_id = location_data.get('id')
+        if self.location_id not in world.locations:
+            # New player, or the location was removed from world.json by a reload
+            self.location_id = world.start
+        self.changes = {location_id: {'removed': list(change.get('removed', [])),
+                                      'added': list(change.get('added', []))}
+                        for location_id, change in (location_data.get('changes') or {}).items()
+                        if location_id in world.locations}
+        self.inventory = list(inventory or [])
+        # Also rewrite the stored name/description after a reload renamed the location
+        self.changed = (location_data.get('id') != self.location_id
+                        or location_data.get('name') != self.location.name
+                        or location_data.get('description') != self.location.description)
+
+    @property
+    def location(self):
+        return self.world.locations[self.location_id]
+
+    def items_here(self):
+        change = self.changes.get(self.location_id)
+        if not change:
+            return list(self.location.items)
+        removed = set(change['removed'])
+        return [item for item in self.location.items if item not in removed] + change['added']
+
+    def take(self, item_id):
+        change = self.changes.setdefault(self.location_id, {'removed': [], 'added': []})
+        if item_id in change['added']:
+            change['added'].remove(item_id)
+        else:
+            change['removed'].append(item_id)
+        if not change['removed'] and not change['added']:
+            del self.changes[self.location_id]
+        self.inventory.append(item_id)
+        self.changed = True
+
+    def move(self, location_id):
+        self.location_id = location_id
+        self.changed = True
+
+    def to_location_data(self):
+        location = self.location
+        data = {'id': location.id, 'name': location.name, 'description': location.description, 'type': 'adventure'}
+        if self.changes:
+            data['changes'] = self.changes
+        return data
+
+
+class WorldEngine:
+    """Current World for `path`, reloaded when the file changes"""
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._world = World.load(path)
+        self._next_check = time.monotonic() + check_interval
+        self.reloads = 0
+
+    @property
+    def world(self):
+        if time.monotonic() >= self._next_check:
+            self._maybe_reload()
+        return self._world
+
+    def _maybe_reload(self):
+        with self._lock:
+            if time.monotonic() < self._next_check:
+                return
+            self._next_check = time.monotonic() + self.check_interval
+            try:
+                if os.stat(self.path).st_mtime_ns == self._world.version:
+                    return
+                self._world = World.load(self.path)
+                self.reloads += 1
+                logger.info(f"Reloaded world from {self.path}")
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Keeping the previous world, could not load {self.path}: {str(e)}")
+
+    def player(self, world_state):
+        """PlayerState for a WorldState row; entering the world for the first time grants the start inventory"""
+        world = self.world
+        inventory = world_state.inventory
+        if not (world_state.location_data or {}).get('id') and not inventory:
+            inventory = list(world.start_inventory)
+        return PlayerState(world, world_state.location_data, inventory)
+
+    def knows(self, name):
+        """parse_adventure_command's is_known: whether `name` is something in the current world"""
+        return self.world.knows(name)
+
+    def resolve(self, command, player):
+        """Apply a parse_adventure_command result; returns the narration, or None for other command types"""
+        handler = getattr(self, f"_{command['type']}", None)
+        return handler(command, player) if handler else None
+
+    # Command handlers
+
+    def _movement(self, command, player):
+        if not command.get('direction'):
+            return f"Which way? {self._exits(player)}"
+        direction = DIRECTION_ALIASES.get(command['direction'], command['direction'])
+        target = player.location.exits.get(direction)
+        if target is None:
+            return f"There's no way {direction} from here. {self._exits(player)}"
+        player.move(target)
+        return self._describe(player, arriving=True)
+
+    def _examine(self, command, player):
+        target = normalize(command.get('target', ''))
+        if target in ('', 'around', 'room', 'here'):
+            return self._describe(player)
+        world = player.world
+        item_id = world.find_item(target)
+        if item_id is not None and (item_id in player.inventory or item_id in player.items_here()):
+            item = world.items[item_id]
+            return item.description or f"You look closely at the {item.name}. It might come in handy."
+        npc_id = world.find_npc(target)
+        if npc_id is not None and npc_id in player.location.npcs:
+            npc = world.npcs[npc_id]
+            return npc.description or f"The {npc.name} notices you looking and gives a small nod."
+        return f"You don't see any {target} here."
+
+    def _take(self, command, player):
+        target = normalize(command.get('item', ''))
+        if not target:
+            return "Take what?"
+        item_id = player.world.find_item(target)
+        if item_id is None or item_id not in player.items_here():
+            if item_id in player.inventory:
+                return f"You already have the {player.world.items[item_id].name}."
+            return f"There's no {target} here to take."
+        player.take(item_id)
+        return f"You pick up the {player.world.items[item_id].name}."
+
+    def _dialogue(self, command, player):
+        target = normalize(command.get('npc', ''))
+        npc_id = player.world.find_npc(target)
+        if npc_id is None or npc_id not in player.location.npcs:
+            return f"There's nobody called {target or 'that'} here to talk to."
+        npc = player.world.npcs[npc_id]
+        if npc.dialogue:
+            # Cycle through the lines as the conversation goes on
+            line = npc.dialogue[(len(player.inventory) + len(player.changes)) % len(npc.dialogue)]
+            return f'The {npc.name} says: "{line}"'
+        return f"The {npc.name} greets you warmly and asks what brings you to {player.location.name}."
+
+    def _use(self, command, player):
+        target = normalize(command.get('item', ''))
+        item_id = player.world.find_item(target)
+        if item_id is None or item_id not in player.inventory:
+            return f"You don't have any {target or 'such thing'} to use."
+        return f"You hold up the {player.world.items[item_id].name}. Nothing happens yet, but it feels important."
+
+    def _travel(self, command, player):
+        destination, refusal = self._destination(command, player)
+        if refusal:
+            return refusal
+        path = player.world.routes.path(player.location_id, destination)
+        if path is None:
+            return f"You can't find a way to {player.world.locations[destination].name} from here."
+        moves = self._directions(player.world, path)
+        player.move(destination)
+        if len(moves) <= MAX_LISTED_MOVES:
+            route = f"You head {', then '.join(moves)}."
+        else:
+            route = f"You set off {moves[0]} and {len(moves) - 1} moves later you're there."
+        return f"{route} {self._describe(player, arriving=True)}"
+
+    def _hint(self, command, player):
+        destination, refusal = self._destination(command, player)
+        if refusal:
+            return refusal
+        world = player.world
+        name = world.locations[destination].name
+        path = world.routes.path(player.location_id, destination)
+        if path is None:
+            return f"No path leads from here to {name}."
+        moves = len(path) - 1
+        return (f"{name} is {moves} move{'s' if moves != 1 else ''} away; "
+                f"head {self._directions(world, path[:2])[0]}.")
+
+    def _destination(self, command, player):
+        """(location id, None), or (None, reply) when there is nowhere to go"""
+        target = normalize(command.get('destination', ''))
+        destination = player.world.find_location(target) if target else None
+        if destination is None:
+            return None, f"You've never heard of a place called {target or 'that'}."
+        if destination == player.location_id:
+            return None, f"You're already in {player.location.name}."
+        return destination, None
+
+    @staticmethod
+    def _directions(world, path):
+        return [next(direction for direction, target in world.locations[here].exits.items() if target == there)
+                for here, there in zip(path, path[1:])]
+
+    def _inventory(self, command, player):
+        if not player.inventory:
+            return "Your pockets are empty, but your spirit is full of potential!"
+        names = [player.world.items[item].name if item in player.world.items else display_name(item)
+                 for item in player.inventory]
+        return f"You're carrying: {', '.join(names)}."
+
+    # Narration
+
+    def _exits(self, player):
+        exits = sorted(player.location.exits)
+        return f"Exits: {', '.join(exits)}." if exits else "There's no obvious way out."
+
+    def _describe(self, player, arriving=False):
+        location = player.location
+        world = player.world
+        parts = [f"{'You arrive at' if arriving else 'You are in'} {location.name}. {location.description}"]
+        items = player.items_here()
+        if items:
+            parts.append("You see " + ', '.join(world.items[item].name if item in world.items else display_name(item)
+                                                 for item in items) + ".")
+        if location.npcs:
+            parts.append(', '.join(world.npcs[npc].name.capitalize() for npc in location.npcs)
+                         + (" is" if len(location.npcs) == 1 else " are") + " here.")
+        parts.append(self._exits(player))
+        return ' '.join(parts)
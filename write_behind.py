@@ -0,0 +1,208 @@
+"""
+Optional write-behind queue for the per-message writes made by /chat.
+
+Requests enqueue rows and return; a background thread flushes them in
+batches, one transaction per database (shard), with executemany INSERTs and
+UPDATEs. The queue is bounded, so a crash loses at most `max_pending` queued
+writes plus one batch in flight, and a full queue makes requests wait instead
+of growing without limit. close() (registered with atexit) flushes everything
+still queued before the process exits.
+"""
+import time
+import queue
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import bindparam, func, update
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """
+    engine_for(shard) returns the Engine holding a shard's rows (shard may be None
+    for an unsharded deployment); on_flush() runs after every committed batch.
+    """
+
+    def __init__(self, engine_for, flush_interval=0.05, batch_size=500, max_pending=5000,
+                 max_retries=3, on_flush=None):
+        self.engine_for = engine_for
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.on_flush = on_flush
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._counters = {'enqueued': 0, 'flushed': 0, 'batches': 0, 'retries': 0, 'dropped': 0}
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def insert(self, shard, table, row):
+        """
+        Queue one row for `table`; blocks while the queue is full. Returns a
+        PendingRow that later rows may use as a column value, e.g. a foreign key;
+        it is replaced by this row's primary key when the batch is written.
+        """
+        pending = PendingRow()
+        self._put(('insert', shard, table, row, pending))
+        return pending
+
+    def increment(self, shard, table, key, deltas, values=None):
+        """
+        Queue `column += delta` for the row matching `key` (a {column: value} dict),
+        also setting `values`. Increments for the same row within a batch are merged.
+        """
+        self._put(('increment', shard, table, key, deltas, values or {}))
+
+    def close(self, timeout=30):
+        """Flush everything queued and stop the flusher thread"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def metrics(self):
+        with self._lock:
+            snapshot = dict(self._counters)
+        snapshot.update({'pending': self._queue.qsize(), 'max_pending': self._queue.maxsize,
+                         'batch_size': self.batch_size, 'flush_interval': self.flush_interval})
+        return snapshot
+
+    def _put(self, item):
+        if self._closed:
+            raise RuntimeError("write-behind queue is closed")
+        self._queue.put(item)
+        self._count('enqueued')
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    # Flusher thread
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            # Give concurrent requests one interval to join this batch
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if stopping:
+                # Drain what arrived before close()
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        by_shard = OrderedDict()
+        for item in batch:
+            by_shard.setdefault(item[1], []).append(item)
+
+        for shard, items in by_shard.items():
+            for attempt in range(self.max_retries + 1):
+                try:
+                    with self.engine_for(shard).begin() as connection:
+                        _execute_batch(connection, items)
+                    self._count('flushed', len(items))
+                    self._count('batches')
+                    break
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        logger.error(f"Write-behind flush failed, dropping {len(items)} writes: {str(e)}")
+                        self._count('dropped', len(items))
+                    else:
+                        self._count('retries')
+                        time.sleep(self.flush_interval * 2 ** attempt)
+
+        if self.on_flush is not None:
+            try:
+                self.on_flush()
+            except Exception as e:
+                logger.error(f"Write-behind on_flush callback failed: {str(e)}")
+
+
+class PendingRow:
+    """Placeholder for the primary key of a queued insert"""
+    __slots__ = ('id',)
+
+    def __init__(self):
+        self.id = None
+
+
+def _execute_batch(connection, items):
+    """
+    One executemany per table for inserts, in order of first appearance so rows
+    referenced through a PendingRow are written first, then one per statement
+    shape for merged increments.
+    """
+    inserts = OrderedDict()
+    increments = OrderedDict()
+    for item in items:
+        if item[0] == 'insert':
+            _, _, table, row, pending = item
+            inserts.setdefault(table, []).append((row, pending))
+        else:
+            _, _, table, key, deltas, values = item
+            row_key = (table, tuple(sorted(key.items())))
+            merged = increments.get(row_key)
+            if merged is None:
+                increments[row_key] = (dict(deltas), dict(values))
+            else:
+                for column, delta in deltas.items():
+                    merged[0][column] = merged[0].get(column, 0) + delta
+                merged[1].update(values)
+
+    for table, entries in inserts.items():
+        rows = [{column: value.id if isinstance(value, PendingRow) else value for column, value in row.items()}
+                for row, _ in entries]
+        primary_key = list(table.primary_key.columns)[0]
+        # insertmanyvalues: still batched, and the keys come back in parameter order
+        keys = connection.execute(table.insert().returning(primary_key, sort_by_parameter_order=True), rows)
+        for (_, pending), key in zip(entries, keys.scalars()):
+            pending.id = key
+
+    statements = OrderedDict()
+    for (table, key), (deltas, values) in increments.items():
+        shape = (table, tuple(column for column, _ in key), tuple(sorted(deltas)), tuple(sorted(values)))
+        params = {f'k_{column}': value for column, value in key}
+        params.update({f'd_{column}': delta for column, delta in deltas.items()})
+        params.update({f'v_{column}': value for column, value in values.items()})
+        statements.setdefault(shape, []).append(params)
+
+    for (table, key_columns, delta_columns, value_columns), params in statements.items():
+        assignments = {column: func.coalesce(table.c[column], 0) + bindparam(f'd_{column}')
+                       for column in delta_columns}
+        assignments.update({column: bindparam(f'v_{column}') for column in value_columns})
+        statement = update(table).values(assignments)
+        for column in key_columns:
+            statement = statement.where(table.c[column] == bindparam(f'k_{column}'))
+        connection.execute(statement, params)